@@ -0,0 +1,73 @@
+import threading
+
+from admission import LatencyWindow
+
+DEFAULT_TIMEOUT_CONFIG = {
+    "adaptive": True,
+    "connect_timeout": 5,   # 建立连接的超时(秒),与读超时分开
+    "percentile": 0.99,     # 按该分位数的耗时计算读超时
+    "factor": 2.0,          # 读超时 = 分位数耗时 * factor
+    "min_timeout": 10,      # 自适应读超时下限(秒)
+    # 自适应读超时上限默认为该应用配置的timeout;单个应用可在dify配置中用min_timeout/max_timeout覆盖
+    "min_samples": 20,      # 样本不足时使用配置的timeout
+    "window": 200           # 每个应用保留的最近耗时样本数
+}
+
+
+class AdaptiveTimeouts:
+    """
+    按Dify应用统计最近的耗时分布,据此选择读超时
+    纯文本应用平时2秒返回,挂起时不必占用线程60秒;生成图片/视频的应用仍可使用较长的超时
+    """
+
+    def __init__(self, timeout_config=None):
+        self.config = {**DEFAULT_TIMEOUT_CONFIG, **(timeout_config or {})}
+        self._lock = threading.Lock()
+        self._windows = {}
+
+    def _window(self, app_name):
+        with self._lock:
+            window = self._windows.get(app_name)
+            if window is None:
+                window = self._windows[app_name] = LatencyWindow(self.config['window'])
+            return window
+
+    def record(self, app_name, seconds):
+        """
+        记录一次成功(或读超时)的耗时;超时按当时的超时值记录,分布会随之上移
+        """
+        self._window(app_name).record(seconds)
+
+    def connect_timeout(self, dify_config):
+        return float(dify_config.get('connect_timeout', self.config['connect_timeout']))
+
+    def read_timeout(self, app_name, dify_config):
+        """
+        返回: 该应用本次请求的读超时(秒)
+        """
+        configured = float(dify_config['timeout'])
+        if not self.config['adaptive']:
+            return configured
+
+        window = self._window(app_name)
+        if window.count() < int(self.config['min_samples']):
+            return configured
+
+        upper = float(dify_config.get('max_timeout', configured))
+        # 下限不能超过上限: 配置的timeout小于min_timeout时,以timeout为准
+        lower = min(float(dify_config.get('min_timeout', self.config['min_timeout'])), upper)
+        estimate = window.percentile(float(self.config['percentile'])) * float(self.config['factor'])
+        return max(lower, min(upper, estimate))
+
+    def stats(self):
+        with self._lock:
+            windows = dict(self._windows)
+        percentile = float(self.config['percentile'])
+        return {
+            app_name: {
+                "samples": window.count(),
+                "p50": round(window.percentile(0.5), 3),
+                f"p{int(percentile * 100)}": round(window.percentile(percentile), 3)
+            }
+            for app_name, window in windows.items()
+        }
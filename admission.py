@@ -0,0 +1,136 @@
+import logging
+import threading
+from collections import deque, defaultdict
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 准入决策
+ADMIT = 'admit'
+BUSY = 'busy'    # 不调用Dify,回复"繁忙"提示
+DROP = 'drop'    # 不调用Dify,静默丢弃(低优先级触发)
+
+DEFAULT_ADMISSION_CONFIG = {
+    "enabled": True,
+    "max_inflight": 32,
+    "max_inflight_per_group": 4,
+    "max_estimated_wait": 30,
+    "latency_window": 200,
+    "busy_reply": "当前请求较多,请稍后再试。",
+    "drop_low_priority": True
+}
+
+
+class LatencyWindow:
+    """
+    最近N次耗时的滑动窗口,用于估算分位数
+    """
+
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=max(1, int(size)))
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def percentile(self, p, default=0.0):
+        with self._lock:
+            if not self._samples:
+                return default
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class AdmissionController:
+    """
+    Dify调用前的准入控制
+    - 限制全局和单个群(会话)已接收但未完成的请求数
+    - 根据最近的Dify耗时估算排队等待时间,超出预算时拒绝
+    被拒绝的请求按优先级返回BUSY(回复繁忙提示)或DROP(静默丢弃)
+    """
+
+    def __init__(self, admission_config=None, concurrency=1):
+        admission_config = {**DEFAULT_ADMISSION_CONFIG, **(admission_config or {})}
+        self.enabled = admission_config['enabled']
+        self.max_inflight = max(1, int(admission_config['max_inflight']))
+        self.max_inflight_per_group = max(1, int(admission_config['max_inflight_per_group']))
+        self.max_estimated_wait = float(admission_config['max_estimated_wait'])
+        self.busy_reply = admission_config['busy_reply']
+        self.drop_low_priority = admission_config['drop_low_priority']
+        self.concurrency = max(1, int(concurrency))
+        self.latency = LatencyWindow(admission_config['latency_window'])
+
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._group_inflight = defaultdict(int)
+
+    def estimate_wait(self, pending):
+        """
+        估算新请求需要排队的时间(秒): 前面的请求按并发数分批,每批按p50耗时计
+        """
+        return (pending // self.concurrency) * self.latency.percentile(0.5)
+
+    def try_admit(self, group_wxid, low_priority=False):
+        """
+        尝试接收一个需要调用Dify的请求
+        返回: ADMIT / BUSY / DROP;返回ADMIT时调用方必须在完成后调用release
+        """
+        if not self.enabled:
+            return ADMIT
+
+        with self._lock:
+            if self._inflight >= self.max_inflight:
+                reason = 'total_cap'
+            elif self._group_inflight.get(group_wxid, 0) >= self.max_inflight_per_group:
+                reason = 'group_cap'
+            elif self.estimate_wait(self._inflight) > self.max_estimated_wait:
+                reason = 'wait_budget'
+            else:
+                self._inflight += 1
+                self._group_inflight[group_wxid] += 1
+                metrics.incr('admission.admitted')
+                return ADMIT
+
+        decision = DROP if (low_priority and self.drop_low_priority) else BUSY
+        metrics.incr(f'admission.shed.{decision}')
+        metrics.incr(f'admission.shed_reason.{reason}')
+        logger.warning("Admission rejected for %s: reason=%s, decision=%s", group_wxid, reason, decision)
+        return decision
+
+    def release(self, group_wxid):
+        """
+        已接收的请求完成(无论成功失败)
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._inflight = max(0, self._inflight - 1)
+            remaining = self._group_inflight[group_wxid] - 1
+            if remaining > 0:
+                self._group_inflight[group_wxid] = remaining
+            else:
+                self._group_inflight.pop(group_wxid, None)
+
+    def record_latency(self, seconds):
+        self.latency.record(seconds)
+
+    def stats(self):
+        with self._lock:
+            inflight = self._inflight
+            busiest = sorted(self._group_inflight.items(), key=lambda item: -item[1])[:10]
+        return {
+            "enabled": self.enabled,
+            "inflight": inflight,
+            "max_inflight": self.max_inflight,
+            "max_inflight_per_group": self.max_inflight_per_group,
+            "busiest_groups": dict(busiest),
+            "dify_latency_p50": round(self.latency.percentile(0.5), 3),
+            "dify_latency_p95": round(self.latency.percentile(0.95), 3),
+            "estimated_wait": round(self.estimate_wait(inflight), 3)
+        }
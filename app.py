@@ -1,14 +1,34 @@
 import json
+import hashlib
 import requests
 from flask import Flask, request, jsonify
 import threading
+import _thread
+import signal
 import logging
-from collections import defaultdict
 from datetime import datetime
 import os
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-import re
+import shutil
+import time
+from urllib.parse import urlparse
+from priority_scheduler import DEFAULT_LANES
+from admission import DEFAULT_ADMISSION_CONFIG, ADMIT, DROP
+from metrics import metrics
+from bot_registry import BotRegistry, DEFAULT_OUTBOUND_LIMIT
+from state_backend import create_state_backend, default_node_id, LeaderElector, DEFAULT_STATE_CONFIG
+from warmup import create_session, warm_up, Readiness, DEFAULT_WARMUP_CONFIG
+from usage_accounting import UsageAccounting, DEFAULT_USAGE_CONFIG, BUDGET_DEGRADE, BUDGET_REFUSE
+from trigger_limiter import DEFAULT_RATE_LIMIT_CONFIG, ALLOW, COOLDOWN_REPLY
+from adaptive_timeout import AdaptiveTimeouts, DEFAULT_TIMEOUT_CONFIG
+from message_classifier import IncomingMessage, DifyReply, MediaMarkers, is_emoji, strip_mentions
+from broadcast import Broadcaster, BroadcastJob, BroadcastSkipped, DEFAULT_BROADCAST_CONFIG
+from refer_parser import extract_refer_fields, combine_refer_fields
+from async_logging import setup_logging, DEFAULT_LOGGING_CONFIG
+from message_splitter import split_message, send_parts, DEFAULT_MAX_BYTES, DEFAULT_PART_INTERVAL
+import tracing
+from tracing import TraceStore, DEFAULT_TRACING_CONFIG
+import profiler
+from profiler import SamplingProfiler, ProfilerBusy, DEFAULT_PROFILING_CONFIG
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -24,6 +44,9 @@ def load_config():
     config_path = 'config.json'
     default_config = {
         "bot_wxid": "",  # 新增:机器人wxid配置
+        # 多机器人账号: {bot_wxid: {description, dify, trigger_keywords, scheduler, admission, outbound}}
+        # 未配置的项使用下面的顶层配置
+        "bots": {},
         "dify": {
             "default": {
                 "api_url": "http://192.168.1.25:54321/v1/chat-messages",
@@ -33,6 +56,8 @@ def load_config():
             },
             "group_mapping": {}
         },
+        # Dify超时: 连接/读超时分开,读超时按该应用最近耗时的p99*factor自适应(上限为应用配置的timeout)
+        "dify_timeouts": DEFAULT_TIMEOUT_CONFIG,
         "weixin": {
             "api_url": "http://127.0.0.1:7777/qianxun/httpapi"
         },
@@ -55,27 +80,56 @@ def load_config():
             "default_reply": "抱歉,我没有理解您的意思。",
             "service_unavailable": "抱歉,服务暂时不可用:"
         },
-        "scheduled_tasks": []
+        "scheduled_tasks": [],
+        # 群发(POST /broadcast 和定时任务共用): 并发发送、失败重试、媒体预取一次所有目标共用
+        "broadcast": DEFAULT_BROADCAST_CONFIG,
+        "scheduler": {
+            "workers": 8,
+            "lanes": DEFAULT_LANES
+        },
+        "admission": DEFAULT_ADMISSION_CONFIG,
+        # 群聊触发限流(按成员和按群),可在group_mapping对应群中用rate_limit覆盖
+        "rate_limit": DEFAULT_RATE_LIMIT_CONFIG,
+        "outbound": DEFAULT_OUTBOUND_LIMIT,  # 每个机器人账号发往千寻的限速(条/秒)
+        # 状态后端: 会话ID、msgId去重、发件箱、定时任务主节点租约;多节点部署时使用sqlite(共享卷)或redis
+        "state": DEFAULT_STATE_CONFIG,
+        "usage": DEFAULT_USAGE_CONFIG,  # Dify token/延迟统计(按群、应用、小时)和每群每日token预算
+        "warmup": DEFAULT_WARMUP_CONFIG,  # 启动时预先建立到Dify/千寻的连接池,完成后/ready才返回就绪
+        "logging": DEFAULT_LOGGING_CONFIG,
+        "sending": {
+            "max_message_bytes": DEFAULT_MAX_BYTES,  # 单条文本消息字节上限,超出则分段发送
+            "part_interval": DEFAULT_PART_INTERVAL,  # 分段之间的发送间隔(秒)
+            "part_retries": 1  # 单个分段失败时的重试次数
+        },
+        "shutdown": {
+            "drain_timeout": 30  # 退出前等待进行中的消息处理完成的最长秒数,剩余任务写入发件箱由下次启动补做
+        },
+        # 额外的Dify回复媒体标记(图片、视频已内置): [{name, marker, send_type(sendImage|sendFile), extension}]
+        "media_markers": [],
+        "tracing": DEFAULT_TRACING_CONFIG,
+        "profiling": DEFAULT_PROFILING_CONFIG
     }
     
     try:
         if os.path.exists(config_path):
             with open(config_path, 'r', encoding='utf-8') as f:
                 config = json.load(f)
-                logger.info(f"Configuration loaded from {config_path}")
+                logger.info("Configuration loaded from %s", config_path)
                 return config
         else:
             # 创建默认配置文件
             with open(config_path, 'w', encoding='utf-8') as f:
                 json.dump(default_config, f, ensure_ascii=False, indent=2)
-            logger.info(f"Default configuration file created at {config_path}")
+            logger.info("Default configuration file created at %s", config_path)
             return default_config
     except Exception as e:
-        logger.error(f"Failed to load config file: {str(e)}, using default config")
+        logger.error("Failed to load config file: %s, using default config", e)
         return default_config
 
 # 加载配置
 config = load_config()
+# 按配置重新初始化日志(async模式下由后台线程写日志)
+log_listener = setup_logging(config.get('logging', {}))
 
 # 从配置文件读取变量
 WEIXIN_API_URL = config['weixin']['api_url']
@@ -83,39 +137,86 @@ TRIGGER_KEYWORDS = config['trigger_keywords']
 MESSAGES = config['messages']
 BOT_WXID = config.get('bot_wxid', '')
 BLACKLIST = config.get('blacklist', []) # 新增: 读取黑名单
+SENDING = config.get('sending', {})
+MAX_MESSAGE_BYTES = SENDING.get('max_message_bytes', DEFAULT_MAX_BYTES)
+PART_INTERVAL = SENDING.get('part_interval', DEFAULT_PART_INTERVAL)
+PART_RETRIES = SENDING.get('part_retries', 1)
+# Dify回复中的媒体标记 -> 发送方式
+media_markers = MediaMarkers(config.get('media_markers', []))
 
-# 存储会话ID的字典,格式: {from_wxid: conversation_id}
-conversations = {}
-# 存储锁,防止多线程同时修改同一会话
-session_locks = defaultdict(threading.Lock)
+# 共享状态后端和本节点ID
+STATE = {**DEFAULT_STATE_CONFIG, **config.get('state', {})}
+NODE_ID = STATE['node_id'] or default_node_id()
+state = create_state_backend(STATE)
 
-def get_dify_config(wxid):
-    """
-    根据wxid获取对应的Dify配置
-    如果是群聊且有专门配置,返回群聊配置;否则返回默认配置
-    """
-    # 检查是否为群聊,且在group_mapping中有配置
-    if '@chatroom' in wxid and wxid in config['dify'].get('group_mapping', {}):
-        dify_config = config['dify']['group_mapping'][wxid]
-        logger.info(f"Using specific Dify config for group: {wxid}")
-    else:
-        dify_config = config['dify']['default']
-        logger.info(f"Using default Dify config for: {wxid}")
-    
-    return dify_config
+# 机器人账号注册表,每个账号有独立的:
+# - 会话ID字典和会话锁(会话命名空间)
+# - 优先级工作调度器: 私聊 > @消息 > 关键词/表情触发 > 定时任务
+# - Dify调用准入控制: 限制在途请求数,过载时回复繁忙或丢弃低优先级触发
+# - 群聊回调快速预过滤: 未@机器人且不含触发词的群消息不做完整解析和日志
+# - 发往千寻的发送限速
+bots = BotRegistry(config, state)
+# Dify和千寻请求共用的连接池,启动时预热
+WARMUP = {**DEFAULT_WARMUP_CONFIG, **config.get('warmup', {})}
+http_session = create_session(WARMUP['pool_size'])
+readiness = Readiness()
+# 按应用的自适应Dify超时
+dify_timeouts = AdaptiveTimeouts(config.get('dify_timeouts', {}))
+# Dify用量统计和token预算
+usage_accounting = UsageAccounting(config.get('usage', {}))
+
+# 群发引擎(HTTP群发接口和定时任务共用)
+BROADCAST = {**DEFAULT_BROADCAST_CONFIG, **config.get('broadcast', {})}
+broadcaster = Broadcaster(BROADCAST, bots, lambda job, target: send_broadcast_target(job, target),
+                          prefetch=lambda job, url: prefetch_broadcast_media(job, url),
+                          cleanup=lambda job: cleanup_broadcast_media(job))
 
-def send_to_dify(query_text, from_wxid, reset_conversation=False):
+# 退出前排空: 收到SIGTERM(或Ctrl+C)后停止接收回调并报告未就绪,等待进行中的消息处理完成
+SHUTDOWN = {"drain_timeout": 30, **config.get('shutdown', {})}
+draining = threading.Event()
+drain_lock = threading.Lock()
+drained = False
+# 回复已写入发件箱、正在发送的msgId(排空超时时这些消息不再重新提问,由发件箱补发)
+sending_msg_ids = set()
+
+# 定时任务主节点选举(主节点同时负责补发发件箱)
+leader = LeaderElector(state, 'scheduled-tasks', NODE_ID, STATE['lease_ttl'], on_tick=lambda: replay_outbox())
+# 每条消息的链路追踪(各阶段耗时),保存在内存环形缓冲区中
+trace_store = TraceStore(config.get('tracing', {}))
+# 在线性能分析(需要管理令牌),只在请求期间采样
+PROFILING = {**DEFAULT_PROFILING_CONFIG, **config.get('profiling', {})}
+sampling_profiler = SamplingProfiler(PROFILING)
+
+def send_to_dify(query_text, from_wxid, reset_conversation=False, bot=None):
     """
     发送消息到Dify并获取回复
-    遇到404错误时会自动去掉conversation_id重试一次
-    根据from_wxid自动选择对应的Dify配置
+    遇到404错误时会自动去掉conversation_id重试一次,原请求和重试共用一个总期限
+    根据机器人和from_wxid自动选择对应的Dify配置和会话
     :param reset_conversation: 是否强制重置会话(即使用空conversation_id)
+    :param bot: 处理该消息的机器人,默认为config.json顶层配置的机器人
     """
+    bot = bot or bots.default
+    conversations = bot.conversations
+    
     # 获取该wxid对应的Dify配置
-    dify_config = get_dify_config(from_wxid)
+    dify_config = bot.get_dify_config(from_wxid)
     dify_api_url = dify_config['api_url']
     dify_api_key = dify_config['api_key']
-    dify_timeout = dify_config['timeout']
+    app_name = dify_config.get('description') or dify_api_url
+    # 读超时按该应用最近的耗时分布选择,同时作为原请求+404重试的总期限
+    dify_timeout = dify_timeouts.read_timeout(app_name, dify_config)
+    connect_timeout = dify_timeouts.connect_timeout(dify_config)
+    
+    # token预算: 接近上限时要求简短回答,超出后不再调用Dify
+    budget_status = usage_accounting.check_budget(from_wxid)
+    if budget_status == BUDGET_REFUSE:
+        logger.warning("Daily token budget exceeded for %s, refusing", from_wxid)
+        metrics.incr('usage.budget_refused')
+        return usage_accounting.budget_reply
+    if budget_status == BUDGET_DEGRADE:
+        logger.info("Token budget nearly used up for %s, asking for a short reply", from_wxid)
+        metrics.incr('usage.budget_degraded')
+        query_text = query_text + usage_accounting.degrade_prompt
     
     headers = {
         'Authorization': f'Bearer {dify_api_key}',
@@ -123,11 +224,11 @@ def send_to_dify(query_text, from_wxid, reset_conversation=False):
     }
     
     # 获取该用户的会话ID
-    with session_locks[from_wxid]:
+    with bot.session_locks[from_wxid]:
         # 如果要求重置会话，则使用空字符串；否则使用存储的ID
         if reset_conversation:
             conversation_id = ""
-            logger.info(f"Forced new conversation for user {from_wxid}")
+            logger.info("Forced new conversation for user %s", from_wxid)
         else:
             conversation_id = conversations.get(from_wxid, "")
         
@@ -140,29 +241,39 @@ def send_to_dify(query_text, from_wxid, reset_conversation=False):
         }
         
         try:
-            logger.info(f"Sending to Dify: user={from_wxid}, conversation_id={conversation_id}, api={dify_api_url}")
-            response = requests.post(dify_api_url, headers=headers, json=data, timeout=dify_timeout)
+            logger.info("Sending to Dify: user=%s, conversation_id=%s, api=%s", from_wxid, conversation_id, dify_api_url)
+            started_at = time.monotonic()
+            deadline = started_at + dify_timeout
+            try:
+                with tracing.span('dify.request', api=dify_api_url, timeout=round(dify_timeout, 1)):
+                    response = http_session.post(dify_api_url, headers=headers, json=data,
+                                                 timeout=(connect_timeout, dify_timeout))
+            finally:
+                elapsed = time.monotonic() - started_at
+                bot.admission.record_latency(elapsed)
             response.raise_for_status()
             
             result = response.json()
-            logger.info(f"Dify response received for user {from_wxid}")
+            logger.info("Dify response received for user %s", from_wxid)
+            dify_timeouts.record(app_name, elapsed)
+            usage_accounting.record(from_wxid, app_name, elapsed, result.get('metadata', {}).get('usage'))
             
             # 更新会话ID
             if 'conversation_id' in result and result['conversation_id']:
                 conversations[from_wxid] = result['conversation_id']
-                logger.info(f"Updated conversation_id for {from_wxid}: {result['conversation_id']}")
+                logger.info("Updated conversation_id for %s: %s", from_wxid, result['conversation_id'])
             
             return result.get('answer', MESSAGES['default_reply'])
             
         except requests.exceptions.HTTPError as e:
-            # 检查是否是404错误
+            # 检查是否是404错误(原请求和404重试在用量中只记为一次请求,耗时从原请求开始计算)
             if e.response.status_code == 404 and conversation_id:
-                logger.warning(f"Received 404 error with conversation_id={conversation_id}, retrying without conversation_id")
+                logger.warning("Received 404 error with conversation_id=%s, retrying without conversation_id", conversation_id)
                 
                 # 清除该用户的会话ID
                 if from_wxid in conversations:
                     del conversations[from_wxid]
-                    logger.info(f"Cleared conversation_id for {from_wxid}")
+                    logger.info("Cleared conversation_id for %s", from_wxid)
                 
                 # 重试:不带conversation_id
                 retry_data = {
@@ -173,31 +284,55 @@ def send_to_dify(query_text, from_wxid, reset_conversation=False):
                     "user": from_wxid
                 }
                 
+                # 重试只能使用总期限中剩余的时间
+                remaining = deadline - time.monotonic()
+                if remaining < 1:
+                    usage_accounting.record(from_wxid, app_name, time.monotonic() - started_at, error=True)
+                    logger.error("No time left for Dify retry (timeout %.1fs)", dify_timeout)
+                    metrics.incr('dify.retry_skipped_deadline')
+                    return f"{MESSAGES['service_unavailable']}timeout"
+                
                 try:
-                    logger.info(f"Retrying Dify request without conversation_id for user={from_wxid}")
-                    retry_response = requests.post(dify_api_url, headers=headers, json=retry_data, timeout=dify_timeout)
+                    logger.info("Retrying Dify request without conversation_id for user=%s", from_wxid)
+                    retry_started = time.monotonic()
+                    try:
+                        with tracing.span('dify.retry_404', api=dify_api_url, timeout=round(remaining, 1)):
+                            retry_response = http_session.post(dify_api_url, headers=headers, json=retry_data,
+                                                               timeout=(min(connect_timeout, remaining), remaining))
+                    finally:
+                        elapsed = time.monotonic() - retry_started
+                        bot.admission.record_latency(elapsed)
                     retry_response.raise_for_status()
                     
                     retry_result = retry_response.json()
-                    logger.info(f"Dify retry successful for user {from_wxid}")
+                    logger.info("Dify retry successful for user %s", from_wxid)
+                    dify_timeouts.record(app_name, elapsed)
+                    usage_accounting.record(from_wxid, app_name, time.monotonic() - started_at,
+                                            retry_result.get('metadata', {}).get('usage'))
                     
                     # 更新新的会话ID
                     if 'conversation_id' in retry_result and retry_result['conversation_id']:
                         conversations[from_wxid] = retry_result['conversation_id']
-                        logger.info(f"Updated new conversation_id for {from_wxid}: {retry_result['conversation_id']}")
+                        logger.info("Updated new conversation_id for %s: %s", from_wxid, retry_result['conversation_id'])
                     
                     return retry_result.get('answer', MESSAGES['default_reply'])
                     
                 except requests.exceptions.RequestException as retry_error:
-                    logger.error(f"Dify API retry failed: {str(retry_error)}")
+                    usage_accounting.record(from_wxid, app_name, time.monotonic() - started_at, error=True)
+                    logger.error("Dify API retry failed: %s", retry_error)
                     return f"{MESSAGES['service_unavailable']}{str(retry_error)}"
             else:
                 # 其他HTTP错误
-                logger.error(f"Dify API request failed: {str(e)}")
+                usage_accounting.record(from_wxid, app_name, elapsed, error=True)
+                logger.error("Dify API request failed: %s", e)
                 return f"{MESSAGES['service_unavailable']}{str(e)}"
                 
         except requests.exceptions.RequestException as e:
-            logger.error(f"Dify API request failed: {str(e)}")
+            usage_accounting.record(from_wxid, app_name, time.monotonic() - started_at, error=True)
+            if isinstance(e, requests.exceptions.ReadTimeout):
+                # 超时按当时的超时值计入分布,应用整体变慢时超时会随之放宽
+                dify_timeouts.record(app_name, dify_timeout)
+            logger.error("Dify API request failed: %s", e)
             return f"{MESSAGES['service_unavailable']}{str(e)}"
 
 def send_weixin_reply(target_wxid, message_content, msg_id, bot_wxid):
@@ -218,8 +353,10 @@ def send_weixin_reply(target_wxid, message_content, msg_id, bot_wxid):
     }
     
     try:
-        logger.info(f"Sending WeChat reply to {target_wxid}")
-        response = requests.post(WEIXIN_API_URL, json=data, params=params)
+        logger.info("Sending WeChat reply to %s", target_wxid)
+        bots.throttle(bot_wxid)
+        with tracing.span('weixin.sendReferText'):
+            response = http_session.post(WEIXIN_API_URL, json=data, params=params)
         response.raise_for_status()
         
         result = response.json()
@@ -227,11 +364,11 @@ def send_weixin_reply(target_wxid, message_content, msg_id, bot_wxid):
             logger.info("WeChat reply sent successfully")
             return True
         else:
-            logger.error(f"WeChat reply failed: {result.get('msg')}")
+            logger.error("WeChat reply failed: %s", result.get('msg'))
             return False
             
     except requests.exceptions.RequestException as e:
-        logger.error(f"WeChat API request failed: {str(e)}")
+        logger.error("WeChat API request failed: %s", e)
         return False
 
 def send_weixin_text(target_wxid, message_content, bot_wxid):
@@ -251,8 +388,10 @@ def send_weixin_text(target_wxid, message_content, bot_wxid):
     }
     
     try:
-        logger.info(f"Sending text message to {target_wxid}")
-        response = requests.post(WEIXIN_API_URL, json=data, params=params)
+        logger.info("Sending text message to %s", target_wxid)
+        bots.throttle(bot_wxid)
+        with tracing.span('weixin.sendText'):
+            response = http_session.post(WEIXIN_API_URL, json=data, params=params)
         response.raise_for_status()
         
         result = response.json()
@@ -260,24 +399,48 @@ def send_weixin_text(target_wxid, message_content, bot_wxid):
             logger.info("Text message sent successfully")
             return True
         else:
-            logger.error(f"Text message failed: {result.get('msg')}")
+            logger.error("Text message failed: %s", result.get('msg'))
             return False
             
     except requests.exceptions.RequestException as e:
-        logger.error(f"WeChat API request failed: {str(e)}")
+        logger.error("WeChat API request failed: %s", e)
         return False
 
-def send_weixin_image(target_wxid, image_url, bot_wxid):
+def send_weixin_long_reply(target_wxid, message_content, msg_id, bot_wxid):
     """
-    发送微信图片消息(通过URL)
+    发送可能超长的引用回复
+    超过字节上限时拆分: 第一段使用引用回复,其余分段作为普通文本按顺序发送
     """
-    import hashlib
-    import time
+    parts = split_message(message_content, MAX_MESSAGE_BYTES)
+    if len(parts) == 1:
+        return send_weixin_reply(target_wxid, message_content, msg_id, bot_wxid)
     
+    logger.info("Reply to %s is too long, sending in %s parts", target_wxid, len(parts))
+    if not send_parts(parts[:1], lambda part: send_weixin_reply(target_wxid, part, msg_id, bot_wxid),
+                      interval=PART_INTERVAL, retries=PART_RETRIES):
+        return False
+    time.sleep(PART_INTERVAL)
+    return send_parts(parts[1:], lambda part: send_weixin_text(target_wxid, part, bot_wxid),
+                      interval=PART_INTERVAL, retries=PART_RETRIES)
+
+def send_weixin_long_text(target_wxid, message_content, bot_wxid):
+    """
+    发送可能超长的普通文本,超过字节上限时按行/句子拆分后依次发送
+    """
+    parts = split_message(message_content, MAX_MESSAGE_BYTES)
+    if len(parts) > 1:
+        logger.info("Text to %s is too long, sending in %s parts", target_wxid, len(parts))
+    return send_parts(parts, lambda part: send_weixin_text(target_wxid, part, bot_wxid),
+                      interval=PART_INTERVAL, retries=PART_RETRIES if len(parts) > 1 else 0)
+
+def send_weixin_image(target_wxid, image_url, bot_wxid, file_extension='.jpg'):
+    """
+    发送微信图片消息(通过URL)
+    """
     # 根据URL和时间戳生成唯一文件名
     timestamp = str(int(time.time() * 1000))
     url_hash = hashlib.md5(image_url.encode()).hexdigest()[:8]
-    file_name = f"image_{timestamp}_{url_hash}.jpg"
+    file_name = f"image_{timestamp}_{url_hash}{file_extension}"
     
     data = {
         "type": "sendImage",
@@ -293,29 +456,28 @@ def send_weixin_image(target_wxid, image_url, bot_wxid):
     }
     
     try:
-        logger.info(f"Sending image to {target_wxid}: {image_url}")
-        response = requests.post(WEIXIN_API_URL, json=data, params=params)
+        logger.info("Sending image to %s: %s", target_wxid, image_url)
+        bots.throttle(bot_wxid)
+        with tracing.span('weixin.sendImage'):
+            response = http_session.post(WEIXIN_API_URL, json=data, params=params)
         response.raise_for_status()
         
         result = response.json()
         if result.get('code') == 200:
-            logger.info(f"Image sent successfully: {file_name}")
+            logger.info("Image sent successfully: %s", file_name)
             return True
         else:
-            logger.error(f"Image sending failed: {result.get('msg')}")
+            logger.error("Image sending failed: %s", result.get('msg'))
             return False
             
     except requests.exceptions.RequestException as e:
-        logger.error(f"WeChat API request failed: {str(e)}")
+        logger.error("WeChat API request failed: %s", e)
         return False
 
 def send_weixin_file(target_wxid, file_url, bot_wxid, file_extension='.mp4'):
     """
     发送微信文件消息(通过URL)
     """
-    import hashlib
-    import time
-    
     # 根据URL和时间戳生成唯一文件名
     timestamp = str(int(time.time() * 1000))
     url_hash = hashlib.md5(file_url.encode()).hexdigest()[:16]
@@ -335,146 +497,122 @@ def send_weixin_file(target_wxid, file_url, bot_wxid, file_extension='.mp4'):
     }
     
     try:
-        logger.info(f"Sending file to {target_wxid}: {file_url}")
-        response = requests.post(WEIXIN_API_URL, json=data, params=params)
+        logger.info("Sending file to %s: %s", target_wxid, file_url)
+        bots.throttle(bot_wxid)
+        with tracing.span('weixin.sendFile'):
+            response = http_session.post(WEIXIN_API_URL, json=data, params=params)
         response.raise_for_status()
         
         result = response.json()
         if result.get('code') == 200:
-            logger.info(f"File sent successfully: {file_name}")
+            logger.info("File sent successfully: %s", file_name)
             return True
         else:
-            logger.error(f"File sending failed: {result.get('msg')}")
+            logger.error("File sending failed: %s", result.get('msg'))
             return False
             
     except requests.exceptions.RequestException as e:
-        logger.error(f"WeChat API request failed: {str(e)}")
+        logger.error("WeChat API request failed: %s", e)
         return False
 
-def extract_and_send_images(message_content, target_wxid, bot_wxid):
+def send_weixin_media(target_wxid, marker, media_url, bot_wxid):
     """
-    从消息中提取![Generated Image](URL)格式的图片URL并发送
-    返回: 发送的图片数量
+    按媒体标记注册的发送方式发送一个媒体URL(sendImage / sendFile)
     """
-    # 匹配 ![Generated Image](URL) 格式
-    pattern = r'!\[Generated Image\]\((https?://[^\)]+)\)'
-    matches = re.findall(pattern, message_content)
-    
-    if not matches:
-        logger.info("No generated images found in message")
-        return 0
-    
-    logger.info(f"Found {len(matches)} generated image(s) in message")
-    
-    success_count = 0
-    for idx, image_url in enumerate(matches, 1):
-        logger.info(f"Sending image {idx}/{len(matches)}: {image_url[:100]}...")
-        if send_weixin_image(target_wxid, image_url, bot_wxid):
-            success_count += 1
-        else:
-            logger.error(f"Failed to send image {idx}/{len(matches)}")
-    
-    logger.info(f"Successfully sent {success_count}/{len(matches)} image(s)")
-    return success_count
+    if marker.send_type == 'sendImage':
+        return send_weixin_image(target_wxid, media_url, bot_wxid, marker.extension or '.jpg')
+    return send_weixin_file(target_wxid, media_url, bot_wxid, file_extension=marker.extension)
 
-def extract_and_send_videos(message_content, target_wxid, bot_wxid):
+def send_reply_segments(reply, target_wxid, bot_wxid, msg_id=None):
     """
-    从消息中提取[点击下载视频](URL)格式的视频URL并发送
-    返回: 发送的视频数量
+    按原文顺序交错发送回复中的文本段和媒体段(图片、视频等),文本不再被丢弃
+    有msg_id时第一个文本段使用引用回复,其余文本作为普通文本(超长时分段)
+    返回: 是否有分段发送成功
     """
-    # 匹配 [点击下载视频](URL) 格式
-    pattern = r'\[点击下载视频\]\((https?://[^\)]+)\)'
-    matches = re.findall(pattern, message_content)
-    
-    if not matches:
-        logger.info("No videos found in message")
-        return 0
-    
-    logger.info(f"Found {len(matches)} video(s) in message")
-    
+    segments = reply.segments
+    media_count = sum(1 for marker, _ in segments if marker is not None)
+    logger.info("Reply contains %s media item(s), sending %s segment(s) in order", media_count, len(segments))
+
     success_count = 0
-    for idx, video_url in enumerate(matches, 1):
-        logger.info(f"Sending video {idx}/{len(matches)}: {video_url[:100]}...")
-        if send_weixin_file(target_wxid, video_url, bot_wxid, file_extension='.mp4'):
+    quoted = msg_id is None
+    for idx, (marker, content) in enumerate(segments, 1):
+        if marker is None:
+            if not quoted:
+                quoted = True
+                sent = send_weixin_long_reply(target_wxid, content, msg_id, bot_wxid)
+            else:
+                sent = send_weixin_long_text(target_wxid, content, bot_wxid)
+        else:
+            logger.info("Sending %s %s/%s: %s...", marker.name, idx, len(segments), content[:100])
+            with tracing.span('media.' + marker.name):
+                sent = send_weixin_media(target_wxid, marker, content, bot_wxid)
+        if sent:
             success_count += 1
         else:
-            logger.error(f"Failed to send video {idx}/{len(matches)}")
-    
-    logger.info(f"Successfully sent {success_count}/{len(matches)} video(s)")
-    return success_count
+            logger.error("Failed to send segment %s/%s", idx, len(segments))
+
+    logger.info("Successfully sent %s/%s segment(s)", success_count, len(segments))
+    return success_count > 0
 
 def parse_refer_message(msg):
     """
     解析XML格式的引用消息,提取title和refermsg中的content
     返回: 拼接后的文本,如果不是XML格式则返回None
     """
-    import xml.etree.ElementTree as ET
-    
-    try:
-        # 尝试解析XML
-        root = ET.fromstring(msg)
-        
-        # 提取title内容
-        title_elem = root.find('.//title')
-        title_text = title_elem.text if title_elem is not None and title_elem.text else ""
-        
-        # 提取refermsg中的content
-        refer_content_elem = root.find('.//refermsg/content')
-        refer_content = refer_content_elem.text if refer_content_elem is not None and refer_content_elem.text else ""
-        
-        # 如果都为空,返回None
-        if not title_text and not refer_content:
-            return None
-        
-        # 拼接内容: "被引用的内容\n当前消息内容"
-        if refer_content and title_text:
-            combined_text = f"{refer_content}\n{title_text}"
-        elif refer_content:
-            combined_text = refer_content
-        else:
-            combined_text = title_text
-        
-        logger.info(f"Parsed refer message - Title: '{title_text}', Refer: '{refer_content}'")
-        return combined_text
-        
-    except ET.ParseError:
-        # 不是有效的XML,返回None
-        return None
-    except Exception as e:
-        logger.warning(f"Error parsing XML message: {str(e)}")
+    fields = extract_refer_fields(msg)
+    if fields is None:
         return None
+    
+    title_text, refer_content = fields
+    combined_text = combine_refer_fields(title_text, refer_content)
+    if combined_text is not None:
+        logger.info("Parsed refer message - Title: '%s', Refer: '%s'", title_text, refer_content)
+    return combined_text
 
-def process_group_message(message_data, bot_wxid):
+def process_group_message(message_data, bot_wxid, bot=None, incoming=None):
     """
     处理群聊消息(@机器人 或 包含关键词触发)
+    :param incoming: 回调中已计算好的消息分类(IncomingMessage),为空时在此计算
     返回: (query_text, direct_reply)
     - query_text: 需要发送给Dify的内容,None表示忽略消息
     - direct_reply: 直接回复的内容,不需要经过Dify
     """
+    bot = bot or bots.default
     data_info = message_data['data']['data']
     msg = data_info['msg']
+    incoming = incoming or IncomingMessage(msg)
     
     # 1. 检查是否@机器人 或 消息包含关键词
     is_mentioned = bot_wxid in data_info.get('atWxidList', [])
-    has_keyword = any(keyword in msg for keyword in TRIGGER_KEYWORDS)
+    has_keyword = any(keyword in msg for keyword in bot.trigger_keywords)
     
     # 检查是否为简单的表情符号: [两个汉字]
-    # 正则匹配: 以[开头, 两个中文字符, 以]结尾
-    is_simple_emoji = bool(re.match(r'^\[[\u4e00-\u9fa5]{2}\]$', msg.strip()))
+    is_simple_emoji = incoming.is_emoji
     
     if not is_mentioned and not has_keyword and not is_simple_emoji:
         return None, None  # 既没@也没关键词且不是表情包,忽略
     
+    # 触发限流: 按(群, 成员)和按群的令牌桶,超出时回复冷却提示或静默丢弃,不调用Dify
+    group_wxid = data_info['fromWxid']
+    sender_wxid = data_info.get('finalFromWxid', '')
+    overrides = bot.group_rate_limit(group_wxid)
+    decision = bot.trigger_limiter.check(group_wxid, sender_wxid, overrides)
+    if decision != ALLOW:
+        logger.info("Trigger rate limited in %s for %s (%s)", group_wxid, sender_wxid, decision)
+        if decision == COOLDOWN_REPLY:
+            return None, bot.trigger_limiter.cooldown_reply(overrides)
+        return None, None
+    
     # 2. 尝试解析XML格式的引用消息
     parsed_refer = parse_refer_message(msg)
     if parsed_refer is not None:
         # 如果是XML引用消息,使用解析后的内容
         processed_msg = parsed_refer
-        logger.info(f"Using parsed refer message content: {processed_msg[:100]}...")
+        logger.info("Using parsed refer message content: %s...", processed_msg[:100])
     else:
         # 3. 移除消息中的@提及(如"@机器人 你好"→"你好")
         # 匹配@后的用户名(支持中文/英文/数字),并替换为空
-        processed_msg = re.sub(r'@[\u4e00-\u9fa5A-Za-z0-9_. ]+\s*', '', msg).strip()
+        processed_msg = strip_mentions(msg)
     
     # 4. 如果是空消息(如仅@机器人但无内容),直接回复
     if not processed_msg:
@@ -489,112 +627,157 @@ def process_private_message(message_data):
     data_info = message_data['data']['data']
     return data_info['msg'].strip()
 
+def send_broadcast_target(job, target):
+    """
+    群发: 向单个目标发送剩余的分段(重试时从失败的分段继续,不重发已发出的分段)
+    prompt任务先为该目标调用Dify(使用该群的Dify配置和会话),回复只获取一次
+    返回: 是否全部发送成功
+    """
+    bot_wxid = job.bot_wxid
+    if target.segments is None:
+        if job.prompt is None:
+            target.segments = job.segments
+        else:
+            logger.info("Processing Dify broadcast %s (%s) for %s", job.id, job.source, target.wxid)
+            dify_reply = send_to_dify(job.prompt, target.wxid, bot=bots.resolve(bot_wxid))
+            # 黑名单检查
+            for keyword in BLACKLIST:
+                if keyword and keyword in dify_reply:
+                    logger.warning("Broadcast %s to %s blocked. Dify reply contains blacklist keyword: '%s'",
+                                   job.id, target.wxid, keyword)
+                    raise BroadcastSkipped(f"blacklist: {keyword}")
+            target.segments = DifyReply(dify_reply, media_markers).segments
+
+    while target.next_segment < len(target.segments):
+        marker, content = target.segments[target.next_segment]
+        if marker is None:
+            sent = send_weixin_long_text(target.wxid, content, bot_wxid)
+        else:
+            # 使用预取后的本地文件(预取失败时仍使用URL);千寻读取不到本地文件时改用原URL再发一次
+            local_path = job.media_paths.get(content)
+            sent = send_weixin_media(target.wxid, marker, local_path or content, bot_wxid)
+            if not sent and local_path:
+                logger.warning("Broadcast %s: sending prefetched file to %s failed, retrying with the URL",
+                               job.id, target.wxid)
+                sent = send_weixin_media(target.wxid, marker, content, bot_wxid)
+        if not sent:
+            return False
+        target.next_segment += 1
+    return True
+
+def prefetch_broadcast_media(job, media_url):
+    """
+    群发前把媒体下载一次到本地目录,所有目标发送同一个本地文件
+    返回: 本地绝对路径;下载失败返回None(各目标继续使用URL)
+    """
+    media_dir = os.path.abspath(os.path.join(BROADCAST['media_dir'], job.id))
+    extension = os.path.splitext(urlparse(media_url).path)[1]
+    path = os.path.join(media_dir, hashlib.md5(media_url.encode()).hexdigest()[:16] + extension)
+    started_at = time.monotonic()
+    try:
+        os.makedirs(media_dir, exist_ok=True)
+        with http_session.get(media_url, stream=True, timeout=(5, 60)) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as f:
+                for chunk in response.iter_content(64 * 1024):
+                    f.write(chunk)
+    except (requests.exceptions.RequestException, OSError) as e:
+        logger.error("Failed to prefetch media for broadcast %s, targets will use the URL: %s", job.id, e)
+        return None
+    logger.info("Prefetched media for broadcast %s in %.2fs: %s", job.id, time.monotonic() - started_at, path)
+    return path
+
+def cleanup_broadcast_media(job):
+    """
+    群发结束后删除预取的媒体文件
+    """
+    if job.media_paths:
+        shutil.rmtree(os.path.abspath(os.path.join(BROADCAST['media_dir'], job.id)), ignore_errors=True)
+
+def serialize_segments(segments):
+    return [[marker.name if marker is not None else None, content] for marker, content in segments]
+
+def deserialize_segments(items):
+    return [(media_markers.by_name(name) if name else None, content) for name, content in items]
+
 def execute_scheduled_task(task):
     """
     执行定时任务
     支持两种类型:
-    - type: "text" - 直接发送固定文本
-    - type: "dify" - 发送prompt到Dify获取回复后发送
+    - type: "text" - 直接发送固定文本(可包含媒体标记)
+    - type: "dify" - 发送prompt到Dify获取回复后发送(每个群单独获取回复)
+    所有目标群聊作为一个群发任务在scheduled通道中并发发送(失败重试),不会挤占私聊/@消息的处理
+    多节点部署时只有持有租约的主节点执行,避免重复发送
     """
     task_name = task.get('name', 'Unnamed Task')
+    
+    if not leader.is_leader:
+        logger.info("Skipping scheduled task '%s', node %s is not the leader", task_name, NODE_ID)
+        return
     task_type = task.get('type', 'dify')  # 默认为dify类型
     target_groups = task.get('target_groups', [])
     
-    logger.info(f"Executing scheduled task: {task_name} (type: {task_type})")
+    logger.info("Executing scheduled task: %s (type: %s)", task_name, task_type)
     
     if not target_groups:
-        logger.error(f"Task '{task_name}' has no target groups, skipping")
+        logger.error("Task '%s' has no target groups, skipping", task_name)
         return
     
-    # 使用配置中的bot_wxid
-    if not BOT_WXID:
+    # 使用任务指定的bot_wxid,未指定时使用配置中的bot_wxid
+    bot_wxid = task.get('bot_wxid') or BOT_WXID
+    if not bot_wxid:
         logger.error("Bot wxid not configured in config.json, cannot send scheduled message")
         return
+    bot = bots.resolve(bot_wxid)
+    if bot is None:
+        logger.error("Task '%s' uses unknown bot %s, skipping", task_name, bot_wxid)
+        return
     
     # 根据任务类型处理
     if task_type == 'text':
         # 固定文本类型
         message = task.get('message', '')
         if not message:
-            logger.error(f"Task '{task_name}' (type: text) has no message, skipping")
+            logger.error("Task '%s' (type: text) has no message, skipping", task_name)
             return
         
         # 直接发送固定文本到所有目标群聊
-        for group_wxid in target_groups:
-            try:
-                logger.info(f"Sending fixed text for task '{task_name}' to group {group_wxid}")
-                success = send_weixin_text(group_wxid, message, BOT_WXID)
-                
-                if success:
-                    logger.info(f"Task '{task_name}' executed successfully for group {group_wxid}")
-                else:
-                    logger.error(f"Task '{task_name}' failed to send message to group {group_wxid}")
-                    
-            except Exception as e:
-                logger.error(f"Error executing task '{task_name}' for group {group_wxid}: {str(e)}", exc_info=True)
+        job = BroadcastJob(bot_wxid, target_groups, segments=media_markers.tokenize(message),
+                           source=f"scheduled:{task_name}")
     
     elif task_type == 'dify':
         # Dify类型
         prompt = task.get('prompt', '')
         if not prompt:
-            logger.error(f"Task '{task_name}' (type: dify) has no prompt, skipping")
+            logger.error("Task '%s' (type: dify) has no prompt, skipping", task_name)
             return
         
         # 发送prompt到Dify获取回复,然后发送到所有目标群聊
-        for group_wxid in target_groups:
-            try:
-                logger.info(f"Processing Dify task '{task_name}' for group {group_wxid}")
-                
-                # 发送prompt到Dify获取回复
-                dify_reply = send_to_dify(prompt, group_wxid)
-                
-                # --- 新增: 定时任务黑名单检查 ---
-                is_blocked = False
-                for keyword in BLACKLIST:
-                    if keyword and keyword in dify_reply:
-                        logger.warning(f"Scheduled task '{task_name}' blocked. Dify reply contains blacklist keyword: '{keyword}'")
-                        is_blocked = True
-                        break
-                
-                if is_blocked:
-                    continue  # 跳过发送环节
-                # -------------------------------
-                
-                # 检查消息中是否包含图片或视频
-                has_generated_images = '![Generated Image]' in dify_reply
-                has_videos = '[点击下载视频]' in dify_reply
-                
-                if has_generated_images or has_videos:
-                    # 如果包含生成的图片或视频,只发送图片/视频,不发送文本消息
-                    logger.info(f"Task '{task_name}' message contains generated images or videos, sending media only")
-                    image_count = extract_and_send_images(dify_reply, group_wxid, BOT_WXID)
-                    video_count = extract_and_send_videos(dify_reply, group_wxid, BOT_WXID)
-                    success = (image_count + video_count) > 0
-                else:
-                    # 普通消息,发送文本
-                    success = send_weixin_text(group_wxid, dify_reply, BOT_WXID)
-                
-                if success:
-                    logger.info(f"Task '{task_name}' executed successfully for group {group_wxid}")
-                else:
-                    logger.error(f"Task '{task_name}' failed to send message to group {group_wxid}")
-                    
-            except Exception as e:
-                logger.error(f"Error executing task '{task_name}' for group {group_wxid}: {str(e)}", exc_info=True)
+        job = BroadcastJob(bot_wxid, target_groups, prompt=prompt, source=f"scheduled:{task_name}")
     
     else:
-        logger.error(f"Task '{task_name}' has unknown type: {task_type}, skipping")
+        logger.error("Task '%s' has unknown type: %s, skipping", task_name, task_type)
+        return
+    
+    try:
+        broadcaster.submit(job)
+    except (ValueError, RuntimeError) as e:
+        logger.error("Task '%s' could not be queued: %s", task_name, e)
 
 def init_scheduler():
     """
     初始化定时任务调度器
     """
-    scheduler = BackgroundScheduler(timezone='Asia/Shanghai')
     scheduled_tasks = config.get('scheduled_tasks', [])
     
-    if not scheduled_tasks:
-        logger.info("No scheduled tasks configured")
-        return scheduler
+    if not any(task.get('enabled', True) for task in scheduled_tasks):
+        logger.info("No enabled scheduled tasks configured")
+        return None
+    
+    # APScheduler只在有定时任务时才导入,缩短没有定时任务时的启动时间
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from apscheduler.triggers.cron import CronTrigger
+    scheduler = BackgroundScheduler(timezone='Asia/Shanghai')
     
     enabled_count = 0
     for task in scheduled_tasks:
@@ -605,11 +788,11 @@ def init_scheduler():
         description = task.get('description', 'No description')
         
         if not enabled:
-            logger.info(f"Scheduled task '{task_name}' is disabled, skipping")
+            logger.info("Scheduled task '%s' is disabled, skipping", task_name)
             continue
         
         if not cron_expr:
-            logger.error(f"Scheduled task '{task_name}' has no cron expression, skipping")
+            logger.error("Scheduled task '%s' has no cron expression, skipping", task_name)
             continue
         
         try:
@@ -628,21 +811,294 @@ def init_scheduler():
             )
             
             enabled_count += 1
-            logger.info(f"Scheduled task added: '{task_name}' (type: {task_type}) - {description}")
-            logger.info(f"  Cron: {cron_expr}")
-            logger.info(f"  Target groups: {', '.join(task.get('target_groups', []))}")
+            logger.info("Scheduled task added: '%s' (type: %s) - %s", task_name, task_type, description)
+            logger.info("  Cron: %s", cron_expr)
+            logger.info("  Target groups: %s", ', '.join(task.get('target_groups', [])))
             
         except Exception as e:
-            logger.error(f"Failed to add scheduled task '{task_name}': {str(e)}")
+            logger.error("Failed to add scheduled task '%s': %s", task_name, e)
     
     if enabled_count > 0:
         scheduler.start()
-        logger.info(f"Scheduler started with {enabled_count} active task(s)")
+        logger.info("Scheduler started with %s active task(s)", enabled_count)
     else:
         logger.info("No enabled scheduled tasks to start")
     
     return scheduler
 
+def upstream_urls():
+    """
+    所有机器人配置中用到的Dify api_url以及千寻接口地址
+    """
+    urls = {WEIXIN_API_URL}
+    for bot in bots.all():
+        urls.add(bot.dify['default']['api_url'])
+        for group_config in bot.dify.get('group_mapping', {}).values():
+            if group_config.get('api_url'):
+                urls.add(group_config['api_url'])
+    return urls
+
+def prepare_readiness():
+    """
+    启动就绪阶段: 加载持久化的会话状态、预热到各上游的连接
+    上游暂时不可用不影响就绪(首条消息时会重新建立连接),状态后端不可用则保持未就绪
+    """
+    try:
+        conversation_count = sum(len(bot.conversations) for bot in bots.all())
+        readiness.set_check('state', True, backend=STATE['backend'], conversations=conversation_count)
+    except Exception as e:
+        logger.error("State backend not available: %s", e)
+        readiness.set_check('state', False, backend=STATE['backend'], error=str(e))
+        return
+    
+    if WARMUP['enabled']:
+        results = warm_up(http_session, upstream_urls(), timeout=WARMUP['timeout'],
+                          connections=min(WARMUP['connections'], WARMUP['pool_size']))
+        readiness.set_check('upstreams', all(result['ok'] for result in results.values()), origins=results)
+    
+    readiness.mark_ready()
+    logger.info("Service ready after %.2fs", readiness.ready_after)
+
+def get_message_lane(event_type, data_info, bot_wxid):
+    """
+    根据消息类型确定调度通道
+    私聊(10009) > 明确@机器人 > 关键词/表情触发
+    """
+    if event_type == 10009:
+        return 'private'
+    if bot_wxid in data_info.get('atWxidList', []):
+        return 'mention'
+    return 'keyword'
+
+def run_traced(trace, func, *args):
+    """
+    在工作线程中执行任务,并把排队等待和处理结果记入trace
+    trace为None(未启用追踪)时直接执行
+    """
+    if trace is None:
+        return func(*args)
+    
+    if trace.queued_at is not None:
+        trace.add_span('queue', trace.queued_at, time.monotonic())
+    try:
+        with tracing.activate(trace):
+            result = func(*args)
+        trace.finish('sent' if result else 'failed')
+        return result
+    except Exception:
+        trace.finish('error')
+        raise
+    finally:
+        trace_store.add(trace)
+
+def handle_admitted_message(query_text, target_wxid, msg_id, bot_wxid, reset_conversation=None):
+    """
+    处理已通过准入控制的消息,完成后释放准入额度
+    """
+    try:
+        return handle_incoming_message(query_text, None, target_wxid, msg_id, bot_wxid, reset_conversation)
+    finally:
+        bots.resolve(bot_wxid).admission.release(target_wxid)
+
+def send_dify_reply(dify_reply, target_wxid, msg_id, bot_wxid):
+    """
+    按回复内容选择发送方式: 文本与媒体交错 / 表情文本 / 引用回复(超长时分段)
+    返回: 是否发送成功
+    """
+    # 检查消息中是否包含图片或视频、是否为[两个汉字]的表情格式(只分类一次)
+    reply = DifyReply(dify_reply, media_markers)
+    
+    if reply.has_media:
+        # 包含生成的图片或视频: 文本和媒体按原文顺序交错发送,只要有分段发送成功就算成功
+        logger.info("Message contains media, sending text and media in order")
+        return send_reply_segments(reply, target_wxid, bot_wxid, msg_id)
+    elif reply.is_emoji:
+        # 如果是表情包回复,直接发送文本,不使用引用回复
+        logger.info("Dify reply is a simple emoji, sending direct text")
+        return send_weixin_text(target_wxid, dify_reply, bot_wxid)
+    else:
+        # 普通消息,发送引用回复(超长时分段发送)
+        return send_weixin_long_reply(target_wxid, dify_reply, msg_id, bot_wxid)
+
+def replay_outbox():
+    """
+    补发发件箱中的记录,只在主节点上执行:
+    - reply: 发送途中节点退出留下的回复,直接补发
+    - query: 排空时未处理完的消息,重新提交到对应机器人的调度通道
+    - prompt / segments: 排空时未发送的群发目标,作为新的群发任务重新提交
+    """
+    for entry in state.outbox_claim_stale(STATE['outbox_replay_after']):
+        if 'reply' in entry:
+            logger.warning("Replaying unfinished reply to %s (msgId=%s)", entry['target_wxid'], entry['msg_id'])
+            send_dify_reply(entry['reply'], entry['target_wxid'], entry['msg_id'], entry['bot_wxid'])
+            continue
+
+        logger.warning("Resuming unfinished %s task for %s (bot=%s)", entry['lane'], entry['target_wxid'],
+                       entry['bot_wxid'])
+        if 'query' in entry:
+            bot = bots.resolve(entry['bot_wxid'])
+            resumed = bot is not None and bot.scheduler.submit(
+                entry['lane'], handle_incoming_message, entry['query'], None, entry['target_wxid'], entry['msg_id'],
+                entry['bot_wxid']) is not None
+        else:
+            job = BroadcastJob(entry['bot_wxid'], [entry['target_wxid']], prompt=entry.get('prompt'),
+                               segments=deserialize_segments(entry.get('segments', [])), source=entry['task'])
+            try:
+                broadcaster.submit(job)
+                resumed = True
+            except (ValueError, RuntimeError):
+                resumed = False
+        if not resumed:
+            logger.error("Could not resume task for %s, keeping it in the outbox", entry['target_wxid'])
+            state.outbox_add(entry, created=0)
+
+def pending_payload(lane, func, args):
+    """
+    把调度器中未完成的任务转换为发件箱记录(由下次启动或其他节点补做)
+    返回: 发件箱记录;无法恢复的任务返回None
+    """
+    if func is run_traced:
+        func, args = args[1], args[2:]
+    if func is handle_admitted_message:
+        query_text, target_wxid, msg_id, bot_wxid = args[:4]
+        return {"lane": lane, "bot_wxid": bot_wxid, "target_wxid": target_wxid, "msg_id": msg_id,
+                "query": query_text}
+    return None
+
+def broadcast_leftovers():
+    """
+    未完成的群发任务中还没发送完成的目标(含正在发送的),转换为发件箱记录(每个目标一条,只保留未发送的分段)
+    """
+    leftovers = []
+    for job in broadcaster.jobs():
+        for target in job.unfinished():
+            payload = {"lane": BROADCAST['lane'], "bot_wxid": job.bot_wxid, "target_wxid": target.wxid,
+                       "task": job.source}
+            if target.segments is None and job.prompt is not None:
+                payload["prompt"] = job.prompt
+            else:
+                payload["segments"] = serialize_segments((target.segments or job.segments)[target.next_segment:])
+            leftovers.append(payload)
+    return leftovers
+
+def drain(scheduler):
+    """
+    优雅退出(重复调用只执行一次):
+    1. 停止接收新回调,/ready返回未就绪
+    2. 关闭定时任务调度器(等待正在执行的定时任务分发完成),停止主节点续约和补发
+    3. 等待各机器人排队和执行中的消息在drain_timeout秒内处理完
+    4. 仍未完成的任务写入发件箱: 排队中的全部写入;执行中的只写入还没拿到回复的消息
+       (已拿到回复的在发件箱中已有记录);群发任务写入还没发送完成的目标(含正在发送的)
+    5. 写出用量统计,关闭状态后端(memory后端保存会话ID和发件箱)
+    """
+    global drained
+    with drain_lock:
+        if drained:
+            return
+        draining.set()
+        readiness.mark_draining()
+        timeout = float(SHUTDOWN['drain_timeout'])
+        deadline = time.monotonic() + timeout
+        logger.info("Draining: stopped accepting callbacks, waiting up to %ss for in-flight messages", timeout)
+
+        if scheduler:
+            logger.info("Shutting down scheduler...")
+            scheduler.shutdown(wait=True)
+        leader.stop()
+
+        queued, running = bots.drain(deadline - time.monotonic())
+        leftovers = [pending_payload(lane, func, args) for lane, func, args, _ in queued]
+        leftovers.extend(broadcast_leftovers())
+        for lane, func, args, _ in running:
+            payload = pending_payload(lane, func, args)
+            if payload and 'query' in payload and payload['msg_id'] not in sending_msg_ids:
+                leftovers.append(payload)
+        persisted = 0
+        for payload in leftovers:
+            if payload is None:
+                continue
+            state.outbox_add(payload, created=0)
+            persisted += 1
+        if persisted:
+            logger.warning("Drain deadline reached, %s unfinished task(s) saved to the outbox", persisted)
+        else:
+            logger.info("Drain complete, no unfinished tasks")
+
+        usage_accounting.stop()
+        state.close()
+        drained = True
+
+def drain_and_stop(scheduler):
+    """
+    收到SIGTERM后在后台排空,HTTP服务在此期间继续运行(回调返回503、/ready返回未就绪),完成后让主线程退出
+    """
+    drain(scheduler)
+    _thread.interrupt_main()
+
+def handle_sigterm(scheduler):
+    """
+    第一次SIGTERM开始排空,排空期间再次收到SIGTERM时立即退出
+    """
+    if draining.is_set():
+        logger.warning("Received SIGTERM again while draining, exiting immediately")
+        os._exit(1)
+    threading.Thread(target=drain_and_stop, args=(scheduler,), name="drain", daemon=True).start()
+
+def handle_incoming_message(query_text, direct_reply, target_wxid, msg_id, bot_wxid, reset_conversation=None):
+    """
+    在工作线程中处理一条已触发的消息: 调用Dify(或直接回复)、黑名单检查、发送微信回复
+    :param reset_conversation: 回调中已判断的"输入是否为表情",为None时在此判断
+    返回: 是否发送成功
+    """
+    log_fields = {'msgId': msg_id, 'wxid': target_wxid}
+    
+    # 判断是直接回复还是通过Dify回复
+    if direct_reply:
+        # 直接回复(不经过Dify)
+        logger.info("Sending direct reply without Dify", extra={**log_fields, 'stage': 'direct_reply'})
+        dify_reply = direct_reply
+    else:
+        # 检查输入是否为[两个汉字]的表情格式,如果是,则重置会话
+        is_input_emoji = is_emoji(query_text) if reset_conversation is None else reset_conversation
+        
+        # 发送到Dify获取回复
+        # 如果是表情包触发,强制reset_conversation=True (创建新会话/不带conversation_id)
+        started_at = time.monotonic()
+        with tracing.span('dify', reset=is_input_emoji):
+            dify_reply = send_to_dify(query_text, target_wxid, reset_conversation=is_input_emoji,
+                                      bot=bots.resolve(bot_wxid))
+        logger.info("Dify reply ready", extra={
+            **log_fields, 'stage': 'dify', 'duration_ms': round((time.monotonic() - started_at) * 1000, 1)})
+    
+    # --- 新增: 黑名单检查逻辑 ---
+    # 如果Dify回复包含黑名单中的任何关键词,则直接忽略该消息
+    for keyword in BLACKLIST:
+        if keyword and keyword in dify_reply:
+            logger.warning("Message blocked. Dify reply contains blacklist keyword: '%s'", keyword,
+                           extra={**log_fields, 'stage': 'blocked'})
+            tracing.set_outcome('blocked')
+            return False
+    # ---------------------------
+    
+    # 发送前记入发件箱,节点在发送途中退出时由主节点补发
+    outbox_id = state.outbox_add({"bot_wxid": bot_wxid, "target_wxid": target_wxid, "msg_id": msg_id,
+                                  "reply": dify_reply})
+    sending_msg_ids.add(msg_id)
+    started_at = time.monotonic()
+    try:
+        success = send_dify_reply(dify_reply, target_wxid, msg_id, bot_wxid)
+    finally:
+        state.outbox_remove(outbox_id)
+        sending_msg_ids.discard(msg_id)
+    
+    duration_ms = round((time.monotonic() - started_at) * 1000, 1)
+    if success:
+        logger.info("WeChat reply sent", extra={**log_fields, 'stage': 'reply', 'duration_ms': duration_ms})
+    else:
+        logger.error("Failed to send WeChat reply for message %s", msg_id,
+                     extra={**log_fields, 'stage': 'reply_failed', 'duration_ms': duration_ms})
+    return success
+
 @app.route('/wechat/callback', methods=['GET', 'POST'])
 def wechat_callback():
     """
@@ -655,30 +1111,64 @@ def wechat_callback():
     
     # 2. 处理消息(POST请求,框架推送的消息)
     elif request.method == 'POST':
+        # 排空期间不再接收新消息
+        if draining.is_set():
+            metrics.incr('callback.draining')
+            return jsonify({"status": "draining"}), 503
         try:
-            message_data = request.json
-            logger.info(f"Received WeChat message: {json.dumps(message_data, ensure_ascii=False)[:500]}...")
+            raw_body = request.get_data()
+            
+            # 快速路径: 明显不会触发的群消息直接忽略,不解析JSON也不记录日志
+            if not bots.should_handle(raw_body):
+                metrics.incr('callback.prefiltered')
+                return jsonify({"status": "ignored"})
+            
+            parse_started = time.monotonic()
+            message_data = json.loads(raw_body)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received WeChat message: %s...", raw_body[:500].decode('utf-8', errors='ignore'))
             
             # 提取基础信息
             event_type = message_data.get('event')  # 10008=群聊,10009=私聊
             bot_wxid = message_data.get('wxid')     # 机器人自身的wxid
             data_info = message_data['data']['data']
+            log_fields = {'msgId': data_info.get('msgId'), 'wxid': data_info.get('fromWxid')}
+            logger.info("Received WeChat message: event=%s, from=%s, msgId=%s", event_type,
+                        data_info.get('fromWxid'), data_info.get('msgId'), extra={**log_fields, 'stage': 'received'})
+            
+            # 按回调中的wxid找到机器人,未登记的账号忽略
+            bot = bots.resolve(bot_wxid)
+            if bot is None:
+                logger.info("Ignoring message for unknown bot %s", bot_wxid,
+                            extra={**log_fields, 'stage': 'ignored', 'sample': 'ignored'})
+                return jsonify({"status": "ignored", "reason": "unknown bot"})
             
             # 优先使用配置中的bot_wxid,如果配置为空则使用回调中的wxid
-            effective_bot_wxid = BOT_WXID if BOT_WXID else bot_wxid
+            effective_bot_wxid = bot.wxid if bot.wxid else bot_wxid
+            
+            # 链路追踪从回调开始,被忽略的消息不会进入缓冲区
+            trace = trace_store.start_trace(data_info.get('msgId'), data_info.get('fromWxid'),
+                                            event=event_type, bot=effective_bot_wxid)
+            if trace is not None:
+                trace.start_wall -= trace.start - parse_started
+                trace.start = parse_started
+                trace.add_span('parse', parse_started, time.monotonic())
             
             # 3. 检查是否是XML引用消息(包含<title>和<refermsg><content>标签)
-            msg_content = data_info.get('msg', '')
-            is_refer_message = '<title>' in msg_content and '<refermsg>' in msg_content and '<content>' in msg_content
+            # 消息分类(表情/引用)只计算一次,随消息传递
+            incoming = IncomingMessage(data_info.get('msg', ''))
+            is_refer_message = incoming.is_refer
             
             # 4. 过滤非文本消息(仅处理msgType=1,但XML引用消息除外)
             if data_info.get('msgType') != 1 and not is_refer_message:
-                logger.info(f"Ignoring non-text message (msgType={data_info.get('msgType')})")
+                logger.info("Ignoring non-text message (msgType=%s)", data_info.get('msgType'),
+                            extra={**log_fields, 'stage': 'ignored', 'sample': 'ignored'})
                 return jsonify({"status": "ignored"})
             
             # 5. 过滤自己发送的消息(msgSource=1是机器人自己发的)
             if data_info.get('msgSource') == 1:
-                logger.info("Ignoring self-sent message (msgSource=1)")
+                logger.info("Ignoring self-sent message (msgSource=1)",
+                            extra={**log_fields, 'stage': 'ignored', 'sample': 'ignored'})
                 return jsonify({"status": "ignored"})
             
             # 5. 处理群聊/私聊消息
@@ -689,9 +1179,13 @@ def wechat_callback():
             # 5.1 群聊消息(event=10008)
             if event_type == 10008:
                 logger.info("Processing group message (event=10008)")
-                query_text, direct_reply = process_group_message(message_data, effective_bot_wxid)
+                classify_started = time.monotonic()
+                query_text, direct_reply = process_group_message(message_data, effective_bot_wxid, bot, incoming)
+                if trace is not None:
+                    trace.add_span('classify', classify_started, time.monotonic())
                 if query_text is None and direct_reply is None:  # 未触发,忽略
-                    logger.info("Ignoring group message (not triggered)")
+                    logger.info("Ignoring group message (not triggered)",
+                                extra={**log_fields, 'stage': 'ignored', 'sample': 'ignored'})
                     return jsonify({"status": "ignored"})
                 target_wxid = data_info['fromWxid']  # 群ID(回复到群里)
             
@@ -701,69 +1195,62 @@ def wechat_callback():
                 query_text = process_private_message(message_data)
                 target_wxid = data_info['fromWxid']  # 好友wxid(回复到私聊)
             
-            # 6. 判断是直接回复还是通过Dify回复
-            if direct_reply:
-                # 直接回复(不经过Dify)
-                logger.info("Sending direct reply without Dify")
-                dify_reply = direct_reply
-            elif query_text:
-                # 检查输入是否为[两个汉字]的表情格式,如果是,则重置会话
-                is_input_emoji = bool(re.match(r'^\[[\u4e00-\u9fa5]{2}\]$', query_text.strip()))
-                
-                # 7. 发送到Dify获取回复
-                # 如果是表情包触发,强制reset_conversation=True (创建新会话/不带conversation_id)
-                dify_reply = send_to_dify(query_text, target_wxid, reset_conversation=is_input_emoji)
-            else:
+            # 6. 按消息类型提交到对应的优先级通道,由工作线程异步完成Dify调用和回复
+            if not direct_reply and not query_text:
                 logger.warning("Empty query text after processing")
                 return jsonify({"status": "error", "message": "Empty query text"})
             
-            # --- 新增: 黑名单检查逻辑 ---
-            # 如果Dify回复包含黑名单中的任何关键词,则直接忽略该消息
-            is_blocked = False
-            for keyword in BLACKLIST:
-                if keyword and keyword in dify_reply:
-                    logger.warning(f"Message blocked. Dify reply contains blacklist keyword: '{keyword}'")
-                    is_blocked = True
-                    break
-            
-            if is_blocked:
-                # 匹配到黑名单,直接返回成功状态但不发送消息
-                return jsonify({"status": "blocked", "message": "Content blocked by blacklist"})
-            # ---------------------------
-            
-            # 8. 发送微信回复
+            lane = get_message_lane(event_type, data_info, effective_bot_wxid)
             msg_id = data_info['msgId']  # 原消息ID(用于引用回复)
             
-            # 检查消息中是否包含图片或视频
-            has_generated_images = '![Generated Image]' in dify_reply
-            has_videos = '[点击下载视频]' in dify_reply
+            # 同一条消息被回调多次(重试或多节点都收到)时只处理一次
+            if not state.mark_seen(f"{effective_bot_wxid}:{msg_id}", STATE['dedup_ttl']):
+                logger.info("Ignoring duplicate message %s", msg_id, extra={**log_fields, 'stage': 'duplicate'})
+                metrics.incr('callback.duplicate')
+                return jsonify({"status": "duplicate"})
             
-            # 检查回复是否为[两个汉字]的表情格式
-            is_output_emoji = bool(re.match(r'^\[[\u4e00-\u9fa5]{2}\]$', dify_reply.strip()))
+            if trace is not None:
+                trace.attrs['lane'] = lane
+                trace.queued_at = time.monotonic()
             
-            if has_generated_images or has_videos:
-                # 如果包含生成的图片或视频,只发送图片/视频,不发送文本消息
-                logger.info("Message contains generated images or videos, sending media only")
-                image_count = extract_and_send_images(dify_reply, target_wxid, effective_bot_wxid)
-                video_count = extract_and_send_videos(dify_reply, target_wxid, effective_bot_wxid)
-                success = (image_count + video_count) > 0  # 只要有媒体文件发送成功就算成功
-            elif is_output_emoji:
-                # 如果是表情包回复,直接发送文本,不使用引用回复
-                logger.info("Dify reply is a simple emoji, sending direct text")
-                success = send_weixin_text(target_wxid, dify_reply, effective_bot_wxid)
+            if direct_reply:
+                future = bot.scheduler.submit(lane, run_traced, trace, handle_incoming_message, None, direct_reply,
+                                               target_wxid, msg_id, effective_bot_wxid)
             else:
-                # 普通消息,发送引用回复
-                success = send_weixin_reply(target_wxid, dify_reply, msg_id, effective_bot_wxid)
+                # 7. 准入控制: 过载时不调用Dify,表情触发(低优先级)直接丢弃,其余回复繁忙提示
+                # 表情触发同时决定低优先级和会话重置,沿用回调中的消息分类
+                is_low_priority = incoming.classify_query(query_text)
+                decision = bot.admission.try_admit(target_wxid, low_priority=is_low_priority)
+                if decision == DROP:
+                    if trace is not None:
+                        trace.finish('shed')
+                        trace_store.add(trace)
+                    return jsonify({"status": "shed"})
+                if decision == ADMIT:
+                    future = bot.scheduler.submit(lane, run_traced, trace, handle_admitted_message, query_text,
+                                                   target_wxid, msg_id, effective_bot_wxid, is_low_priority)
+                    if future is None:
+                        bot.admission.release(target_wxid)
+                else:
+                    if trace is not None:
+                        trace.attrs['busy_reply'] = True
+                    future = bot.scheduler.submit(lane, run_traced, trace, handle_incoming_message, None,
+                                                   bot.admission.busy_reply, target_wxid, msg_id, effective_bot_wxid)
             
-            # 9. 返回处理结果
-            if success:
-                return jsonify({"status": "processed"})
-            else:
-                return jsonify({"status": "error", "message": "Failed to send WeChat reply"})
+            if future is None:
+                logger.warning("Message %s rejected, lane '%s' is full", msg_id, lane)
+                metrics.incr(f'scheduler.rejected.{lane}')
+                if trace is not None:
+                    trace.finish('rejected')
+                    trace_store.add(trace)
+                return jsonify({"status": "busy", "lane": lane})
+            
+            logger.info("Message queued in lane '%s'", lane, extra={**log_fields, 'stage': 'queued'})
+            return jsonify({"status": "queued", "lane": lane})
 
         # 处理全局异常
         except Exception as e:
-            logger.error(f"Error processing message: {str(e)}", exc_info=True)
+            logger.error("Error processing message: %s", e, exc_info=True)
             return jsonify({"status": "error", "message": str(e)}), 500  # 500=服务器内部错误
 
 @app.route('/', methods=['GET'])
@@ -777,48 +1264,268 @@ def health_check():
         "timestamp": datetime.now().isoformat(),
         "config_loaded": True,
         "bot_wxid_configured": bool(BOT_WXID),
+        "bot_count": len(bots.all()),
+        "node_id": NODE_ID,
+        "leader": leader.is_leader,
         "blacklist_count": len(BLACKLIST)
     })
 
+@app.route('/ready', methods=['GET'])
+def ready_check():
+    """
+    就绪检查端点(负载均衡/部署流程使用): 连接预热和状态加载完成前返回503
+    """
+    snapshot = readiness.snapshot()
+    return jsonify(snapshot), 200 if snapshot['ready'] else 503
+
+def is_admin_request():
+    """
+    校验管理令牌(请求头X-Admin-Token或参数token),未配置profiling.token时拒绝所有请求
+    """
+    provided = request.headers.get('X-Admin-Token') or request.args.get('token')
+    return profiler.check_token(PROFILING.get('token'), provided)
+
+@app.route('/debug/scheduler', methods=['GET'])
+def scheduler_stats():
+    """
+    各机器人的优先级调度器状态: 各通道排队数、执行数和排队耗时(需要管理令牌)
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify({wxid: bot_stats['scheduler'] for wxid, bot_stats in bots.stats().items()})
+
+@app.route('/debug/bots', methods=['GET'])
+def bot_stats():
+    """
+    各机器人账号的会话数、发送限速等待、调度器和准入控制状态(需要管理令牌)
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify(bots.stats())
+
+@app.route('/debug/metrics', methods=['GET'])
+def metrics_snapshot():
+    """
+    运行计数器(含准入控制的拒绝/丢弃次数)(需要管理令牌)
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify({
+        "counters": metrics.snapshot(),
+        "admission": {(bot.wxid or "default"): bot.admission.stats() for bot in bots.all()},
+        "dify_timeouts": dify_timeouts.stats()
+    })
+
+@app.route('/debug/usage', methods=['GET'])
+def usage_snapshot():
+    """
+    Dify用量: 最近N小时按群、按应用、按小时的请求数/token/费用/延迟分位数,以及当日预算使用情况(需要管理令牌)
+    参数: hours=统计小时数(默认24), group=只看某个群/好友wxid
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    hours = request.args.get('hours', 24, type=int)
+    group = request.args.get('group') or None
+    return jsonify(usage_accounting.query(hours=max(1, hours), group=group))
+
+@app.route('/debug/traces', methods=['GET'])
+def traces_snapshot():
+    """
+    最近消息的链路追踪: 最慢的N条(各阶段耗时)及按群汇总(需要管理令牌)
+    参数: slowest=返回条数(默认20), group=只看某个群/好友wxid
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    slowest = request.args.get('slowest', 20, type=int)
+    group = request.args.get('group') or None
+    return jsonify(trace_store.query(slowest=slowest, group=group))
+
+@app.route('/broadcast', methods=['POST'])
+def create_broadcast():
+    """
+    群发(需要管理令牌): 同一条文本/媒体发送到多个群聊或好友,立即返回任务ID,进度用 GET /broadcast/<job_id> 查询
+    请求体: {"targets": [wxid, ...], "message": "文本(可包含媒体标记)", "media": [{"type": "image", "url": "..."}],
+            "prompt": "对每个目标单独调用Dify(替代message/media)", "bot_wxid": "默认为配置中的bot_wxid"}
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({"error": "request body must be a JSON object"}), 400
+    targets = body.get('targets')
+    if not isinstance(targets, list) or not all(isinstance(target, str) and target for target in targets):
+        return jsonify({"error": "targets must be a non-empty list of wxids"}), 400
+    for field in ('message', 'prompt', 'bot_wxid'):
+        if body.get(field) is not None and not isinstance(body[field], str):
+            return jsonify({"error": f"{field} must be a string"}), 400
+    media = body.get('media') or []
+    if not isinstance(media, list):
+        return jsonify({"error": "media must be a list"}), 400
+    
+    prompt = body.get('prompt')
+    segments = media_markers.tokenize(body.get('message') or '')
+    for item in media:
+        if not isinstance(item, dict):
+            return jsonify({"error": f"invalid media item: {item}"}), 400
+        marker = media_markers.by_name(item.get('type', 'image'))
+        url = item.get('url')
+        if marker is None or not isinstance(url, str) or not url:
+            return jsonify({"error": f"invalid media item: {item}"}), 400
+        segments.append((marker, url))
+    if not segments and not prompt:
+        return jsonify({"error": "message, media or prompt is required"}), 400
+    
+    bot_wxid = body.get('bot_wxid') or BOT_WXID
+    if not bot_wxid:
+        return jsonify({"error": "bot_wxid is required"}), 400
+    
+    job = BroadcastJob(bot_wxid, targets, segments=None if prompt else segments, prompt=prompt, source='api')
+    try:
+        broadcaster.submit(job)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"job_id": job.id, "total": len(job.targets), "status_url": f"/broadcast/{job.id}"}), 202
+
+@app.route('/broadcast', methods=['GET'])
+def list_broadcasts():
+    """
+    最近的群发任务及进度(需要管理令牌)
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify([job.snapshot(include_targets=False) for job in broadcaster.jobs()])
+
+@app.route('/broadcast/<job_id>', methods=['GET'])
+def broadcast_status(job_id):
+    """
+    单个群发任务的进度、吞吐量和每个目标的状态(需要管理令牌)
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    job = broadcaster.get(job_id)
+    if job is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify(job.snapshot())
+
+@app.route('/debug/profile', methods=['POST'])
+def profile_process():
+    """
+    对运行中的进程采样seconds秒,返回热点调用栈(按线程汇总 + 火焰图折叠栈)
+    参数: seconds=采样时长(默认10), interval=采样间隔, format=json|collapsed
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    
+    seconds = request.args.get('seconds', 10, type=float)
+    interval = request.args.get('interval', None, type=float)
+    logger.info("Profiling session started (%.1fs)", seconds)
+    try:
+        result = sampling_profiler.profile(seconds, interval)
+    except ProfilerBusy:
+        return jsonify({"error": "profiling session already running"}), 409
+    
+    if request.args.get('format') == 'collapsed':
+        return result['collapsed'], 200, {'Content-Type': 'text/plain; charset=utf-8'}
+    return jsonify(result)
+
+@app.route('/debug/memory', methods=['GET'])
+def memory_profile():
+    """
+    tracemalloc内存占用Top N(需先调用/debug/memory/start),以及会话相关字典的大小
+    参数: top=返回条数(默认20), group_by=lineno|filename
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    
+    top = request.args.get('top', 20, type=int)
+    key_type = 'filename' if request.args.get('group_by') == 'filename' else 'lineno'
+    return jsonify({
+        "tracing": profiler.tracemalloc.is_tracing(),
+        "snapshot": profiler.memory_snapshot(top, key_type),
+        "objects": {
+            "conversations": sum(len(bot.conversations) for bot in bots.all()),
+            "session_locks": sum(len(bot.session_locks) for bot in bots.all())
+        }
+    })
+
+@app.route('/debug/memory/start', methods=['POST'])
+def memory_profile_start():
+    """
+    开始跟踪内存分配(跟踪期间有额外开销,排查完毕后调用/debug/memory/stop)
+    """
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    profiler.memory_start(PROFILING.get('tracemalloc_frames', 1))
+    logger.info("tracemalloc started")
+    return jsonify({"tracing": True})
+
+@app.route('/debug/memory/stop', methods=['POST'])
+def memory_profile_stop():
+    if not is_admin_request():
+        return jsonify({"error": "forbidden"}), 403
+    profiler.memory_stop()
+    logger.info("tracemalloc stopped")
+    return jsonify({"tracing": False})
+
 if __name__ == '__main__':
     # 从配置文件读取服务器设置
     host = config['server']['host']
     port = config['server']['port']
     debug = config['server']['debug']
     
-    logger.info(f"Starting WeChat-Dify bridge server on http://{host}:{port}")
-    logger.info(f"Callback URL (for 千寻框架): http://127.0.0.1:{port}/wechat/callback")
-    logger.info(f"Trigger keywords: {', '.join(TRIGGER_KEYWORDS)}")
+    logger.info("Starting WeChat-Dify bridge server on http://%s:%s", host, port)
+    logger.info("Callback URL (for 千寻框架): http://127.0.0.1:%s/wechat/callback", port)
+    logger.info("Trigger keywords: %s", ', '.join(TRIGGER_KEYWORDS))
     
     # 显示bot_wxid配置状态
     if BOT_WXID:
-        logger.info(f"Bot wxid configured: {BOT_WXID}")
+        logger.info("Bot wxid configured: %s", BOT_WXID)
     else:
         logger.warning("Bot wxid not configured in config.json, will use wxid from callback messages")
     
     # 显示黑名单信息
     if BLACKLIST:
-        logger.info(f"Blacklist loaded with {len(BLACKLIST)} keywords")
+        logger.info("Blacklist loaded with %s keywords", len(BLACKLIST))
     else:
         logger.info("No blacklist keywords configured")
         
     # 显示群聊映射配置
     group_mapping = config['dify'].get('group_mapping', {})
     if group_mapping:
-        logger.info(f"Group mappings configured: {len(group_mapping)} group(s)")
+        logger.info("Group mappings configured: %s group(s)", len(group_mapping))
         for group_id, group_config in group_mapping.items():
             desc = group_config.get('description', 'No description')
-            logger.info(f"  - {group_id}: {desc}")
+            logger.info("  - %s: %s", group_id, desc)
     else:
         logger.info("No group mappings configured, all groups will use default Dify config")
     
-    # 初始化定时任务调度器
+    # 显示机器人账号
+    for bot in bots.all():
+        logger.info("Bot %s: %s worker(s) %s", bot.wxid or '(callback wxid)', bot.scheduler.workers, bot.description)
+    
+    # 启动各机器人的优先级工作调度器
+    bots.start()
+    usage_accounting.start()
+    
+    # 就绪阶段在后台执行,完成前/ready返回503
+    threading.Thread(target=prepare_readiness, name="warmup", daemon=True).start()
+    
+    # 参与定时任务主节点选举,然后初始化定时任务调度器(每个节点都加载,只有主节点执行)
+    leader.start()
     scheduler = init_scheduler()
     
+    # SIGTERM(部署/滚动重启)时先排空再退出
+    signal.signal(signal.SIGTERM, lambda signum, frame: handle_sigterm(scheduler))
+    
     try:
         app.run(host=host, port=port, debug=debug)
     except (KeyboardInterrupt, SystemExit):
-        logger.info("Shutting down scheduler...")
-        if scheduler:
-            scheduler.shutdown()
-        logger.info("Server stopped")
+        pass
+    # Ctrl+C时在这里排空;SIGTERM触发的排空已在后台完成(或等待其完成)
+    drain(scheduler)
+    logger.info("Server stopped")
+    if log_listener:
+        log_listener.stop()
@@ -0,0 +1,114 @@
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from metrics import metrics
+
+DEFAULT_LOGGING_CONFIG = {
+    "mode": "sync",          # sync: 请求线程直接写stderr; async: 有界队列 + 后台写线程
+    "format": "text",        # text: 原有文本格式; json: 每行一条JSON记录
+    "level": "INFO",
+    "queue_size": 10000,     # async模式下队列上限,满了直接丢弃并计数
+    "sample_rates": {        # async模式下按记录的sample标签采样,N表示每N条保留1条
+        "ignored": 100
+    }
+}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 结构化字段,通过 logger.info(..., extra={...}) 传入
+STRUCTURED_FIELDS = ('msgId', 'wxid', 'stage', 'duration_ms')
+
+
+class JsonLineFormatter(logging.Formatter):
+    """
+    每条记录输出一行紧凑JSON,包含msgId/wxid/stage/duration_ms等结构化字段
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, separators=(',', ':'))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    高频日志采样: 带有sample标签的记录每N条只保留1条
+    用法: logger.info("...", extra={'sample': 'ignored'})
+    """
+
+    def __init__(self, sample_rates):
+        super().__init__()
+        self.sample_rates = {tag: max(1, int(rate)) for tag, rate in (sample_rates or {}).items()}
+        self._counters = {tag: itertools.count() for tag in self.sample_rates}
+
+    def filter(self, record):
+        tag = getattr(record, 'sample', None)
+        if tag is None or tag not in self.sample_rates:
+            return True
+        # itertools.count的next()在CPython中是原子操作,不需要加锁
+        return next(self._counters[tag]) % self.sample_rates[tag] == 0
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    请求线程只把LogRecord放进有界队列,不做格式化;
+    消息拼接(getMessage)和格式化都在后台写线程中完成
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr('logging.dropped')
+
+
+def setup_logging(logging_config=None):
+    """
+    根据配置初始化根日志
+    返回: async模式下返回QueueListener(退出前需要调用stop()刷新队列),否则返回None
+    """
+    logging_config = {**DEFAULT_LOGGING_CONFIG, **(logging_config or {})}
+    level = getattr(logging, str(logging_config['level']).upper(), logging.INFO)
+
+    if logging_config['format'] == 'json':
+        formatter = JsonLineFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+
+    if logging_config['mode'] != 'async':
+        root.addHandler(stream_handler)
+        return None
+
+    log_queue = queue.Queue(maxsize=max(1, int(logging_config['queue_size'])))
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    # 采样在请求线程中进行,被丢弃的记录不会进入队列
+    queue_handler.addFilter(SamplingFilter(logging_config['sample_rates']))
+    root.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
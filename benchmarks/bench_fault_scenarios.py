@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+故障场景测试: 在本地故障注入模拟服务(fault_stub.py)上运行完整的消息处理流程
+(handle_incoming_message: Dify调用、404会话重试、黑名单、发件箱、千寻发送),逐个场景检查:
+- 吞吐量(条/秒)不低于下限
+- p99耗时不超过上限
+- 处理过程中没有未捕获的异常
+- 场景结束后没有残留线程
+- 重复运行基线场景后内存(tracemalloc)增长不超过上限
+
+在临时目录中生成config.json并导入app(不会改动仓库中的config.json),需要安装flask和requests
+任一检查失败时以非0退出
+
+运行: python benchmarks/bench_fault_scenarios.py [--messages 200] [--workers 16] [--only 连接重置]
+pytest中由tests/test_fault_scenarios.py以默认参数运行
+"""
+
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from fault_stub import FaultStub
+
+BOT_WXID = "wxid_faultbench"
+DIFY_TIMEOUT = 3
+USERS = 20
+
+# 每个场景: 两个上游的故障配置 + 阈值
+# 同一用户的消息按会话锁串行处理,排在超时请求后面的消息最多再等一个Dify超时,
+# 所以有超时的场景p99上限为两个超时加余量
+SCENARIOS = [
+    {"name": "无故障基线", "dify": {"latency": 0.02}, "qianxun": {},
+     "min_throughput": 50, "max_p99": 0.5},
+    {"name": "Dify延迟尖刺", "dify": {"latency": 0.02, "spike_rate": 0.05, "spike_latency": DIFY_TIMEOUT + 2},
+     "qianxun": {}, "min_throughput": 10, "max_p99": DIFY_TIMEOUT * 2 + 1},
+    {"name": "连接重置", "dify": {"latency": 0.02, "reset_rate": 0.2}, "qianxun": {"reset_rate": 0.1},
+     "min_throughput": 50, "max_p99": 0.5},
+    {"name": "Dify 429/5xx", "dify": {"latency": 0.02, "status_rates": {"429": 0.1, "500": 0.05, "503": 0.05}},
+     "qianxun": {}, "min_throughput": 50, "max_p99": 0.5},
+    {"name": "会话404重试", "dify": {"latency": 0.02, "conversation_404_rate": 0.3}, "qianxun": {},
+     "min_throughput": 40, "max_p99": 0.5},
+    {"name": "慢速响应体", "dify": {"latency": 0.02, "drip_rate": 0.2, "drip_interval": 0.02}, "qianxun": {},
+     "min_throughput": 20, "max_p99": 2.0},
+    {"name": "千寻code!=200/502", "dify": {"latency": 0.02},
+     "qianxun": {"error_code_rate": 0.3, "status_rates": {"502": 0.05}},
+     "min_throughput": 50, "max_p99": 0.5},
+    {"name": "混合故障", "dify": {"latency": 0.02, "spike_rate": 0.02, "spike_latency": DIFY_TIMEOUT + 2,
+                              "reset_rate": 0.05, "status_rates": {"429": 0.05, "500": 0.02},
+                              "conversation_404_rate": 0.1, "drip_rate": 0.05, "drip_interval": 0.01},
+     "qianxun": {"reset_rate": 0.02, "error_code_rate": 0.1, "latency": 0.01},
+     "min_throughput": 10, "max_p99": DIFY_TIMEOUT * 2 + 1},
+]
+
+
+def write_config(workdir, base_url):
+    config = {
+        "bot_wxid": BOT_WXID,
+        "dify": {
+            "default": {"api_url": f"{base_url}/v1/chat-messages", "api_key": "app-faultbench",
+                        "timeout": DIFY_TIMEOUT, "description": "fault-bench"},
+            "group_mapping": {}
+        },
+        "weixin": {"api_url": f"{base_url}/qianxun/httpapi"},
+        "server": {"host": "127.0.0.1", "port": 0, "debug": False},
+        "trigger_keywords": ["@AI小朋"],
+        "blacklist": [],
+        "messages": {
+            "empty_message_reply": "empty",
+            "default_reply": "default",
+            "service_unavailable": "unavailable:"
+        },
+        "scheduled_tasks": [],
+        "scheduler": {"workers": 4},
+        "admission": {"enabled": False},
+        "outbound": {"rate": 0},
+        "state": {"backend": "memory", "memory_snapshot": ""},
+        "usage": {"path": os.path.join(workdir, "usage.json")},
+        "warmup": {"enabled": False},
+        "logging": {"level": "CRITICAL"}
+    }
+    with open(os.path.join(workdir, 'config.json'), 'w', encoding='utf-8') as f:
+        json.dump(config, f, ensure_ascii=False)
+
+
+def bridge_threads():
+    # 模拟服务为每个连接创建的处理线程不计入(数量随连接池中的长连接变化)
+    return sorted(thread.name for thread in threading.enumerate()
+                  if 'process_request_thread' not in thread.name)
+
+
+def run_scenario(app, stub, scenario, messages, workers, round_id):
+    stub.configure({"dify": scenario['dify'], "qianxun": scenario['qianxun']})
+    latencies = []
+    errors = []
+
+    def one(idx):
+        started_at = time.monotonic()
+        try:
+            app.handle_incoming_message(f"第{idx}条消息", None, f"wxid_user{idx % USERS}",
+                                        f"{round_id}-{idx}", BOT_WXID)
+        except Exception as e:
+            errors.append(repr(e))
+        latencies.append(time.monotonic() - started_at)
+
+    started_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(one, range(messages)))
+    elapsed = time.monotonic() - started_at
+
+    latencies.sort()
+    return {
+        "throughput": messages / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "errors": errors,
+        "counters": stub.stats()['counters']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dify/千寻 故障场景测试")
+    parser.add_argument('--messages', type=int, default=200, help='每个场景的消息数')
+    parser.add_argument('--workers', type=int, default=16, help='并发处理线程数')
+    parser.add_argument('--only', default='', help='只运行名称包含该字符串的场景')
+    parser.add_argument('--max-memory-kb', type=float, default=2048, help='重复运行基线后允许的内存增长')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    stub = FaultStub(seed=args.seed).start()
+    workdir = tempfile.mkdtemp(prefix='fault-bench-')
+    write_config(workdir, stub.base_url)
+    os.chdir(workdir)
+    try:
+        import app
+    except ImportError as e:
+        print(f"import app 失败(缺少依赖?): {e}")
+        sys.exit(2)
+
+    scenarios = [scenario for scenario in SCENARIOS if args.only in scenario['name']]
+    baseline = SCENARIOS[0]
+    failures = []
+
+    # 预热一轮(连接池、惰性初始化),之后记录线程和内存基准
+    tracemalloc.start()
+    run_scenario(app, stub, baseline, args.messages, args.workers, 'warmup')
+    gc.collect()
+    threads_before = bridge_threads()
+    memory_before = tracemalloc.get_traced_memory()[0]
+
+    print("=" * 78)
+    print(f"{'场景':<20}{'吞吐(条/秒)':>12}{'p50(ms)':>10}{'p99(ms)':>10}{'异常':>6}  注入统计")
+    print("=" * 78)
+    for round_id, scenario in enumerate(scenarios):
+        result = run_scenario(app, stub, scenario, args.messages, args.workers, round_id)
+        injected = ', '.join(f"{key}={value}" for key, value in sorted(result['counters'].items())
+                             if not key.endswith(('.requests', '.ok')))
+        print(f"{scenario['name']:<20}{result['throughput']:>12.1f}{result['p50'] * 1000:>10.1f}"
+              f"{result['p99'] * 1000:>10.1f}{len(result['errors']):>6}  {injected or '-'}")
+
+        if result['throughput'] < scenario['min_throughput']:
+            failures.append(f"{scenario['name']}: 吞吐 {result['throughput']:.1f} < {scenario['min_throughput']}")
+        if result['p99'] > scenario['max_p99']:
+            failures.append(f"{scenario['name']}: p99 {result['p99']:.2f}s > {scenario['max_p99']}s")
+        if result['errors']:
+            failures.append(f"{scenario['name']}: {len(result['errors'])} 个未捕获异常, 例如 {result['errors'][0]}")
+
+    # 故障结束后重复基线,检查线程和内存是否回到原水平
+    for round_id in range(2):
+        run_scenario(app, stub, baseline, args.messages, args.workers, f'recheck{round_id}')
+    gc.collect()
+    threads_after = bridge_threads()
+    memory_growth_kb = (tracemalloc.get_traced_memory()[0] - memory_before) / 1024
+    tracemalloc.stop()
+    print("=" * 78)
+    print(f"线程: {len(threads_before)} -> {len(threads_after)}, 内存增长: {memory_growth_kb:.1f}KB")
+
+    leaked = sorted(set(threads_after) - set(threads_before))
+    if leaked:
+        failures.append(f"残留线程: {', '.join(leaked)}")
+    if memory_growth_kb > args.max_memory_kb:
+        failures.append(f"内存增长 {memory_growth_kb:.1f}KB > {args.max_memory_kb}KB")
+
+    stub.stop()
+    if failures:
+        print("失败:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("全部场景通过")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时与首条消息延迟基准测试
+1. 启动耗时: 在临时目录中多次执行 import app(不会改动仓库中的config.json),取中位数
+2. 首条消息延迟: 本地模拟上游(HTTP/1.1长连接),对比"新建连接"和"预热后复用连接池"的首个请求耗时
+   本地回环上没有DNS和TLS开销,模拟服务对每个新连接等待 --handshake-ms 模拟建连耗时;
+   可用 --upstream 指定真实地址
+
+预热后的首个请求不比新建连接快时以非0退出(只检查本地模拟上游)
+
+运行: python benchmarks/bench_startup.py [--rounds 5] [--upstream http://host:port/path]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from warmup import create_session, warm_up
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+
+
+class UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体分两次写出;不关闭Nagle时,长连接上的第二次写要等客户端的延迟ACK(约40ms),
+    # 复用连接反而比新建连接慢,测出的是模拟服务的问题而不是预热的效果
+    disable_nagle_algorithm = True
+    # 每个新连接先等待该秒数,模拟真实上游的TLS握手等建连耗时
+    handshake_delay = 0.0
+
+    def setup(self):
+        super().setup()
+        if self.handshake_delay > 0:
+            time.sleep(self.handshake_delay)
+
+    def _reply(self, body=b'{"code": 200}'):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._reply()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self._reply()
+
+    def log_message(self, *args):
+        pass
+
+
+def bench_import(rounds):
+    samples = []
+    env = {**os.environ, "PYTHONPATH": REPO_ROOT}
+    for _ in range(rounds):
+        with tempfile.TemporaryDirectory() as workdir:
+            result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=workdir, env=env,
+                                    capture_output=True, text=True)
+        if result.returncode != 0:
+            print("import app 失败(缺少依赖?),跳过启动耗时测试:")
+            print(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else result.returncode)
+            return
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    print(f"import app: 中位数 {statistics.median(samples) * 1000:.1f}ms, "
+          f"最小 {min(samples) * 1000:.1f}ms ({rounds} 次)")
+
+
+def first_request_ms(url, warm):
+    session = create_session()
+    if warm:
+        warm_up(session, [url])
+    started_at = time.perf_counter()
+    session.post(url, json={"query": "你好"}, timeout=10)
+    elapsed = (time.perf_counter() - started_at) * 1000
+    session.close()
+    return elapsed
+
+
+def bench_first_message(url, rounds):
+    cold = [first_request_ms(url, warm=False) for _ in range(rounds)]
+    warm = [first_request_ms(url, warm=True) for _ in range(rounds)]
+    cold_ms = statistics.median(cold)
+    warm_ms = statistics.median(warm)
+    print(f"首个请求(新建连接):   {cold_ms:.2f}ms")
+    print(f"首个请求(预热连接池): {warm_ms:.2f}ms")
+    print(f"节省: {cold_ms - warm_ms:.2f}ms/次")
+    return cold_ms, warm_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时与首条消息延迟基准测试")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--upstream', default='', help='真实上游地址,默认使用本地模拟服务')
+    parser.add_argument('--handshake-ms', type=float, default=5, help='本地模拟服务每个新连接的建连耗时(毫秒)')
+    args = parser.parse_args()
+
+    bench_import(args.rounds)
+
+    if args.upstream:
+        bench_first_message(args.upstream, args.rounds)
+        return
+
+    UpstreamHandler.handshake_delay = args.handshake_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), UpstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        cold_ms, warm_ms = bench_first_message(f"http://127.0.0.1:{server.server_address[1]}/v1/chat-messages",
+                                               args.rounds * 4)
+    finally:
+        server.shutdown()
+    if warm_ms >= cold_ms:
+        print("回归: 预热连接池后的首个请求没有比新建连接快")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
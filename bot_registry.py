@@ -0,0 +1,200 @@
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+from priority_scheduler import PriorityScheduler
+from admission import AdmissionController
+from callback_filter import CallbackPrefilter
+from state_backend import MemoryStateBackend, ConversationMap
+from trigger_limiter import TriggerLimiter
+
+logger = logging.getLogger(__name__)
+
+# 单个机器人账号发往千寻的消息速率(条/秒)和突发上限,rate<=0表示不限速
+DEFAULT_OUTBOUND_LIMIT = {"rate": 3.0, "burst": 10}
+
+# 从原始回调中读取机器人wxid(顶层wxid字段),只用于选择预过滤器
+CALLBACK_WXID_PATTERN = re.compile(rb'"wxid"\s*:\s*"([^"\\]+)"')
+
+
+class RateLimiter:
+    """
+    令牌桶限速器,acquire()在没有令牌时阻塞等待
+    """
+
+    def __init__(self, rate=3.0, burst=10):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited = 0.0  # 累计等待秒数
+
+    def acquire(self):
+        """
+        取一个令牌
+        返回: 本次等待的秒数
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.waited += waited
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class Bot:
+    """
+    单个千寻机器人账号及其独立的资源:
+    Dify路由、会话命名空间、工作线程池、准入控制、发送限速、群聊触发限流
+    未单独配置的项使用config.json顶层配置
+    """
+
+    def __init__(self, wxid, bot_config, base_config, state):
+        self.wxid = wxid
+        self.description = bot_config.get('description', '')
+        self.dify = bot_config.get('dify') or base_config['dify']
+        self.trigger_keywords = bot_config.get('trigger_keywords') or base_config['trigger_keywords']
+
+        name = f"bot-{wxid[-6:]}" if wxid else "lane-worker"
+        self.scheduler = PriorityScheduler(bot_config.get('scheduler') or base_config.get('scheduler', {}), name=name)
+        self.admission = AdmissionController(bot_config.get('admission') or base_config.get('admission', {}),
+                                             concurrency=self.scheduler.workers)
+        self.prefilter = CallbackPrefilter(wxid, self.trigger_keywords)
+        outbound = {**DEFAULT_OUTBOUND_LIMIT, **(bot_config.get('outbound') or base_config.get('outbound', {}))}
+        self.outbound = RateLimiter(outbound['rate'], outbound['burst'])
+        self.trigger_limiter = TriggerLimiter(bot_config.get('rate_limit') or base_config.get('rate_limit', {}))
+
+        # 会话命名空间: 同一个群在不同机器人下的会话互不影响
+        # 格式: {from_wxid: conversation_id},保存在状态后端中,多个节点共享
+        self.conversations = ConversationMap(state, wxid or 'default')
+        self.session_locks = defaultdict(threading.Lock)
+
+    def get_dify_config(self, wxid):
+        """
+        根据wxid获取该机器人对应的Dify配置
+        如果是群聊且有专门配置,返回群聊配置;否则返回默认配置
+        """
+        group_mapping = self.dify.get('group_mapping', {})
+        if '@chatroom' in wxid and wxid in group_mapping:
+            logger.info("Using specific Dify config for group: %s", wxid)
+            return group_mapping[wxid]
+        logger.info("Using default Dify config for: %s", wxid)
+        return self.dify['default']
+
+    def group_rate_limit(self, group_wxid):
+        """
+        返回: group_mapping中该群的限流配置(覆盖默认值),未配置时返回None
+        """
+        return self.dify.get('group_mapping', {}).get(group_wxid, {}).get('rate_limit')
+
+    def stats(self):
+        return {
+            "description": self.description,
+            "conversations": len(self.conversations),
+            "outbound_wait_seconds": round(self.outbound.waited, 3),
+            "rate_limit": self.trigger_limiter.stats(),
+            "scheduler": self.scheduler.stats(),
+            "admission": self.admission.stats()
+        }
+
+
+class BotRegistry:
+    """
+    按回调中的wxid查找机器人
+    - config.json的bots中每一项是一个独立的机器人账号
+    - 顶层bot_wxid(或未配置bots时)作为默认机器人;顶层bot_wxid为空时默认机器人接收所有回调
+    """
+
+    def __init__(self, config, state=None):
+        state = state or MemoryStateBackend()
+        default_wxid = config.get('bot_wxid', '')
+        bots_config = config.get('bots', {})
+
+        self.bots = {}
+        for wxid, bot_config in bots_config.items():
+            self.bots[wxid] = Bot(wxid, bot_config, config, state)
+
+        if default_wxid in self.bots:
+            self.default = self.bots[default_wxid]
+        else:
+            self.default = Bot(default_wxid, {}, config, state)
+            if default_wxid:
+                self.bots[default_wxid] = self.default
+        # 未配置bots或顶层bot_wxid为空时,所有未登记的回调都交给默认机器人(与单账号部署的行为一致)
+        self.catch_all = not bots_config or not default_wxid
+
+    def resolve(self, wxid):
+        """
+        返回: 回调wxid对应的机器人;未登记的账号返回None
+        """
+        bot = self.bots.get(wxid)
+        if bot is None and self.catch_all:
+            return self.default
+        return bot
+
+    def should_handle(self, raw_body):
+        """
+        用对应机器人的预过滤器判断原始回调;无法确定是哪个机器人时交给完整流程
+        """
+        match = CALLBACK_WXID_PATTERN.search(raw_body)
+        if match is None:
+            return True
+        bot = self.resolve(match.group(1).decode('utf-8', errors='ignore'))
+        if bot is None:
+            return True
+        return bot.prefilter.should_handle(raw_body)
+
+    def throttle(self, wxid):
+        """
+        按机器人发送限速,阻塞到可以发送为止
+        """
+        bot = self.resolve(wxid)
+        if bot is not None:
+            waited = bot.outbound.acquire()
+            if waited > 0:
+                logger.info("Outbound rate limit for bot %s, waited %.2fs", wxid, waited)
+
+    def all(self):
+        bots = list(self.bots.values())
+        if self.default not in bots:
+            bots.append(self.default)
+        return bots
+
+    def start(self):
+        for bot in self.all():
+            bot.scheduler.start()
+
+    def shutdown(self, wait=True):
+        for bot in self.all():
+            bot.scheduler.shutdown(wait=wait)
+
+    def drain(self, timeout):
+        """
+        所有机器人同时停止接收新任务,在共同的截止时间前等待各自的任务完成
+        返回: (未执行的任务, 仍在执行的任务),每项为(通道名, func, args, kwargs)
+        """
+        deadline = time.monotonic() + timeout
+        for bot in self.all():
+            bot.scheduler.shutdown(wait=False)
+        queued, running = [], []
+        for bot in self.all():
+            bot_queued, bot_running = bot.scheduler.drain(deadline - time.monotonic())
+            queued.extend(bot_queued)
+            running.extend(bot_running)
+        return queued, running
+
+    def stats(self):
+        return {(bot.wxid or "default"): bot.stats() for bot in self.all()}
@@ -0,0 +1,288 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROADCAST_CONFIG = {
+    "lane": "scheduled",       # 发送任务所在的调度通道(与定时任务共用最低优先级,不挤占私聊/@消息)
+    "concurrency": 2,          # 单个群发任务同时发送的目标数(同时受通道max_concurrency和发送限速约束)
+    "retries": 2,              # 单个目标发送失败后的重试次数(从失败的分段继续,不重发已发出的分段)
+    "retry_backoff": 5,        # 第n次重试前等待 n*retry_backoff 秒
+    "max_targets": 1000,       # 单个任务最多的目标数
+    # 媒体先下载一次到本地,所有目标共用(千寻不必为每个目标重复下载)
+    # 只在千寻与本服务在同一台机器上(能读取media_dir)时开启;本地文件发送失败时仍改用原URL发送
+    "prefetch_media": False,
+    "media_dir": "broadcast_media",  # 预取文件目录
+    "keep_jobs": 100           # 内存中保留的最近任务数(用于查询进度)
+}
+
+# 目标状态
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class BroadcastSkipped(Exception):
+    """
+    目标无需再发送(例如Dify回复命中黑名单),不重试
+    """
+
+
+class BroadcastTarget:
+    """
+    单个目标的发送状态
+    """
+
+    __slots__ = ('wxid', 'state', 'attempts', 'error', 'next_segment', 'segments', 'retry_at', 'finished_at')
+
+    def __init__(self, wxid):
+        self.wxid = wxid
+        self.state = PENDING
+        self.attempts = 0
+        self.error = None
+        self.next_segment = 0   # 下一个要发送的分段(重试时从这里继续)
+        self.segments = None    # prompt任务: 该目标的Dify回复分段
+        self.retry_at = 0.0
+        self.finished_at = None
+
+    def snapshot(self):
+        return {
+            "wxid": self.wxid,
+            "state": self.state,
+            "attempts": self.attempts,
+            "error": self.error,
+            "finished_at": self.finished_at
+        }
+
+
+class BroadcastJob:
+    """
+    一次群发: 同一内容(文本/媒体分段)或同一prompt(每个目标单独调用Dify)发送到多个目标
+    """
+
+    def __init__(self, bot_wxid, targets, segments=None, prompt=None, source='api'):
+        self.id = uuid.uuid4().hex[:12]
+        self.bot_wxid = bot_wxid
+        self.segments = segments or []
+        self.prompt = prompt
+        self.source = source
+        self.targets = OrderedDict((wxid, BroadcastTarget(wxid)) for wxid in dict.fromkeys(targets))
+        self.media_paths = {}   # 媒体URL -> 预取后的本地路径
+        self.state = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+        self._queue = deque(self.targets.values())
+        self._runners = 0
+
+    def next_target(self):
+        """
+        取出下一个可以发送的目标(首次发送或重试等待期已过)
+        返回: (目标, 0);待发送目标都还在重试等待期时返回(None, 最短等待秒数);没有待发送目标时返回(None, 0)
+        """
+        with self._lock:
+            now = time.monotonic()
+            for idx, target in enumerate(self._queue):
+                if target.retry_at <= now:
+                    del self._queue[idx]
+                    target.state = SENDING
+                    return target, 0.0
+            if not self._queue:
+                return None, 0.0
+            return None, min(target.retry_at for target in self._queue) - now
+
+    def requeue(self, target, delay):
+        with self._lock:
+            target.state = PENDING
+            target.retry_at = time.monotonic() + delay
+            self._queue.append(target)
+
+    def unfinished(self):
+        """
+        返回: 还没有发送完成的目标(等待发送、等待重试和正在发送),排空退出时写入发件箱
+        正在发送的目标从未发出的分段继续,正在发送的那一段可能重复发送
+        """
+        with self._lock:
+            return [target for target in self.targets.values() if target.state in (PENDING, SENDING)]
+
+    def counts(self):
+        counts = {PENDING: 0, SENDING: 0, SENT: 0, FAILED: 0, SKIPPED: 0}
+        for target in self.targets.values():
+            counts[target.state] += 1
+        return counts
+
+    def snapshot(self, include_targets=True):
+        counts = self.counts()
+        done = counts[SENT] + counts[FAILED] + counts[SKIPPED]
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        result = {
+            "job_id": self.id,
+            "source": self.source,
+            "bot_wxid": self.bot_wxid,
+            "state": self.state,
+            "total": len(self.targets),
+            "counts": counts,
+            "progress": round(done / len(self.targets), 3) if self.targets else 1.0,
+            "elapsed_seconds": round(elapsed, 3),
+            "throughput_per_second": round(counts[SENT] / elapsed, 3) if elapsed > 0 else 0.0,
+            "created": self.created
+        }
+        if include_targets:
+            result["targets"] = [target.snapshot() for target in self.targets.values()]
+        return result
+
+
+class Broadcaster:
+    """
+    群发引擎: 每个任务向机器人调度器提交concurrency个发送者,发送者依次取目标发送,
+    失败的目标放回队尾等待重试;剩下的目标都在等待重试时发送者先退出,由定时器到期后重新提交,
+    不占用调度通道的工作线程;发送速率由机器人的发往千寻限速控制
+    HTTP群发接口和定时任务共用
+    """
+
+    def __init__(self, broadcast_config, bots, send_target, prefetch=None, cleanup=None):
+        """
+        :param send_target: send_target(job, target) 发送该目标剩余的分段,返回是否成功;无需再发送时抛出BroadcastSkipped
+        :param prefetch: prefetch(job, url) 下载媒体到本地,返回本地路径(失败返回None,继续使用URL)
+        :param cleanup: cleanup(job) 任务结束后删除预取文件
+        """
+        self.config = {**DEFAULT_BROADCAST_CONFIG, **(broadcast_config or {})}
+        self.bots = bots
+        self.send_target = send_target
+        self.prefetch = prefetch
+        self.cleanup = cleanup
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def submit(self, job):
+        """
+        开始一个群发任务
+        返回: 任务;没有目标、目标数超限或机器人不存在时抛出ValueError,调度队列已满时抛出RuntimeError
+        """
+        if not job.targets:
+            raise ValueError("no targets")
+        if len(job.targets) > int(self.config['max_targets']):
+            raise ValueError(f"too many targets (max {self.config['max_targets']})")
+        bot = self.bots.resolve(job.bot_wxid)
+        if bot is None:
+            raise ValueError(f"unknown bot {job.bot_wxid}")
+
+        with self._lock:
+            self._jobs[job.id] = job
+            self._evict()
+        # 预取和启动发送者也在调度通道中执行,不阻塞HTTP请求线程和APScheduler线程
+        if bot.scheduler.submit(self.config['lane'], self._start, job) is None:
+            job.state = 'rejected'
+            raise RuntimeError("scheduler queue full")
+        metrics.incr('broadcast.jobs')
+        logger.info("Broadcast job %s (%s) queued for %s target(s)", job.id, job.source, len(job.targets))
+        return job
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in ('done', 'rejected')]
+        while len(self._jobs) > int(self.config['keep_jobs']) and finished:
+            self._jobs.pop(finished.pop(0), None)
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _start(self, job):
+        job.state = 'running'
+        job.started = time.time()
+        if self.prefetch and self.config['prefetch_media']:
+            for marker, content in job.segments:
+                if marker is not None and content not in job.media_paths:
+                    path = self.prefetch(job, content)
+                    if path:
+                        job.media_paths[content] = path
+
+        bot = self.bots.resolve(job.bot_wxid)
+        runners = max(1, min(int(self.config['concurrency']), len(job.targets)))
+        # 先登记全部发送者,避免第一个发送者在其余发送者提交前就把任务标记为完成
+        with job._lock:
+            job._runners = runners
+        for _ in range(runners):
+            if bot.scheduler.submit(self.config['lane'], self._run, job) is None:
+                logger.error("Broadcast job %s could not start a sender, scheduler queue full", job.id)
+                self._runner_done(job)
+
+    def _run(self, job):
+        retries = int(self.config['retries'])
+        backoff = float(self.config['retry_backoff'])
+        resumed_later = False
+        try:
+            while True:
+                target, wait = job.next_target()
+                if target is None:
+                    if wait > 0:
+                        # 发送者的名额交给定时器,任务在重试结束前不会被标记为完成
+                        resumed_later = True
+                        self._resume_later(job, wait)
+                    return
+
+                target.attempts += 1
+                try:
+                    sent = self.send_target(job, target)
+                    error = None if sent else 'send failed'
+                except BroadcastSkipped as e:
+                    target.state, target.error, target.finished_at = SKIPPED, str(e), time.time()
+                    metrics.incr('broadcast.skipped')
+                    continue
+                except Exception as e:
+                    logger.error("Broadcast job %s target %s failed: %s", job.id, target.wxid, e, exc_info=True)
+                    sent, error = False, str(e)
+
+                if sent:
+                    target.state, target.error, target.finished_at = SENT, None, time.time()
+                    metrics.incr('broadcast.sent')
+                elif target.attempts <= retries:
+                    target.error = error
+                    metrics.incr('broadcast.retried')
+                    job.requeue(target, backoff * target.attempts)
+                else:
+                    target.state, target.error, target.finished_at = FAILED, error, time.time()
+                    metrics.incr('broadcast.failed')
+        finally:
+            if not resumed_later:
+                self._runner_done(job)
+
+    def _resume_later(self, job, delay):
+        timer = threading.Timer(delay, self._resume, args=(job,))
+        timer.daemon = True
+        timer.start()
+
+    def _resume(self, job):
+        bot = self.bots.resolve(job.bot_wxid)
+        if bot is None or bot.scheduler.submit(self.config['lane'], self._run, job) is None:
+            # 调度器已停止(正在退出)或队列已满: 剩余目标保持待发送,退出时写入发件箱
+            logger.error("Broadcast job %s could not resume a sender for retries", job.id)
+            self._runner_done(job)
+
+    def _runner_done(self, job):
+        with job._lock:
+            job._runners -= 1
+            if job._runners > 0:
+                return
+        job.state = 'done'
+        job.finished = time.time()
+        counts = job.counts()
+        logger.info("Broadcast job %s finished: %s sent, %s failed, %s skipped, %s pending",
+                    job.id, counts[SENT], counts[FAILED], counts[SKIPPED], counts[PENDING])
+        if self.cleanup:
+            try:
+                self.cleanup(job)
+            except OSError as e:
+                logger.error("Failed to clean up media for broadcast job %s: %s", job.id, e)
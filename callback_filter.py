@@ -0,0 +1,68 @@
+import json
+import re
+
+# 从原始请求体中读取字段的正则(bytes),只查找不解析整个JSON
+EVENT_PATTERN = re.compile(rb'"event"\s*:\s*(\d+)')
+SELF_SENT_PATTERN = re.compile(rb'"msgSource"\s*:\s*1\b')
+AT_LIST_PATTERN = re.compile(rb'"atWxidList"\s*:\s*\[([^\]]*)\]')
+# \u转义和可选的\/转义(一次正则扫描比两次双字节子串查找快)
+ESCAPE_PATTERN = re.compile(rb'\\[u/]')
+# str.strip()会去掉的非ASCII空白(如全角空格),在UTF-8请求体中以原始字节出现
+# ASCII控制字符在JSON中只能以\uXXXX或\f等转义出现,\u转义的请求体会交给完整流程
+_UNICODE_SPACES = b'|'.join(re.escape(chr(code).encode('utf-8'))
+                            for code in range(0x80, 0x3001) if chr(code).isspace())
+# 消息以[开头(可能是[两个汉字]表情触发),允许前导空白/转义空白
+EMOJI_CANDIDATE_PATTERN = re.compile(rb'"msg"\s*:\s*"(?:\s|\\[nrtf]|' + _UNICODE_SPACES + rb')*\[')
+
+GROUP_EVENT = b'10008'
+
+
+class CallbackPrefilter:
+    """
+    群聊回调快速预过滤
+    在完整解析JSON和记录日志之前,直接在原始请求体上判断消息是否可能触发机器人:
+    - 非群聊事件、无法确定的情况一律交给完整流程(保守策略,不会漏处理)
+    - 机器人自己发送的消息(msgSource=1)直接忽略
+    - 既没有@机器人、也不包含触发关键词、也不是表情触发的群消息直接忽略
+    """
+
+    def __init__(self, bot_wxid, trigger_keywords):
+        # bot_wxid为空时无法判断@的是谁,只要atWxidList不为空就交给完整流程
+        self.bot_wxid = self._encode(bot_wxid) if bot_wxid else None
+        # 关键词按JSON转义后的形式匹配原始请求体
+        self.keywords = [self._encode(keyword) for keyword in trigger_keywords if keyword]
+
+    @staticmethod
+    def _encode(text):
+        return json.dumps(text, ensure_ascii=False)[1:-1].encode('utf-8')
+
+    def should_handle(self, raw_body):
+        """
+        返回: True表示需要走完整流程,False表示可以直接忽略
+        """
+        event_match = EVENT_PATTERN.search(raw_body)
+        if event_match is None or event_match.group(1) != GROUP_EVENT:
+            return True  # 私聊/其他事件/格式不明确,交给完整流程
+
+        if SELF_SENT_PATTERN.search(raw_body):
+            return False
+
+        # 请求体中有\u转义(或可选的\/转义)时无法直接匹配关键词,交给完整流程
+        if ESCAPE_PATTERN.search(raw_body):
+            return True
+
+        # 注意: 顶层wxid字段就是机器人自己,只能在atWxidList内部查找
+        at_match = AT_LIST_PATTERN.search(raw_body)
+        if at_match is not None:
+            at_list = at_match.group(1)
+            if self.bot_wxid is None:
+                if at_list.strip():
+                    return True
+            elif self.bot_wxid in at_list:
+                return True
+
+        for keyword in self.keywords:
+            if keyword in raw_body:
+                return True
+
+        return EMOJI_CANDIDATE_PATTERN.search(raw_body) is not None
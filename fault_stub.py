@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dify / 千寻 上游故障注入模拟服务(仅用于本地测试)
+同一个端口同时模拟两个上游:
+- POST .../chat-messages     Dify阻塞模式对话接口
+- POST 其他路径(如/qianxun/httpapi) 千寻HTTP API
+可按比例注入: 延迟尖刺、连接重置(RST)、404/429/5xx、逐字节慢速返回响应体、千寻code!=200
+
+运行: python fault_stub.py [--port 7788] [--config faults.json] [--seed 1]
+然后把config.json中dify的api_url和weixin.api_url指向该端口
+运行期间可用 GET /_faults 查看统计, POST /_faults 替换故障配置(JSON,格式同DEFAULT_FAULT_CONFIG)
+"""
+
+import argparse
+import json
+import random
+import socket
+import struct
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 每个上游的故障配置,rate均为0~1的概率
+DEFAULT_UPSTREAM_FAULTS = {
+    "latency": 0.0,            # 基础延迟(秒)
+    "spike_rate": 0.0,         # 延迟尖刺比例
+    "spike_latency": 5.0,      # 尖刺时的延迟(秒)
+    "reset_rate": 0.0,         # 读取请求后直接重置连接(RST)的比例
+    "status_rates": {},        # 按比例返回的HTTP错误,例如 {"429": 0.05, "500": 0.02}
+    "drip_rate": 0.0,          # 响应体逐块慢速返回的比例
+    "drip_chunk": 8,           # 慢速返回时每块字节数
+    "drip_interval": 0.05,     # 慢速返回时每块间隔(秒)
+    "conversation_404_rate": 0.0,  # Dify: 带conversation_id的请求返回404(会话不存在)的比例
+    "error_code_rate": 0.0     # 千寻: 返回HTTP 200但code!=200的比例
+}
+
+DEFAULT_FAULT_CONFIG = {
+    "dify": DEFAULT_UPSTREAM_FAULTS,
+    "qianxun": DEFAULT_UPSTREAM_FAULTS
+}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认的listen队列只有5,并发测试时连接会因SYN重传多等1秒
+    request_queue_size = 128
+
+
+class FaultStub:
+    """
+    故障注入模拟服务,可在进程内启动(测试/基准脚本)或作为独立进程运行
+    """
+
+    def __init__(self, fault_config=None, host='127.0.0.1', port=0, seed=None):
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self.configure(fault_config)
+        self.server = StubServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def configure(self, fault_config=None):
+        """
+        替换故障配置并清零统计
+        """
+        fault_config = fault_config or {}
+        with self._lock:
+            self.faults = {
+                upstream: {**DEFAULT_UPSTREAM_FAULTS, **fault_config.get(upstream, {})}
+                for upstream in DEFAULT_FAULT_CONFIG
+            }
+            self.counters = Counter()
+
+    def stats(self):
+        with self._lock:
+            return {"faults": self.faults, "counters": dict(self.counters)}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fault-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def decide(self, upstream, has_conversation=False):
+        """
+        为一次请求抽取故障
+        返回: (延迟秒数, 动作, 参数, 慢速返回参数或None) 动作为 ok / reset / status / conversation_404 / error_code
+        """
+        with self._lock:
+            faults = self.faults[upstream]
+            rng = self._rng
+            delay = faults['latency']
+            if faults['spike_rate'] and rng.random() < faults['spike_rate']:
+                delay = faults['spike_latency']
+                self.counters[f'{upstream}.spike'] += 1
+            drip = bool(faults['drip_rate']) and rng.random() < faults['drip_rate']
+
+            action, arg = 'ok', None
+            if faults['reset_rate'] and rng.random() < faults['reset_rate']:
+                action = 'reset'
+            elif has_conversation and faults['conversation_404_rate'] and \
+                    rng.random() < faults['conversation_404_rate']:
+                action = 'conversation_404'
+            elif faults['error_code_rate'] and rng.random() < faults['error_code_rate']:
+                action = 'error_code'
+            else:
+                for status, rate in faults['status_rates'].items():
+                    if rng.random() < rate:
+                        action, arg = 'status', int(status)
+                        break
+
+            self.counters[f'{upstream}.requests'] += 1
+            self.counters[f'{upstream}.{action}' if arg is None else f'{upstream}.status_{arg}'] += 1
+            if drip and action != 'reset':
+                self.counters[f'{upstream}.drip'] += 1
+            return delay, action, arg, (faults['drip_chunk'], faults['drip_interval']) if drip else None
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                # 连接预热
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def do_GET(self):
+                if self.path.startswith('/_faults'):
+                    self._send_json(200, stub.stats())
+                else:
+                    self._send_json(404, {"message": "not found"})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.startswith('/_faults'):
+                    stub.configure(json.loads(body or b'{}'))
+                    self._send_json(200, stub.stats())
+                    return
+                try:
+                    payload = json.loads(body or b'{}')
+                except ValueError:
+                    payload = {}
+
+                if 'chat-messages' in self.path:
+                    self._dify(payload)
+                else:
+                    self._qianxun(payload)
+
+            def _dify(self, payload):
+                delay, action, arg, drip = stub.decide('dify', bool(payload.get('conversation_id')))
+                if self._apply(delay, action):
+                    return
+                if action == 'conversation_404':
+                    self._send_json(404, {"code": "not_found", "message": "Conversation Not Exists."}, drip)
+                elif action == 'status':
+                    self._send_json(arg, {"code": "fault_injected", "message": f"injected {arg}"}, drip)
+                else:
+                    self._send_json(200, {
+                        "answer": f"收到: {payload.get('query', '')[:50]}",
+                        "conversation_id": payload.get('conversation_id') or uuid.uuid4().hex,
+                        "metadata": {"usage": {"prompt_tokens": 20, "completion_tokens": 10,
+                                               "total_tokens": 30, "total_price": "0.0001"}}
+                    }, drip)
+
+            def _qianxun(self, payload):
+                delay, action, arg, drip = stub.decide('qianxun')
+                if self._apply(delay, action):
+                    return
+                if action == 'status':
+                    self._send_json(arg, {"code": arg, "msg": f"injected {arg}"}, drip)
+                elif action == 'error_code':
+                    self._send_json(200, {"code": 500, "msg": "fault injected"}, drip)
+                else:
+                    self._send_json(200, {"code": 200, "msg": "操作成功", "result": {}}, drip)
+
+            def _apply(self, delay, action):
+                """
+                执行延迟;需要重置连接时发送RST后返回True
+                """
+                if delay > 0:
+                    time.sleep(delay)
+                if action != 'reset':
+                    return False
+                # SO_LINGER=0时close直接发送RST,客户端得到Connection reset by peer
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                self.close_connection = True
+                self.connection.close()
+                return True
+
+            def _send_json(self, status, data, drip=None):
+                body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                try:
+                    if drip is None:
+                        self.wfile.write(body)
+                        return
+                    chunk, interval = drip
+                    for start in range(0, len(body), max(1, int(chunk))):
+                        self.wfile.write(body[start:start + chunk])
+                        self.wfile.flush()
+                        time.sleep(interval)
+                except OSError:
+                    # 客户端超时或不读取响应体直接断开
+                    self.close_connection = True
+
+            def finish(self):
+                try:
+                    super().finish()
+                except OSError:
+                    pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dify/千寻 故障注入模拟服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7788)
+    parser.add_argument('--config', default='', help='故障配置JSON文件,格式同DEFAULT_FAULT_CONFIG')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    fault_config = {}
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            fault_config = json.load(f)
+
+    stub = FaultStub(fault_config, args.host, args.port, args.seed)
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Fault stub listening on {stub.base_url}")
+    print(f"  Dify:    {stub.base_url}/v1/chat-messages")
+    print(f"  千寻:    {stub.base_url}/qianxun/httpapi")
+    print(f"  统计:    GET {stub.base_url}/_faults")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(stub.stats(), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
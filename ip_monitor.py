@@ -1,7 +1,10 @@
 import requests
+import argparse
+import ipaddress
 import time
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 # 配置参数
@@ -10,6 +13,19 @@ WECHAT_API_URL = "http://127.0.0.1:7777/qianxun/httpapi"
 WXID = "wxid_alwc6m6hw4rs22"
 TARGET_WXID = "19986814732@chatroom"
 IP_FILE = "current_ip.txt"
+
+# 守护进程模式配置
+IP_CHECK_URLS = [               # 多个探测地址并发查询（均返回纯文本IP）
+    IP_CHECK_URL,
+    "https://api.ipify.org",
+    "https://ifconfig.me/ip",
+    "https://icanhazip.com"
+]
+DAEMON_INTERVAL = 60            # 检查间隔（秒）
+PROBE_TIMEOUT = 10              # 单个探测的超时（秒）
+PROBE_QUORUM = 2                # 至少几个探测结果一致才采用
+DEBOUNCE_COUNT = 3              # 新IP需要连续出现几次才认定为变化
+LATENCY_SMOOTHING = 0.3         # 探测耗时的指数滑动平均系数
 def get_current_ip():
     """获取当前IP地址"""
     try:
@@ -33,18 +49,20 @@ def read_stored_ip():
     return None
 
 def save_ip(ip):
-    """保存IP地址到文件"""
+    """保存IP地址到文件（先写临时文件再替换，避免写到一半被读到）"""
     try:
-        with open(IP_FILE, 'w', encoding='utf-8') as f:
+        tmp_file = f"{IP_FILE}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             f.write(ip)
+        os.replace(tmp_file, IP_FILE)
         print(f"[{datetime.now()}] IP地址已保存到文件: {ip}")
         return True
     except Exception as e:
         print(f"[{datetime.now()}] 保存IP文件失败: {e}")
         return False
 
-def send_wechat_message(new_ip):
-    """发送微信消息"""
+def send_wechat_message(new_ip, session=None):
+    """发送微信消息（守护进程模式下传入session复用连接）"""
     try:
         # 构建请求URL
         url = f"{WECHAT_API_URL}?wxid={WXID}"
@@ -60,7 +78,7 @@ def send_wechat_message(new_ip):
         
         # 发送POST请求
         headers = {'Content-Type': 'application/json'}
-        response = requests.post(url, json=payload, headers=headers, timeout=10)
+        response = (session or requests).post(url, json=payload, headers=headers, timeout=10)
         response.raise_for_status()
         
         result = response.json()
@@ -74,6 +92,140 @@ def send_wechat_message(new_ip):
         print(f"[{datetime.now()}] 发送微信消息异常: {e}")
         return False
 
+class IpProbePool:
+    """
+    多个IP探测地址
+    - 按平均耗时排序，优先查询快的探测，慢的只在结果不足时补充
+    - 并发查询，达到PROBE_QUORUM个一致结果即返回
+    - 复用同一个requests.Session的连接
+    """
+
+    def __init__(self, urls, session):
+        self.session = session
+        self.latency = {url: None for url in urls}  # 平均耗时（秒），None表示还没有数据
+        self.failures = {url: 0 for url in urls}
+        self.executor = ThreadPoolExecutor(max_workers=len(urls))
+
+    def ordered_urls(self):
+        # 没有数据的探测排在前面先测一次；失败过的按失败次数加罚
+        return sorted(self.latency, key=lambda url: (self.latency[url] or 0) + self.failures[url] * PROBE_TIMEOUT)
+
+    def probe(self, url):
+        started_at = time.monotonic()
+        try:
+            response = self.session.get(url, timeout=PROBE_TIMEOUT)
+            response.raise_for_status()
+            # 校验返回内容确实是IP，避免错误页面被当成新IP
+            ip = str(ipaddress.ip_address(response.text.strip()))
+            self.failures[url] = 0
+        except Exception as e:
+            print(f"[{datetime.now()}] 探测失败 {url}: {e}")
+            self.failures[url] += 1
+            ip = None
+        elapsed = time.monotonic() - started_at
+        previous = self.latency[url]
+        self.latency[url] = elapsed if previous is None else previous + LATENCY_SMOOTHING * (elapsed - previous)
+        return ip
+
+    def query(self):
+        """
+        返回: 达到法定数量一致的IP；探测结果不足或不一致时返回None
+        """
+        urls = self.ordered_urls()
+        quorum = min(PROBE_QUORUM, len(urls))
+        votes = {}
+        # 先查询最快的quorum+1个，不够再补充剩余的
+        for batch in (urls[:quorum + 1], urls[quorum + 1:]):
+            if not batch:
+                continue
+            futures = [self.executor.submit(self.probe, url) for url in batch]
+            for future in as_completed(futures):
+                ip = future.result()
+                if ip is None:
+                    continue
+                votes[ip] = votes.get(ip, 0) + 1
+                if votes[ip] >= quorum:
+                    return ip
+        print(f"[{datetime.now()}] 探测结果未达成一致: {votes}")
+        return None
+
+
+class IpChangeDebouncer:
+    """
+    IP变化去抖: 新IP需要连续debounce_count次被确认才算变化
+    中途恢复为原IP或出现另一个新IP时重新计数
+    """
+
+    def __init__(self, stored_ip, debounce_count=DEBOUNCE_COUNT):
+        self.stored_ip = stored_ip
+        self.debounce_count = debounce_count
+        self.candidate_ip = None
+        self.candidate_count = 0
+
+    def observe(self, current_ip):
+        """
+        记录一次探测结果
+        返回: 已确认变化的新IP（调用方保存成功后调用confirm）；没有变化或仍在去抖时返回None
+        """
+        if current_ip == self.stored_ip:
+            if self.candidate_ip is not None:
+                print(f"[{datetime.now()}] IP恢复为 {self.stored_ip}，忽略候选IP {self.candidate_ip}")
+            self.candidate_ip = None
+            self.candidate_count = 0
+            return None
+
+        if current_ip != self.candidate_ip:
+            self.candidate_ip = current_ip
+            self.candidate_count = 0
+        self.candidate_count += 1
+        print(f"[{datetime.now()}] 检测到新IP {current_ip}（{self.candidate_count}/{self.debounce_count}）")
+        return current_ip if self.candidate_count >= self.debounce_count else None
+
+    def confirm(self, ip):
+        self.stored_ip = ip
+        self.candidate_ip = None
+        self.candidate_count = 0
+
+
+def run_daemon():
+    """
+    守护进程模式: 常驻运行，定期检查IP
+    新IP需要连续DEBOUNCE_COUNT次被确认才会保存并发送通知，避免单次探测异常导致误报
+    """
+    print(f"[{datetime.now()}] IP地址监控守护进程启动，间隔 {DAEMON_INTERVAL} 秒")
+    print(f"  探测地址: {', '.join(IP_CHECK_URLS)}")
+    print(f"  一致数量: {PROBE_QUORUM}，去抖次数: {DEBOUNCE_COUNT}")
+    print("-" * 60)
+
+    session = requests.Session()
+    probes = IpProbePool(IP_CHECK_URLS, session)
+    debouncer = IpChangeDebouncer(read_stored_ip())
+
+    while True:
+        started_at = time.monotonic()
+        current_ip = probes.query()
+
+        if current_ip is None:
+            pass
+        elif debouncer.stored_ip is None:
+            print(f"[{datetime.now()}] 首次运行，保存初始IP地址: {current_ip}")
+            if save_ip(current_ip):
+                debouncer.confirm(current_ip)
+        elif debouncer.observe(current_ip) is not None:
+            print(f"[{datetime.now()}] IP地址发生变化!")
+            print(f"  旧IP: {debouncer.stored_ip}")
+            print(f"  新IP: {current_ip}")
+            # 保存失败时保留候选计数，下一次检查再尝试
+            if save_ip(current_ip):
+                debouncer.confirm(current_ip)
+                send_wechat_message(current_ip, session=session)
+
+        latency_info = ', '.join(
+            f"{url}={probes.latency[url] * 1000:.0f}ms" for url in probes.ordered_urls() if probes.latency[url] is not None)
+        print(f"[{datetime.now()}] 探测耗时: {latency_info}")
+        time.sleep(max(0, DAEMON_INTERVAL - (time.monotonic() - started_at)))
+
+
 def main():
     """主函数"""
     print(f"[{datetime.now()}] IP地址监控程序启动")
@@ -114,4 +266,14 @@ def main():
     print("-" * 60)
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="IP地址监控程序")
+    parser.add_argument('--daemon', action='store_true', help='常驻运行，多探测并发查询并去抖（默认只检查一次）')
+    args = parser.parse_args()
+
+    if args.daemon:
+        try:
+            run_daemon()
+        except KeyboardInterrupt:
+            print(f"[{datetime.now()}] 守护进程退出")
+    else:
+        main()
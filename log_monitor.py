@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import argparse
+import glob
+import gzip
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
 import time
 import requests
 import json
 import re
 from datetime import datetime
 
+from message_splitter import split_message, send_parts, summarize_lines
+
 # ===== 全局配置 =====
+# 以下常量是配置文件不存在时生成的默认监控规则
 # 关键字配置（可以根据需要修改）
 KEYWORDS = ["[error]", "异常123"]  # 支持多个关键字
 
@@ -25,30 +34,341 @@ WECHAT_CHATROOM = "34412824967@chatroom"
 # 31位ID的正则表达式（匹配连续31个数字）
 ID_PATTERN = re.compile(r'\b\d{31}\b')
 
+# 消息发送配置
+MAX_MESSAGE_BYTES = 4000   # 单条消息字节上限，超出则按行拆分为多条（带"(1/3)"标记）
+PART_INTERVAL = 1.0        # 分段之间的发送间隔（秒）
+SUMMARY_HEAD_LINES = 30    # 行数过多时保留开头的行数
+SUMMARY_TAIL_LINES = 30    # 行数过多时保留结尾的行数
+
+# 回溯扫描: 普通文件按该大小切分为按行对齐的字节区间，交给进程池并行扫描
+BACKFILL_RANGE_BYTES = 32 * 1024 * 1024
+
+# 监控配置文件（多文件/通配符、每组规则独立的关键字、ID正则、黑名单和目标群）
+CONFIG_FILE_PATH = "log_monitor_config.json"
+
+# 告警状态配置（去重指纹、抑制窗口、文件读取位置）
+DEFAULT_ALERT_STATE_CONFIG = {
+    "path": "log_monitor_state.json",
+    "suppression_window": 3600,   # 相同告警在该时间（秒）内只发送一次
+    "state_ttl": 7 * 24 * 3600,   # 超过该时间（秒）未再出现的指纹从状态文件中清除
+    "incremental": True,          # 只读取上次检查之后新增的日志内容
+    # 增量模式下关键字行和同ID的关联行可能落在不同次读取中:
+    "context_lines": 1000,        # 每个文件保留最近读到的包含ID的行数，新出现的ID也在这些行中关联
+    "id_ttl": 3600                # 已提取的ID保留秒数，之后读到的包含这些ID的行继续发送
+}
+
+# 指纹归一化: 去掉时间戳、十六进制串和数字，使同一类错误得到相同指纹
+TIMESTAMP_PATTERN = re.compile(r'\d{4}[-/]\d{1,2}[-/]\d{1,2}[ T]\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?|\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?')
+HEX_PATTERN = re.compile(r'\b[0-9a-fA-F]{16,}\b')
+NUMBER_PATTERN = re.compile(r'\d+')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def load_config():
+    """
+    加载监控配置文件，如果不存在则用上面的常量生成默认配置
+    """
+    default_config = {
+        "wechat": {
+            "api_url": WECHAT_API_URL,
+            "wxid": WECHAT_WXID
+        },
+        "monitors": [
+            {
+                "name": "one-api",
+                "paths": [LOG_FILE_PATH],  # 支持通配符，如 /var/log/*/error.log
+                "keywords": KEYWORDS,
+                "blacklist": BLACKLIST_KEYWORDS,
+                "id_pattern": ID_PATTERN.pattern,
+                "chatroom": WECHAT_CHATROOM
+            }
+        ],
+        "alert_state": DEFAULT_ALERT_STATE_CONFIG
+    }
+
+    try:
+        if os.path.exists(CONFIG_FILE_PATH):
+            with open(CONFIG_FILE_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        with open(CONFIG_FILE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(default_config, f, ensure_ascii=False, indent=2)
+        print(f"[{datetime.now()}] 已生成默认配置文件: {CONFIG_FILE_PATH}")
+        return default_config
+    except Exception as e:
+        print(f"[{datetime.now()}] 读取配置文件异常: {str(e)}，使用默认配置")
+        return default_config
+
+
+class AlertStateStore:
+    """
+    持久化的告警状态
+    - fingerprints: 每条告警归一化后的指纹，记录最后发送时间和被抑制的次数
+    - files: 每个日志文件上次读到的位置（inode + 偏移量），下次只读新增内容；
+      以及最近读到的包含ID的行（context）和最近提取的ID（ids），用于跨多次读取关联ID
+    读取位置和发送时间只在告警发送成功后才生效，发送失败时下次重新读取并发送
+    状态文件通过临时文件 + os.replace 原子写入
+    """
+
+    def __init__(self, state_config=None):
+        state_config = {**DEFAULT_ALERT_STATE_CONFIG, **(state_config or {})}
+        self.path = state_config['path']
+        self.suppression_window = state_config['suppression_window']
+        self.state_ttl = state_config['state_ttl']
+        self.incremental = state_config['incremental']
+        self.context_lines = int(state_config['context_lines'])
+        self.id_ttl = state_config['id_ttl']
+        self.fingerprints = {}
+        self.files = {}
+        self.pending_files = {}   # 本次读到的位置，commit_file之后才写入files
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.fingerprints = state.get('fingerprints', {})
+            self.files = state.get('files', {})
+        except Exception as e:
+            print(f"[{datetime.now()}] 读取告警状态文件异常: {str(e)}，重新开始记录")
+
+    def save(self):
+        now = time.time()
+        # 清除长时间未出现且没有待汇总次数的指纹
+        self.fingerprints = {
+            fp: entry for fp, entry in self.fingerprints.items()
+            if entry.get('suppressed') or now - entry.get('last_seen', now) < self.state_ttl
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"fingerprints": self.fingerprints, "files": self.files}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            print(f"[{datetime.now()}] 保存告警状态文件异常: {str(e)}")
+
+    @staticmethod
+    def fingerprint(rule, line):
+        """
+        归一化后计算指纹: 去掉ID、时间戳、十六进制串和数字，统一大小写和空白
+        """
+        normalized = rule.id_pattern.sub('<id>', line)
+        normalized = TIMESTAMP_PATTERN.sub('<ts>', normalized)
+        normalized = HEX_PATTERN.sub('<hex>', normalized)
+        normalized = NUMBER_PATTERN.sub('#', normalized)
+        normalized = WHITESPACE_PATTERN.sub(' ', normalized).strip().lower()
+        return hashlib.sha1(f"{rule.name}\n{normalized}".encode('utf-8')).hexdigest()[:20]
+
+    def filter_lines(self, rule, lines):
+        """
+        按指纹去重并应用抑制窗口
+        - 本次相同指纹的多行只发送第一行，附带重复次数
+        - 抑制窗口内已发送过的指纹只累计次数，不发送
+        返回: 需要发送的行
+        """
+        now = time.time()
+        groups = {}
+        for line in lines:
+            fp = self.fingerprint(rule, line)
+            if fp in groups:
+                groups[fp][1] += 1
+            else:
+                groups[fp] = [line, 1]
+
+        to_send = []
+        suppressed = 0
+        for fp, (line, count) in groups.items():
+            entry = self.fingerprints.setdefault(fp, {"rule": rule.name, "first_seen": now, "last_sent": 0, "suppressed": 0})
+            entry['last_seen'] = now
+            entry['sample'] = line[:200]
+            if now - entry['last_sent'] < self.suppression_window:
+                entry['suppressed'] += count
+                suppressed += count
+                continue
+
+            suffix = []
+            if count > 1:
+                suffix.append(f"本次共 {count} 次")
+            if entry['suppressed']:
+                suffix.append(f"此前另有 {entry['suppressed']} 次已抑制")
+            to_send.append(f"{line}（{'，'.join(suffix)}）" if suffix else line)
+            entry['last_sent'] = now
+            entry['suppressed'] = 0
+
+        if suppressed:
+            print(f"[{datetime.now()}] [{rule.name}] {suppressed} 行处于抑制窗口内，未发送")
+        return to_send
+
+    def expired_rollups(self, rule):
+        """
+        抑制窗口已结束、但窗口内还有被抑制次数的告警，发送一条"又出现N次"的汇总
+        """
+        now = time.time()
+        rollups = []
+        for entry in self.fingerprints.values():
+            if entry.get('rule') != rule.name or not entry.get('suppressed'):
+                continue
+            if now - entry['last_sent'] < self.suppression_window:
+                continue
+            rollups.append(f"{entry['sample']}（抑制窗口内又出现 {entry['suppressed']} 次）")
+            entry['last_sent'] = now
+            entry['suppressed'] = 0
+        return rollups
+
+    def snapshot(self, rule):
+        """
+        记录规则所有指纹的当前状态，发送失败时用restore回滚
+        """
+        return {fp: dict(entry) for fp, entry in self.fingerprints.items() if entry.get('rule') == rule.name}
 
-def send_wechat_message(message):
+    def restore(self, rule, snapshot):
+        """
+        回滚到snapshot时的状态: 本次新增的指纹删除，已有指纹恢复发送时间和抑制次数
+        """
+        for fp in [fp for fp, entry in self.fingerprints.items() if entry.get('rule') == rule.name]:
+            if fp not in snapshot:
+                del self.fingerprints[fp]
+        self.fingerprints.update(snapshot)
+
+    def commit_file(self, path):
+        """
+        文件新增内容已全部处理（相关告警发送成功）后，保存本次读到的位置
+        """
+        if path in self.pending_files:
+            self.files[path] = self.pending_files.pop(path)
+
+    def read_new_lines(self, path):
+        """
+        读取日志文件中上次位置之后新增的完整行
+        文件被轮转（inode变化）或截断（变小）时从头开始读
+        非增量模式下每次读取整个文件
+        读到的位置先暂存，调用commit_file后才保存
+        """
+        if not self.incremental:
+            return read_lines(path)
+
+        stat = os.stat(path)
+        file_state = self.files.get(path, {})
+        offset = file_state.get('offset', 0)
+        if file_state.get('inode') != stat.st_ino or stat.st_size < offset:
+            offset = 0
+
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+
+        # 只处理完整的行，最后一行未写完的部分留到下次
+        end = data.rfind(b'\n') + 1
+        self.pending_files[path] = {**file_state, "inode": stat.st_ino, "offset": offset + end}
+        text = data[:end].decode('utf-8', errors='ignore')
+        return [line.strip() for line in text.splitlines() if line.strip()]
+
+    def scan_new_lines(self, path, lines, rules):
+        """
+        在新增行上执行规则，并与之前读取的内容关联（需先调用read_new_lines）:
+        - 新提取的ID同时在之前保留的包含ID的行中查找（关联行先于关键字行写入）
+        - 之前提取的ID在新增行中继续查找（关联行在之后的读取中才写入）
+        非增量模式下每次读取整个文件，直接扫描
+        返回: {规则名: 最终要发送的行列表}
+        """
+        if not self.incremental:
+            return scan_lines(lines, rules)
+
+        now = time.time()
+        file_state = self.pending_files[path]
+        context = file_state.get('context', [])
+        known_ids = {
+            rule.name: {id_value for id_value, seen in file_state.get('ids', {}).get(rule.name, {}).items()
+                        if now - seen < self.id_ttl}
+            for rule in rules
+        }
+
+        extracted_ids = extract_rule_ids(lines, rules)
+        new_ids = {rule.name: extracted_ids[rule.name] - known_ids[rule.name] for rule in rules}
+        for rule in rules:
+            print(f"[{datetime.now()}] [{rule.name}] 共提取到 {len(extracted_ids[rule.name])} 个唯一ID，"
+                  f"之前读取中的ID {len(known_ids[rule.name])} 个")
+        earlier = collect_related_lines(context, rules, new_ids)
+        current = collect_related_lines(lines, rules, {rule.name: extracted_ids[rule.name] | known_ids[rule.name]
+                                                       for rule in rules})
+        related = {rule.name: earlier[rule.name] + current[rule.name] for rule in rules}
+
+        # 保留最近的包含ID的行和未过期的ID，随读取位置一起在commit_file后生效
+        id_patterns = list({rule.id_pattern.pattern: rule.id_pattern for rule in rules}.values())
+        id_lines = [line for line in lines if any(pattern.search(line) for pattern in id_patterns)]
+        file_state['context'] = (context + id_lines)[-self.context_lines:] if self.context_lines > 0 else []
+        ids = {}
+        for rule in rules:
+            entries = {id_value: seen for id_value, seen in file_state.get('ids', {}).get(rule.name, {}).items()
+                       if now - seen < self.id_ttl}
+            entries.update(dict.fromkeys(extracted_ids[rule.name], now))
+            if entries:
+                ids[rule.name] = entries
+        file_state['ids'] = ids
+        return filter_blacklist(rules, related)
+
+
+def compile_any(words):
+    """
+    将多个关键字编译为一个不区分大小写的正则（一次search匹配所有关键字）
+    没有关键字时返回None
+    """
+    words = [word for word in words if word]
+    if not words:
+        return None
+    # 长的关键字优先，避免被其前缀提前匹配
+    words = sorted(set(words), key=len, reverse=True)
+    return re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+
+
+class MonitorRule:
+    """
+    一组监控规则: 关键字、ID正则、黑名单和目标群
+    """
+
+    def __init__(self, rule_config, default_wxid):
+        self.name = rule_config.get('name', 'unnamed')
+        self.paths = rule_config.get('paths', [])
+        self.keywords = rule_config.get('keywords', [])
+        self.blacklist = rule_config.get('blacklist', [])
+        self.id_pattern = re.compile(rule_config.get('id_pattern', ID_PATTERN.pattern))
+        self.chatroom = rule_config['chatroom']
+        self.wxid = rule_config.get('wxid', default_wxid)
+        self.keyword_matcher = compile_any(self.keywords)
+        self.blacklist_matcher = compile_any(self.blacklist)
+
+    def match_keyword(self, line):
+        return self.keyword_matcher is not None and self.keyword_matcher.search(line) is not None
+
+    def is_blacklisted(self, line):
+        return self.blacklist_matcher is not None and self.blacklist_matcher.search(line) is not None
+
+
+def send_wechat_message(message, chatroom=WECHAT_CHATROOM, wxid=WECHAT_WXID, api_url=WECHAT_API_URL):
     """
     发送微信消息
     :param message: 要发送的消息内容
+    :param chatroom: 目标群
     :return: 是否发送成功
     """
     try:
         # 构造请求URL
-        url = f"{WECHAT_API_URL}?wxid={WECHAT_WXID}"
-        
+        url = f"{api_url}?wxid={wxid}"
+
         # 构造请求Body
         payload = {
             "type": "sendText2",
             "data": {
-                "wxid": WECHAT_CHATROOM,
+                "wxid": chatroom,
                 "msg": message
             }
         }
-        
+
         # 发送POST请求
         headers = {'Content-Type': 'application/json'}
         response = requests.post(url, json=payload, headers=headers, timeout=10)
-        
+
         # 检查响应
         if response.status_code == 200:
             result = response.json()
@@ -61,120 +381,344 @@ def send_wechat_message(message):
         else:
             print(f"[{datetime.now()}] HTTP请求失败: {response.status_code}")
             return False
-            
+
     except Exception as e:
         print(f"[{datetime.now()}] 发送消息异常: {str(e)}")
         return False
 
 
-def check_log_file():
+def expand_paths(rules):
     """
-    检查日志文件中的内容
+    展开所有规则中的通配符路径
+    返回: {文件路径: [适用的规则]}，同一个文件只出现一次
     """
-    try:
-        with open(LOG_FILE_PATH, 'r', encoding='utf-8', errors='ignore') as f:
-            lines = f.readlines()
-        
-        print(f"[{datetime.now()}] 读取日志文件,共 {len(lines)} 行")
-        
-        # 步骤1: 查找所有匹配KEYWORDS的行
-        keyword_matched_lines = []
-        for line in lines:
-            line_stripped = line.strip()
-            if not line_stripped:
+    files = {}
+    for rule in rules:
+        for pattern in rule.paths:
+            matched = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            if not matched:
+                print(f"[{datetime.now()}] [{rule.name}] 没有匹配的日志文件: {pattern}")
+            for path in matched:
+                files.setdefault(path, [])
+                if rule not in files[path]:
+                    files[path].append(rule)
+    return files
+
+
+def extract_rule_ids(lines, rules, verbose=True):
+    """
+    步骤1: 用所有规则关键字合并的正则一次筛出候选行，再按规则提取ID
+    返回: {规则名: ID集合}
+    """
+    combined_matcher = compile_any([keyword for rule in rules for keyword in rule.keywords])
+    extracted_ids = {rule.name: set() for rule in rules}
+    if combined_matcher is None:
+        return extracted_ids
+
+    for line in lines:
+        if not combined_matcher.search(line):
+            continue
+        for rule in rules:
+            if not rule.match_keyword(line):
                 continue
-            
-            # 检查是否匹配任何关键字
-            for keyword in KEYWORDS:
-                if keyword.lower() in line_stripped.lower():
-                    keyword_matched_lines.append(line_stripped)
-                    print(f"[{datetime.now()}] 匹配到关键字 '{keyword}': {line_stripped[:100]}...")
-                    break
-        
-        print(f"[{datetime.now()}] 共找到 {len(keyword_matched_lines)} 行匹配关键字")
-        
-        # 步骤2: 从匹配的行中提取31位ID，并重新筛选包含这些ID的所有行
-        extracted_ids = set()
-        for line in keyword_matched_lines:
-            # 查找31位ID
-            match = ID_PATTERN.search(line)
+            match = rule.id_pattern.search(line)
             if match:
-                id_value = match.group()
-                extracted_ids.add(id_value)
-                print(f"[{datetime.now()}] 提取到ID: {id_value}")
-            else:
-                print(f"[{datetime.now()}] 未找到31位ID，忽略: {line[:100]}...")
-        
-        print(f"[{datetime.now()}] 共提取到 {len(extracted_ids)} 个唯一ID")
-        
-        # 如果没有提取到任何ID，直接返回
-        if not extracted_ids:
-            print(f"[{datetime.now()}] 没有提取到任何ID，无内容发送")
-            return
-        
-        # 从整个日志文件中筛选包含这些ID的所有行
-        id_related_lines = []
+                extracted_ids[rule.name].add(match.group())
+            elif verbose:
+                print(f"[{datetime.now()}] [{rule.name}] 未找到ID，忽略: {line[:100]}...")
+    return extracted_ids
+
+
+def collect_related_lines(lines, rules, extracted_ids):
+    """
+    步骤2: 找出包含已提取ID的所有行，相同ID正则的规则共用一次扫描
+    返回: {规则名: 行列表}（保持原有顺序）
+    """
+    rules_by_pattern = {}
+    for rule in rules:
+        if extracted_ids[rule.name]:
+            rules_by_pattern.setdefault(rule.id_pattern.pattern, []).append(rule)
+
+    related_lines = {rule.name: [] for rule in rules}
+    for pattern_rules in rules_by_pattern.values():
+        id_pattern = pattern_rules[0].id_pattern
         for line in lines:
-            line_stripped = line.strip()
-            if not line_stripped:
+            line_ids = id_pattern.findall(line)
+            if not line_ids:
                 continue
-            
-            # 检查该行是否包含任何提取到的ID
-            for id_value in extracted_ids:
-                if id_value in line_stripped:
-                    id_related_lines.append(line_stripped)
-                    break
-        
-        print(f"[{datetime.now()}] 共找到 {len(id_related_lines)} 行包含提取的ID")
-        
-        # 步骤3: 过滤掉包含黑名单关键字的行
-        final_lines = []
-        for line in id_related_lines:
-            # 检查是否包含黑名单关键字
-            is_blacklisted = False
-            for bl_keyword in BLACKLIST_KEYWORDS:
-                if bl_keyword.lower() in line.lower():
-                    is_blacklisted = True
-                    print(f"[{datetime.now()}] 包含黑名单关键字 '{bl_keyword}'，跳过: {line[:100]}...")
-                    break
-            
-            if not is_blacklisted:
-                final_lines.append(line)
-        
-        print(f"[{datetime.now()}] 过滤黑名单后剩余 {len(final_lines)} 行")
-        
-        # 发送最终结果
-        if final_lines:
-            message = '\n'.join(final_lines)
-            print(f"[{datetime.now()}] 准备发送 {len(final_lines)} 行内容")
-            send_wechat_message(message)
-        else:
-            print(f"[{datetime.now()}] 没有符合条件的内容需要发送")
-            
-    except FileNotFoundError:
-        print(f"[{datetime.now()}] 日志文件不存在: {LOG_FILE_PATH}")
-    except Exception as e:
-        print(f"[{datetime.now()}] 读取日志文件异常: {str(e)}")
+            for rule in pattern_rules:
+                rule_ids = extracted_ids[rule.name]
+                if any(id_value in rule_ids for id_value in line_ids):
+                    related_lines[rule.name].append(line)
+    return related_lines
+
+
+def filter_blacklist(rules, related_lines):
+    """
+    步骤3: 按规则过滤黑名单
+    返回: {规则名: 最终要发送的行列表}
+    """
+    results = {}
+    for rule in rules:
+        final_lines = [line for line in related_lines[rule.name] if not rule.is_blacklisted(line)]
+        print(f"[{datetime.now()}] [{rule.name}] 包含ID的行 {len(related_lines[rule.name])} 行，过滤黑名单后剩余 {len(final_lines)} 行")
+        results[rule.name] = final_lines
+    return results
+
+
+def scan_lines(lines, rules):
+    """
+    在一组日志行上同时执行多组规则（关键字匹配 -> ID关联 -> 黑名单过滤）
+    返回: {规则名: 最终要发送的行列表}
+    """
+    extracted_ids = extract_rule_ids(lines, rules)
+    for rule in rules:
+        print(f"[{datetime.now()}] [{rule.name}] 共提取到 {len(extracted_ids[rule.name])} 个唯一ID")
+    return filter_blacklist(rules, collect_related_lines(lines, rules, extracted_ids))
+
+
+def read_lines(path):
+    """
+    读取日志文件的所有非空行（去掉首尾空白）
+    """
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def send_alert(rule, final_lines, api_url):
+    """
+    将规则的最终结果发送到其目标群
+    返回: 是否所有分段都发送成功
+    """
+    # 行数过多时只发送开头+结尾，中间给出省略行数
+    summary_lines = summarize_lines(final_lines, SUMMARY_HEAD_LINES, SUMMARY_TAIL_LINES)
+    message = '\n'.join(summary_lines)
+    parts = split_message(message, MAX_MESSAGE_BYTES)
+    print(f"[{datetime.now()}] [{rule.name}] 准备发送 {len(final_lines)} 行内容（摘要 {len(summary_lines)} 行，分 {len(parts)} 条发送）")
+    return send_parts(
+        parts,
+        lambda part: send_wechat_message(part, chatroom=rule.chatroom, wxid=rule.wxid, api_url=api_url),
+        interval=PART_INTERVAL
+    )
+
+
+def check_log_files(config):
+    """
+    检查所有配置的日志文件，每个文件只读取一次，所有适用的规则一起处理
+    增量模式下只处理上次检查之后新增的行；结果按告警指纹去重并应用抑制窗口
+    """
+    state = AlertStateStore(config.get('alert_state', {}))
+    wechat_config = config.get('wechat', {})
+    api_url = wechat_config.get('api_url', WECHAT_API_URL)
+    rules = [MonitorRule(rule_config, wechat_config.get('wxid', WECHAT_WXID)) for rule_config in config.get('monitors', [])]
+
+    # 同一规则可能匹配多个文件，结果按规则汇总后再发送
+    rule_lines = {rule.name: [] for rule in rules}
+    rule_paths = {rule.name: [] for rule in rules}
+    paths = expand_paths(rules)
+    for path, file_rules in paths.items():
+        try:
+            lines = state.read_new_lines(path)
+        except FileNotFoundError:
+            print(f"[{datetime.now()}] 日志文件不存在: {path}")
+            continue
+        except Exception as e:
+            print(f"[{datetime.now()}] 读取日志文件异常: {path}: {str(e)}")
+            continue
+
+        print(f"[{datetime.now()}] 读取日志文件 {path}，新增 {len(lines)} 行，适用规则: {', '.join(rule.name for rule in file_rules)}")
+        if not lines:
+            continue
+        for rule_name, final_lines in state.scan_new_lines(path, lines, file_rules).items():
+            rule_lines[rule_name].extend(final_lines)
+            rule_paths[rule_name].append(path)
+
+    # 发送失败的规则回滚指纹状态，其读取的文件不保存位置，下次检查时重新读取并发送
+    failed_paths = set()
+    for rule in rules:
+        snapshot = state.snapshot(rule)
+        final_lines = state.filter_lines(rule, rule_lines[rule.name]) + state.expired_rollups(rule)
+        if not final_lines:
+            print(f"[{datetime.now()}] [{rule.name}] 没有符合条件的内容需要发送")
+        elif not send_alert(rule, final_lines, api_url):
+            print(f"[{datetime.now()}] [{rule.name}] 告警发送失败，下次检查时重新发送")
+            state.restore(rule, snapshot)
+            failed_paths.update(rule_paths[rule.name])
+
+    for path in paths:
+        if path not in failed_paths:
+            state.commit_file(path)
+    state.save()
+
+
+def split_ranges(path, range_bytes=None):
+    """
+    将文件切分为按行对齐的字节区间 [(start, end), ...]
+    gzip文件无法随机定位，整个文件作为一个区间 [(None, None)]
+    """
+    if path.endswith('.gz'):
+        return [(None, None)]
+
+    range_bytes = range_bytes or BACKFILL_RANGE_BYTES
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + range_bytes
+            if end >= size:
+                end = size
+            else:
+                # 区间结尾移动到下一个换行符之后，保证每行只属于一个区间
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def iter_range_lines(path, start, end):
+    """
+    逐行读取文件的一个区间（去掉首尾空白，跳过空行）
+    start为None时表示gzip文件，边读边解压，不落盘
+    """
+    if start is None:
+        with gzip.open(path, 'rt', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+        return
+
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    for line in data.decode('utf-8', errors='ignore').splitlines():
+        line = line.strip()
+        if line:
+            yield line
+
+
+def backfill_extract_task(path, start, end, rule_configs, default_wxid):
+    """
+    进程池任务（阶段1）: 扫描一个区间，返回该区间内按规则提取到的ID
+    """
+    rules = [MonitorRule(rule_config, default_wxid) for rule_config in rule_configs]
+    return extract_rule_ids(iter_range_lines(path, start, end), rules, verbose=False)
+
+
+def backfill_collect_task(path, start, end, rule_configs, default_wxid, extracted_ids):
+    """
+    进程池任务（阶段2）: 扫描一个区间，返回包含已合并ID的行
+    """
+    rules = [MonitorRule(rule_config, default_wxid) for rule_config in rule_configs]
+    return collect_related_lines(iter_range_lines(path, start, end), rules, extracted_ids)
+
+
+def run_backfill(config, paths, rule_names=None, workers=None, send=False):
+    """
+    回溯扫描归档日志（支持gzip），结果与增量检查的关联/黑名单逻辑完全一致
+    阶段1: 各区间并行提取ID，按文件合并各区间的ID集合
+    阶段2: 各区间并行找出包含合并后ID的行，按区间顺序拼接后过滤黑名单
+    不读写增量状态文件；默认只打印结果，send=True时发送到规则的目标群
+    """
+    wechat_config = config.get('wechat', {})
+    api_url = wechat_config.get('api_url', WECHAT_API_URL)
+    default_wxid = wechat_config.get('wxid', WECHAT_WXID)
+    rule_configs = [
+        rule_config for rule_config in config.get('monitors', [])
+        if not rule_names or rule_config.get('name') in rule_names
+    ]
+    if not rule_configs:
+        print(f"[{datetime.now()}] 没有可用的监控规则")
+        return {}
+    rules = [MonitorRule(rule_config, default_wxid) for rule_config in rule_configs]
+
+    files = []
+    for pattern in paths:
+        matched = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        files.extend(path for path in matched if os.path.isfile(path) and path not in files)
+    if not files:
+        print(f"[{datetime.now()}] 没有找到需要回溯的日志文件: {paths}")
+        return {}
+
+    tasks = [(path, start, end) for path in files for start, end in split_ranges(path)]
+    print(f"[{datetime.now()}] 回溯扫描 {len(files)} 个文件，共 {len(tasks)} 个区间")
+
+    rule_lines = {rule.name: [] for rule in rules}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # 阶段1: 提取ID并按文件合并
+        file_ids = {path: {rule.name: set() for rule in rules} for path in files}
+        futures = [pool.submit(backfill_extract_task, path, start, end, rule_configs, default_wxid)
+                   for path, start, end in tasks]
+        for (path, _, _), future in zip(tasks, futures):
+            for rule_name, ids in future.result().items():
+                file_ids[path][rule_name].update(ids)
+
+        # 阶段2: 收集关联行（按区间顺序拼接，保持原始行序）
+        file_related = {path: {rule.name: [] for rule in rules} for path in files}
+        futures = [pool.submit(backfill_collect_task, path, start, end, rule_configs, default_wxid, file_ids[path])
+                   for path, start, end in tasks]
+        for (path, _, _), future in zip(tasks, futures):
+            for rule_name, lines in future.result().items():
+                file_related[path][rule_name].extend(lines)
+
+    for path in files:
+        print(f"[{datetime.now()}] {path}: " + "，".join(
+            f"[{rule.name}] {len(file_ids[path][rule.name])} 个ID" for rule in rules))
+        for rule_name, final_lines in filter_blacklist(rules, file_related[path]).items():
+            rule_lines[rule_name].extend(final_lines)
+
+    for rule in rules:
+        final_lines = rule_lines[rule.name]
+        print("=" * 60)
+        print(f"[{rule.name}] 回溯结果 {len(final_lines)} 行")
+        print("=" * 60)
+        for line in final_lines:
+            print(line)
+        if send and final_lines:
+            send_alert(rule, final_lines, api_url)
+    return rule_lines
 
 
 def main():
     """
     主函数
     """
+    parser = argparse.ArgumentParser(description="日志监控微信通知程序")
+    parser.add_argument('--backfill', nargs='+', metavar='PATH',
+                        help='回溯扫描指定的日志文件或通配符（支持.gz），不更新增量状态')
+    parser.add_argument('--rule', action='append', help='回溯时只使用指定名称的规则（可多次指定）')
+    parser.add_argument('--workers', type=int, default=None, help='回溯扫描的进程数（默认CPU核数）')
+    parser.add_argument('--send', action='store_true', help='回溯结果发送到规则的目标群（默认只打印）')
+    args = parser.parse_args()
+
+    config = load_config()
+
+    if args.backfill:
+        started_at = time.monotonic()
+        run_backfill(config, args.backfill, rule_names=args.rule, workers=args.workers, send=args.send)
+        print(f"[{datetime.now()}] 回溯完成（耗时 {time.monotonic() - started_at:.2f} 秒）")
+        return
+
     print("=" * 60)
     print("日志监控微信通知程序")
     print("=" * 60)
-    print(f"监控文件: {LOG_FILE_PATH}")
-    print(f"关键字: {KEYWORDS}")
-    print(f"黑名单关键字: {BLACKLIST_KEYWORDS}")
-    print(f"微信机器人: {WECHAT_WXID}")
-    print(f"目标群组: {WECHAT_CHATROOM}")
+    for rule_config in config.get('monitors', []):
+        print(f"[{rule_config.get('name', 'unnamed')}]")
+        print(f"  监控文件: {rule_config.get('paths', [])}")
+        print(f"  关键字: {rule_config.get('keywords', [])}")
+        print(f"  黑名单关键字: {rule_config.get('blacklist', [])}")
+        print(f"  目标群组: {rule_config.get('chatroom')}")
+    print(f"微信机器人: {config.get('wechat', {}).get('wxid', WECHAT_WXID)}")
     print("=" * 60)
-    
+
     # 执行一次检查
-    check_log_file()
-    
-    print(f"[{datetime.now()}] 检查完成，程序退出")
+    started_at = time.monotonic()
+    check_log_files(config)
+
+    print(f"[{datetime.now()}] 检查完成（耗时 {time.monotonic() - started_at:.2f} 秒），程序退出")
     print("=" * 60)
 
 
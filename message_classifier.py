@@ -0,0 +1,155 @@
+import re
+
+# [两个汉字] 表情触发/表情回复
+EMOJI_PATTERN = re.compile(r'^\[[\u4e00-\u9fa5]{2}\]$')
+# @提及(如"@机器人 你好"中的"@机器人 "),支持中文/英文/数字
+MENTION_PATTERN = re.compile(r'@[\u4e00-\u9fa5A-Za-z0-9_. ]+\s*')
+
+# Dify回复中的媒体标记: 标记文本 + (URL),每种标记对应一种千寻发送方式
+# 新增媒体类型(音频、文档等)只需在配置media_markers中追加,例如:
+# {"name": "audio", "marker": "[点击收听音频]", "send_type": "sendFile", "extension": ".mp3"}
+DEFAULT_MEDIA_MARKERS = [
+    {"name": "image", "marker": "![Generated Image]", "send_type": "sendImage", "extension": ".jpg"},
+    {"name": "video", "marker": "[点击下载视频]", "send_type": "sendFile", "extension": ".mp4"}
+]
+# 标记与URL之间以"(http"连接,按"标记最后一个字符 + (http"做子串查找,先排除不含媒体的回复
+MEDIA_URL_OPEN = '(http'
+
+
+def is_emoji(text):
+    """
+    是否为[两个汉字]格式的表情
+    """
+    return EMOJI_PATTERN.match(text.strip()) is not None
+
+
+def strip_mentions(text):
+    """
+    移除消息中的@提及
+    """
+    return MENTION_PATTERN.sub('', text).strip()
+
+
+def is_refer_xml(msg):
+    """
+    是否为XML引用消息(包含<title>和<refermsg><content>标签)
+    """
+    return '<title>' in msg and '<refermsg>' in msg and '<content>' in msg
+
+
+class IncomingMessage:
+    """
+    收到的消息的分类结果,每条消息只计算一次,随消息传递
+    """
+
+    __slots__ = ('msg', 'is_emoji', 'is_refer', 'query_is_emoji')
+
+    def __init__(self, msg):
+        self.msg = msg
+        self.is_emoji = is_emoji(msg)
+        self.is_refer = is_refer_xml(msg)
+        self.query_is_emoji = None
+
+    def classify_query(self, query):
+        """
+        记录发给Dify的内容是否为表情(决定低优先级和会话重置)
+        内容就是原消息(私聊、表情触发、没有@提及)时复用已有的分类结果
+        """
+        self.query_is_emoji = self.is_emoji if query == self.msg.strip() else is_emoji(query)
+        return self.query_is_emoji
+
+
+class MediaMarker:
+    """
+    一种媒体标记及其发送方式(sendImage / sendFile + 文件扩展名)
+    """
+
+    __slots__ = ('name', 'marker', 'send_type', 'extension')
+
+    def __init__(self, name, marker, send_type='sendFile', extension=''):
+        self.name = name
+        self.marker = marker
+        self.send_type = send_type
+        self.extension = extension
+
+
+class MediaMarkers:
+    """
+    媒体标记注册表: 所有标记合并为一个正则,一次扫描把回复切分为按原顺序排列的文本段和媒体段
+    """
+
+    def __init__(self, markers=None):
+        self._markers = {}
+        for marker in DEFAULT_MEDIA_MARKERS + list(markers or []):
+            self.register(**marker)
+
+    def register(self, name, marker, send_type='sendFile', extension=''):
+        """
+        注册(或按标记文本覆盖)一种媒体标记
+        """
+        if not marker:
+            raise ValueError(f"media marker '{name}' must not be empty")
+        self._markers[marker] = MediaMarker(name, marker, send_type, extension)
+        # 快速路径的子串由已注册的标记推出(默认标记都以]结尾,只有一个"](http")
+        self._url_prefixes = sorted({text[-1] + MEDIA_URL_OPEN for text in self._markers})
+        # 长标记优先,避免一个标记是另一个的后缀时匹配到较短的那个
+        alternatives = '|'.join(re.escape(text) for text in sorted(self._markers, key=len, reverse=True))
+        self._pattern = re.compile(rf'(?P<marker>{alternatives})\((?P<url>https?://[^\)]+)\)')
+
+    def all(self):
+        return list(self._markers.values())
+
+    def by_name(self, name):
+        for marker in self._markers.values():
+            if marker.name == name:
+                return marker
+        return None
+
+    def tokenize(self, text):
+        """
+        返回: [(None, 文本), (MediaMarker, URL), ...],保持原文顺序;文本段已去掉首尾空白,空文本段不返回
+        """
+        for prefix in self._url_prefixes:
+            if prefix in text:
+                break
+        else:
+            return [(None, text)] if text.strip() else []
+
+        # split一次切分: [文本, 标记, URL, 文本, 标记, URL, ..., 文本]
+        parts = self._pattern.split(text)
+        markers = self._markers
+        segments = []
+        for idx in range(0, len(parts) - 1, 3):
+            chunk = parts[idx].strip()
+            if chunk:
+                segments.append((None, chunk))
+            segments.append((markers[parts[idx + 1]], parts[idx + 2]))
+        chunk = parts[-1].strip()
+        if chunk:
+            segments.append((None, chunk))
+        return segments
+
+
+# 未单独配置时使用的默认注册表
+default_media_markers = MediaMarkers()
+
+
+class DifyReply:
+    """
+    Dify回复的分类结果: 表情回复 / 文本与媒体(图片、视频等链接)交错的分段 / 普通文本
+    """
+
+    __slots__ = ('text', 'is_emoji', 'segments', 'has_media')
+
+    def __init__(self, text, media_markers=None):
+        self.text = text
+        self.is_emoji = is_emoji(text)
+        self.segments = (media_markers or default_media_markers).tokenize(text)
+        # 相邻文本之间必有媒体段,所以只有一段且为文本时才不含媒体
+        self.has_media = len(self.segments) > 1 or (bool(self.segments) and self.segments[0][0] is not None)
+
+    def media_urls(self, name):
+        """
+        返回: 某种媒体(如image、video)的全部URL
+        """
+        return [url for marker, url in self.segments if marker is not None and marker.name == name]
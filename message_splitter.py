@@ -0,0 +1,139 @@
+import re
+import time
+
+# 单条微信文本消息的默认字节上限(UTF-8),超出则拆分发送
+DEFAULT_MAX_BYTES = 4000
+# 拆分后每段之间的发送间隔(秒)
+DEFAULT_PART_INTERVAL = 1.0
+
+# 为"(12/34)\n"这样的分段标记预留的字节数
+MARKER_RESERVE = 16
+
+# 句子边界: 中英文句末标点(保留在句子末尾)
+SENTENCE_PATTERN = re.compile(r'[^。！？!?；;\n]*[。！？!?；;]+|[^。！？!?；;\n]+$')
+
+
+def byte_len(text):
+    return len(text.encode('utf-8'))
+
+
+def hard_split(text, budget):
+    """
+    按字节预算硬切(不会切断多字节字符)
+    """
+    pieces = []
+    current = []
+    current_bytes = 0
+    for char in text:
+        char_bytes = byte_len(char)
+        if current and current_bytes + char_bytes > budget:
+            pieces.append(''.join(current))
+            current = []
+            current_bytes = 0
+        current.append(char)
+        current_bytes += char_bytes
+    if current:
+        pieces.append(''.join(current))
+    return pieces
+
+
+def split_units(text, budget):
+    """
+    将文本切成不超过预算的最小单元: 优先按行,超长行按句子,超长句子硬切
+    每个单元保留自身的换行符,依次拼接即可还原原文
+    """
+    units = []
+    for line in text.splitlines(keepends=True):
+        if byte_len(line) <= budget:
+            units.append(line)
+            continue
+
+        body = line.rstrip('\n')
+        ending = line[len(body):]
+        sentences = SENTENCE_PATTERN.findall(body) or [body]
+        # 正则没有覆盖的字符(理论上不会出现)时退回到整行硬切
+        if ''.join(sentences) != body:
+            sentences = [body]
+        for sentence in sentences:
+            if byte_len(sentence) <= budget:
+                units.append(sentence)
+            else:
+                units.extend(hard_split(sentence, budget))
+        if ending:
+            units[-1] += ending
+    return units
+
+
+def split_message(text, max_bytes=DEFAULT_MAX_BYTES, with_markers=True):
+    """
+    按字节预算拆分长消息
+    在行/句子边界处切分,多段时在每段前加"(1/3)"样式的标记
+    返回: 分段列表(不需要拆分时只有一段,原样返回)
+    """
+    if byte_len(text) <= max_bytes:
+        return [text]
+
+    budget = max(1, max_bytes - (MARKER_RESERVE if with_markers else 0))
+    parts = []
+    current = []
+    current_bytes = 0
+    for unit in split_units(text, budget):
+        unit_bytes = byte_len(unit)
+        if current and current_bytes + unit_bytes > budget:
+            parts.append(''.join(current))
+            current = []
+            current_bytes = 0
+        current.append(unit)
+        current_bytes += unit_bytes
+    if current:
+        parts.append(''.join(current))
+
+    parts = [part.strip('\n') for part in parts]
+    parts = [part for part in parts if part.strip()]
+    if with_markers and len(parts) > 1:
+        total = len(parts)
+        parts = [f"({idx}/{total})\n{part}" for idx, part in enumerate(parts, 1)]
+    return parts
+
+
+def send_parts(parts, send_func, interval=DEFAULT_PART_INTERVAL, retries=1):
+    """
+    按顺序发送分段,每段之间间隔interval秒
+    单段失败时只重试该段(最多retries次),不会重发整条消息
+    :param send_func: 发送单段的函数,返回真值表示成功
+    返回: 是否所有分段都发送成功
+    """
+    all_sent = True
+    for idx, part in enumerate(parts):
+        if idx > 0 and interval > 0:
+            time.sleep(interval)
+
+        sent = False
+        for attempt in range(retries + 1):
+            if attempt > 0 and interval > 0:
+                time.sleep(interval)
+            if send_func(part):
+                sent = True
+                break
+        if not sent:
+            all_sent = False
+    return all_sent
+
+
+def send_long_text(text, send_func, max_bytes=DEFAULT_MAX_BYTES, interval=DEFAULT_PART_INTERVAL, retries=1):
+    """
+    拆分并发送长文本
+    返回: 是否所有分段都发送成功
+    """
+    return send_parts(split_message(text, max_bytes), send_func, interval=interval, retries=retries)
+
+
+def summarize_lines(lines, head=30, tail=30):
+    """
+    行数过多时只保留开头和结尾,中间用省略行数代替
+    返回: 处理后的行列表
+    """
+    if len(lines) <= head + tail:
+        return list(lines)
+    omitted = len(lines) - head - tail
+    return list(lines[:head]) + [f"... 省略 {omitted} 行 ..."] + list(lines[len(lines) - tail:])
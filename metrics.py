@@ -0,0 +1,29 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    进程内计数器,线程安全
+    名称使用点分格式,如 admission.shed.busy
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def get(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+
+# 全局实例
+metrics = Metrics()
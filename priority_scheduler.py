@@ -0,0 +1,254 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# 默认通道配置(按优先级从高到低)
+# weight: 加权轮询权重,越大被调度的机会越多
+# max_concurrency: 该通道同时执行的任务上限
+# max_queue: 该通道排队任务上限,超过则拒绝
+DEFAULT_LANES = {
+    "private": {"weight": 8, "max_concurrency": 4, "max_queue": 200},
+    "mention": {"weight": 4, "max_concurrency": 4, "max_queue": 200},
+    "keyword": {"weight": 2, "max_concurrency": 2, "max_queue": 100},
+    "scheduled": {"weight": 1, "max_concurrency": 2, "max_queue": 500}  # 定时任务和群发
+}
+
+
+class Lane:
+    """
+    单个调度通道: 排队队列、并发计数以及排队耗时统计
+    """
+
+    def __init__(self, name, weight=1, max_concurrency=1, max_queue=100, priority=0):
+        self.name = name
+        self.weight = max(1, int(weight))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(1, int(max_queue))
+        self.priority = priority  # 数字越小优先级越高,权重相同时用于决胜
+        self.queue = deque()
+        self.running = 0
+        self.current_weight = 0  # 平滑加权轮询的当前权重
+
+        # 统计信息
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.wait_samples = deque(maxlen=500)
+
+    def is_eligible(self):
+        return bool(self.queue) and self.running < self.max_concurrency
+
+    def record_wait(self, wait_seconds):
+        self.total_wait += wait_seconds
+        self.max_wait = max(self.max_wait, wait_seconds)
+        self.wait_samples.append(wait_seconds)
+
+    def stats(self):
+        samples = sorted(self.wait_samples)
+        started = self.completed + self.failed + self.running
+
+        def percentile(p):
+            if not samples:
+                return 0.0
+            return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+        return {
+            "weight": self.weight,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queued": len(self.queue),
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "queue_time_ms": {
+                "avg": round(self.total_wait / started * 1000, 2) if started else 0.0,
+                "p50": round(percentile(0.50) * 1000, 2),
+                "p95": round(percentile(0.95) * 1000, 2),
+                "max": round(self.max_wait * 1000, 2)
+            }
+        }
+
+
+class PriorityScheduler:
+    """
+    多通道优先级工作调度器
+    私聊、@消息、关键词/表情触发、定时任务分别进入不同通道,
+    工作线程按平滑加权轮询从有空闲并发额度的通道中取任务执行,
+    避免定时广播或关键词刷屏占满线程和Dify额度
+    """
+
+    def __init__(self, scheduler_config=None, name='lane-worker'):
+        scheduler_config = scheduler_config or {}
+        self.name = name  # 工作线程名前缀(多个调度器并存时区分)
+        lanes_config = scheduler_config.get('lanes') or DEFAULT_LANES
+        self.workers = max(1, int(scheduler_config.get('workers', 8)))
+
+        self.lanes = {}
+        for priority, (name, lane_config) in enumerate(lanes_config.items()):
+            self.lanes[name] = Lane(
+                name,
+                weight=lane_config.get('weight', 1),
+                max_concurrency=lane_config.get('max_concurrency', 1),
+                max_queue=lane_config.get('max_queue', 100),
+                priority=priority
+            )
+
+        self._cond = threading.Condition()
+        self._running = {}  # 正在执行的任务: id(future) -> (通道名, func, args, kwargs)
+        self._threads = []
+        self._started = False
+        self._stopped = False
+
+    def start(self):
+        """
+        启动工作线程(重复调用无副作用)
+        """
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+
+        for idx in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"{self.name}-{idx}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("Priority scheduler started with %s worker(s), lanes: %s", self.workers, ', '.join(self.lanes))
+
+    def submit(self, lane_name, func, *args, **kwargs):
+        """
+        提交任务到指定通道
+        返回: Future对象;通道不存在或队列已满时返回None
+        """
+        lane = self.lanes.get(lane_name)
+        if lane is None:
+            logger.error("Unknown scheduler lane: %s", lane_name)
+            return None
+
+        if not self._started:
+            self.start()
+
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                lane.rejected += 1
+                return None
+            if len(lane.queue) >= lane.max_queue:
+                lane.rejected += 1
+                logger.warning("Lane '%s' queue full (%s), rejecting task", lane_name, lane.max_queue)
+                return None
+            lane.queue.append((time.monotonic(), future, func, args, kwargs))
+            lane.submitted += 1
+            self._cond.notify()
+        return future
+
+    def _pick_lane(self):
+        """
+        平滑加权轮询(与nginx相同的算法),只在可执行的通道之间选择
+        调用方必须持有self._cond
+        """
+        eligible = [lane for lane in self.lanes.values() if lane.is_eligible()]
+        if not eligible:
+            return None
+
+        total_weight = 0
+        best = None
+        for lane in eligible:
+            lane.current_weight += lane.weight
+            total_weight += lane.weight
+            if best is None or lane.current_weight > best.current_weight or \
+                    (lane.current_weight == best.current_weight and lane.priority < best.priority):
+                best = lane
+        best.current_weight -= total_weight
+        return best
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                lane = self._pick_lane()
+                while lane is None:
+                    if self._stopped:
+                        return
+                    self._cond.wait()
+                    lane = self._pick_lane()
+                enqueued_at, future, func, args, kwargs = lane.queue.popleft()
+                lane.running += 1
+                lane.record_wait(time.monotonic() - enqueued_at)
+                self._running[id(future)] = (lane.name, func, args, kwargs)
+
+            failed = False
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    failed = True
+                    logger.error("Task in lane '%s' failed: %s", lane.name, e, exc_info=True)
+                    future.set_exception(e)
+
+            with self._cond:
+                lane.running -= 1
+                self._running.pop(id(future), None)
+                if failed:
+                    lane.failed += 1
+                else:
+                    lane.completed += 1
+                # 并发额度释放后可能有其他通道变为可执行
+                self._cond.notify_all()
+
+    def stats(self):
+        """
+        返回各通道的排队/执行/排队耗时统计
+        """
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "lanes": {name: lane.stats() for name, lane in self.lanes.items()}
+            }
+
+    def drain(self, timeout):
+        """
+        停止接收新任务,等待排队和执行中的任务在timeout秒内完成
+        到期后仍在排队的任务被取消(不再执行)
+        返回: (未执行的任务, 仍在执行的任务),每项为(通道名, func, args, kwargs)
+        """
+        deadline = time.monotonic() + max(0.0, timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+            while self._started and (self._running or any(lane.queue for lane in self.lanes.values())):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            queued = []
+            for lane in self.lanes.values():
+                while lane.queue:
+                    _, future, func, args, kwargs = lane.queue.popleft()
+                    future.cancel()
+                    queued.append((lane.name, func, args, kwargs))
+            running = list(self._running.values())
+
+        if queued or running:
+            logger.warning("Scheduler drain timed out: %s queued and %s running task(s) left",
+                           len(queued), len(running))
+        return queued, running
+
+    def shutdown(self, wait=True):
+        """
+        停止接收新任务,工作线程在队列清空后退出
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
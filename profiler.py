@@ -0,0 +1,151 @@
+import hmac
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+DEFAULT_PROFILING_CONFIG = {
+    "token": "",             # 管理接口令牌,为空时禁用性能分析接口
+    "max_duration": 60,      # 单次采样最长秒数
+    "sample_interval": 0.01, # 采样间隔(秒)
+    "max_depth": 64,         # 每个调用栈最多保留的帧数
+    "tracemalloc_frames": 1  # tracemalloc每次分配记录的帧数,越大越准但开销越高
+}
+
+
+class ProfilerBusy(Exception):
+    """已有采样会话在运行"""
+
+
+def check_token(expected, provided):
+    """
+    校验管理令牌;未配置令牌时一律拒绝
+    """
+    if not expected or not provided:
+        return False
+    # compare_digest不支持含非ASCII字符的str,统一按UTF-8字节比较
+    return hmac.compare_digest(str(expected).encode('utf-8'), str(provided).encode('utf-8'))
+
+
+def frame_stack(frame, max_depth):
+    """
+    将帧链转为从外到内的"函数 (文件:行)"列表
+    """
+    stack = []
+    while frame is not None and len(stack) < max_depth:
+        code = frame.f_code
+        filename = code.co_filename.rsplit('/', 1)[-1]
+        stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class SamplingProfiler:
+    """
+    基于sys._current_frames()的采样分析器
+    只在会话期间运行一个后台采样线程,不做任何插桩;未运行时没有开销
+    同一时间只允许一个会话
+    """
+
+    def __init__(self, profiling_config=None):
+        profiling_config = {**DEFAULT_PROFILING_CONFIG, **(profiling_config or {})}
+        self.max_duration = float(profiling_config['max_duration'])
+        self.sample_interval = float(profiling_config['sample_interval'])
+        self.max_depth = int(profiling_config['max_depth'])
+        self._session_lock = threading.Lock()
+
+    def profile(self, duration, interval=None):
+        """
+        在当前进程上采样duration秒(阻塞调用线程)
+        返回: {"collapsed": 火焰图折叠栈文本, "threads": 按线程汇总, ...}
+        """
+        duration = min(max(float(duration), 0.1), self.max_duration)
+        interval = max(float(interval or self.sample_interval), 0.001)
+        if not self._session_lock.acquire(blocking=False):
+            raise ProfilerBusy("profiling session already running")
+        try:
+            return self._run(duration, interval)
+        finally:
+            self._session_lock.release()
+
+    def _run(self, duration, interval):
+        own_ident = threading.get_ident()
+        stacks = Counter()
+        thread_samples = Counter()
+        thread_top = defaultdict(Counter)
+        samples = 0
+
+        started_at = time.monotonic()
+        deadline = started_at + duration
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                thread_name = names.get(ident, str(ident))
+                stack = frame_stack(frame, self.max_depth)
+                if not stack:
+                    continue
+                stacks[';'.join([thread_name] + stack)] += 1
+                thread_samples[thread_name] += 1
+                thread_top[thread_name][stack[-1]] += 1
+            samples += 1
+            time.sleep(interval)
+        elapsed = time.monotonic() - started_at
+
+        collapsed = '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+        threads = {
+            name: {
+                "samples": count,
+                "top_frames": [{"frame": frame, "samples": n} for frame, n in thread_top[name].most_common(10)]
+            }
+            for name, count in thread_samples.most_common()
+        }
+        return {
+            "duration": round(elapsed, 3),
+            "interval": interval,
+            "samples": samples,
+            "threads": threads,
+            "collapsed": collapsed
+        }
+
+
+def memory_start(frames=1):
+    """
+    开始跟踪内存分配(已在跟踪时不做任何事)
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(max(1, int(frames)))
+    return True
+
+
+def memory_stop():
+    tracemalloc.stop()
+
+
+def memory_snapshot(top=20, key_type='lineno'):
+    """
+    返回tracemalloc占用最多的N个位置;未开始跟踪时返回None
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    stats = snapshot.statistics(key_type)
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "top": [
+            {
+                "location": str(stat.traceback[0]),
+                "size_bytes": stat.size,
+                "count": stat.count
+            }
+            for stat in stats[:top]
+        ]
+    }
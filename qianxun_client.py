@@ -0,0 +1,55 @@
+import logging
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class QianxunClient:
+    """
+    千寻框架HTTP API客户端
+    所有发送共用一个requests.Session,复用到千寻的长连接(连接池)
+    """
+
+    def __init__(self, api_url, timeout=10, pool_size=10):
+        self.api_url = api_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def call(self, bot_wxid, msg_type, data):
+        """
+        调用千寻接口
+        返回: 千寻的响应JSON;请求异常时返回{"error": "..."}
+        """
+        payload = {
+            "type": msg_type,
+            "data": data
+        }
+        try:
+            response = self.session.post(self.api_url, params={"wxid": bot_wxid}, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error("Qianxun API request failed (%s): %s", msg_type, e)
+            return {"error": str(e)}
+
+    def send_text(self, bot_wxid, target_wxid, message, msg_type='sendText2'):
+        """
+        发送文本消息
+        返回: 千寻的响应JSON
+        """
+        return self.call(bot_wxid, msg_type, {"wxid": target_wxid, "msg": message})
+
+    def close(self):
+        self.session.close()
+
+
+def is_success(result):
+    """
+    千寻响应是否表示发送成功
+    """
+    return isinstance(result, dict) and result.get('code') == 200
@@ -0,0 +1,120 @@
+import re
+from xml.parsers import expat
+
+# 只检查开头的BOM/空白和第一个字符,普通文本不会被完整扫描
+XML_START_PATTERN = re.compile(r'\ufeff?\s*<')
+
+
+class ReferMessageHandler:
+    """
+    expat回调: 只收集第一个<title>(非根节点)和第一个<refermsg><content>(refermsg非根节点)的直接文本
+    与ElementTree的 root.find('.//title').text / root.find('.//refermsg/content').text 语义一致:
+    - refermsg嵌套时按refermsg的开始顺序取,外层refermsg的content优先于先出现的内层content
+    - 带命名空间的元素名为"uri}name"(与ElementTree的"{uri}name"一样不会匹配)
+    """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.stack = []
+        self.title = None
+        self.refer_content = None
+        self._refermsgs = []         # 未结束的refermsg(非根节点)的开始序号
+        self._refermsg_count = 0
+        self._refer_owner = None     # refer_content所属refermsg的开始序号
+        self._capture_field = None   # 正在收集的字段名
+        self._capture_owner = None
+        self._capture_parts = []
+        # 文本回调只在收集字段时挂上,其余文本不进入Python
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+
+    @property
+    def done(self):
+        # 还有更早开始的外层refermsg未结束时,它的content可能排在前面
+        return self.title is not None and self._refer_owner is not None \
+            and (not self._refermsgs or self._refermsgs[0] > self._refer_owner)
+
+    def start_element(self, name, attrs):
+        if self._capture_field is not None:
+            # 出现子元素,element.text到此结束
+            self._finish_capture()
+
+        self.stack.append(name)
+        depth = len(self.stack)
+        if name == 'title' and self.title is None and depth > 1:
+            self._begin_capture('title', None)
+        elif name == 'content' and depth > 2 and self.stack[-2] == 'refermsg':
+            owner = self._refermsgs[-1]
+            if self._refer_owner is None or owner < self._refer_owner:
+                self._begin_capture('refer_content', owner)
+        elif name == 'refermsg' and depth > 1:
+            self._refermsgs.append(self._refermsg_count)
+            self._refermsg_count += 1
+
+    def end_element(self, name):
+        if self._capture_field is not None:
+            self._finish_capture()
+        if name == 'refermsg' and len(self.stack) > 1:
+            self._refermsgs.pop()
+            self._detach_if_done()
+        self.stack.pop()
+
+    def character_data(self, data):
+        self._capture_parts.append(data)
+
+    def _begin_capture(self, field, owner):
+        self._capture_field = field
+        self._capture_owner = owner
+        self._capture_parts = []
+        self.parser.CharacterDataHandler = self.character_data
+
+    def _finish_capture(self):
+        setattr(self, self._capture_field, ''.join(self._capture_parts))
+        if self._capture_field == 'refer_content':
+            self._refer_owner = self._capture_owner
+        self._capture_field = None
+        self._capture_parts = []
+        self.parser.CharacterDataHandler = None
+        self._detach_if_done()
+
+    def _detach_if_done(self):
+        if self.done:
+            # 两个字段都已确定,剩余部分只由expat检查格式
+            self.parser.StartElementHandler = None
+            self.parser.EndElementHandler = None
+
+
+def extract_refer_fields(msg):
+    """
+    从引用消息XML中提取(title, refer_content)
+    - 不是以<开头的文本直接返回None(只看开头,O(1))
+    - 不构建整棵树;两个字段都找到后不再回调Python,剩余部分只检查格式
+    - XML格式错误(截断、根元素后有多余内容等)返回None,与ElementTree整树解析一致
+    返回: (title, refer_content),缺失的字段为空字符串;不是XML则返回None
+    """
+    if not msg or XML_START_PATTERN.match(msg) is None:
+        return None
+
+    parser = expat.ParserCreate(namespace_separator='}')
+    handler = ReferMessageHandler(parser)
+    try:
+        parser.Parse(msg, True)
+    except (expat.ExpatError, UnicodeEncodeError):
+        # 格式错误的XML(如以<开头的普通文本),或含有无法编码的孤立代理字符(JSON的\ud800)
+        return None
+    finally:
+        # 断开handler与parser之间的引用环,由引用计数立即回收,不等GC
+        handler.parser = None
+
+    return handler.title or "", handler.refer_content or ""
+
+
+def combine_refer_fields(title_text, refer_content):
+    """
+    拼接内容: "被引用的内容\n当前消息内容"
+    返回: 拼接后的文本,两个字段都为空时返回None
+    """
+    if refer_content and title_text:
+        return f"{refer_content}\n{title_text}"
+    return refer_content or title_text or None
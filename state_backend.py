@@ -0,0 +1,469 @@
+import heapq
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_CONFIG = {
+    "backend": "memory",                # memory | sqlite | redis
+    "sqlite_path": "bridge_state.db",   # 多节点共享时放在共享卷上
+    "redis_url": "redis://127.0.0.1:6379/0",
+    "key_prefix": "wxbridge:",
+    "node_id": "",                      # 为空时使用 主机名-进程号
+    "dedup_ttl": 600,                   # msgId去重保留秒数
+    "lease_ttl": 30,                    # 定时任务主节点租约秒数
+    "outbox_replay_after": 300,         # 发件箱中超过该秒数仍未完成的回复由主节点补发
+    # memory后端: 退出时把会话ID和发件箱写入该文件,下次启动时读回(读回后删除),为空则不保存
+    "memory_snapshot": "bridge_state_snapshot.json"
+}
+
+
+def default_node_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class MemoryStateBackend:
+    """
+    进程内状态(默认),单节点部署使用
+    配置了snapshot_path时,会话ID和发件箱在退出(close)时保存,重启后恢复;去重记录和租约不保存
+    """
+
+    def __init__(self, snapshot_path=None):
+        self._lock = threading.Lock()
+        self._conversations = {}
+        self._seen = {}
+        self._seen_expiry = []  # (过期时间, msg_key)小顶堆,与_seen一一对应
+        self._outbox = {}
+        self._leases = {}
+        self.snapshot_path = snapshot_path
+        if snapshot_path:
+            self._load_snapshot()
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.snapshot_path):
+            return
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # 读回后删除,避免进程异常退出后再次启动时重复补发旧的发件箱记录
+            os.remove(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load state snapshot %s: %s", self.snapshot_path, e)
+            return
+        for namespace, key, conversation_id in data.get('conversations', []):
+            self._conversations[(namespace, key)] = conversation_id
+        for entry_id, created, payload in data.get('outbox', []):
+            self._outbox[entry_id] = (created, payload)
+        logger.info("Restored %s conversation(s) and %s outbox entry(ies) from %s",
+                    len(self._conversations), len(self._outbox), self.snapshot_path)
+
+    def _save_snapshot(self):
+        with self._lock:
+            data = {
+                "conversations": [[namespace, key, conversation_id]
+                                  for (namespace, key), conversation_id in self._conversations.items()],
+                "outbox": [[entry_id, created, payload] for entry_id, (created, payload) in self._outbox.items()]
+            }
+        tmp_path = self.snapshot_path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.snapshot_path)
+            logger.info("Saved %s conversation(s) and %s outbox entry(ies) to %s",
+                        len(data['conversations']), len(data['outbox']), self.snapshot_path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error("Failed to save state snapshot %s: %s", self.snapshot_path, e)
+
+    # --- 会话ID ---
+    def get_conversation(self, namespace, key):
+        return self._conversations.get((namespace, key))
+
+    def set_conversation(self, namespace, key, conversation_id):
+        self._conversations[(namespace, key)] = conversation_id
+
+    def delete_conversation(self, namespace, key):
+        self._conversations.pop((namespace, key), None)
+
+    def count_conversations(self, namespace):
+        with self._lock:
+            return sum(1 for ns, _ in list(self._conversations) if ns == namespace)
+
+    # --- msgId去重 ---
+    def mark_seen(self, msg_key, ttl):
+        """
+        记录消息已处理
+        返回: True表示首次出现,False表示重复
+        """
+        now = time.time()
+        with self._lock:
+            # 每次只从堆顶弹出已过期的记录,不遍历整个表
+            while self._seen_expiry and self._seen_expiry[0][0] <= now:
+                _, expired_key = heapq.heappop(self._seen_expiry)
+                del self._seen[expired_key]
+            if msg_key in self._seen:
+                return False
+            self._seen[msg_key] = now + ttl
+            heapq.heappush(self._seen_expiry, (now + ttl, msg_key))
+            return True
+
+    # --- 发件箱 ---
+    def outbox_add(self, payload, created=None):
+        """
+        :param created: 记录时间,默认为当前时间;传0表示下次补发时立即处理(例如退出前未完成的任务)
+        """
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._outbox[entry_id] = (time.time() if created is None else created, payload)
+        return entry_id
+
+    def outbox_remove(self, entry_id):
+        with self._lock:
+            self._outbox.pop(entry_id, None)
+
+    def outbox_claim_stale(self, older_than):
+        """
+        取出并删除超过older_than秒仍未完成的发件箱记录
+        """
+        cutoff = time.time() - older_than
+        with self._lock:
+            stale = [entry_id for entry_id, (created, _) in self._outbox.items() if created < cutoff]
+            return [self._outbox.pop(entry_id)[1] for entry_id in stale]
+
+    def outbox_size(self):
+        return len(self._outbox)
+
+    # --- 租约 ---
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(name)
+            if current is None or current[0] == owner or current[1] <= now:
+                self._leases[name] = (owner, now + ttl)
+                return True
+            return False
+
+    def release_lease(self, name, owner):
+        with self._lock:
+            current = self._leases.get(name)
+            if current is not None and current[0] == owner:
+                del self._leases[name]
+
+    def close(self):
+        if self.snapshot_path:
+            self._save_snapshot()
+
+
+class SQLiteStateBackend:
+    """
+    SQLite状态,数据库文件放在共享卷上即可被多个节点共享
+    每个线程使用独立连接,需要原子性的操作使用BEGIN IMMEDIATE
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS conversations ("
+        " namespace TEXT NOT NULL, key TEXT NOT NULL, conversation_id TEXT NOT NULL,"
+        " updated REAL NOT NULL, PRIMARY KEY (namespace, key))",
+        "CREATE TABLE IF NOT EXISTS seen_messages (msg_key TEXT PRIMARY KEY, expires REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS outbox (id TEXT PRIMARY KEY, created REAL NOT NULL, payload TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)",
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        for statement in self.SCHEMA:
+            conn.execute(statement)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: 自动提交,需要事务时显式BEGIN
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, func):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_conversation(self, namespace, key):
+        row = self._conn().execute(
+            "SELECT conversation_id FROM conversations WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_conversation(self, namespace, key, conversation_id):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO conversations (namespace, key, conversation_id, updated) VALUES (?, ?, ?, ?)",
+            (namespace, key, conversation_id, time.time())
+        )
+
+    def delete_conversation(self, namespace, key):
+        self._conn().execute("DELETE FROM conversations WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def count_conversations(self, namespace):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM conversations WHERE namespace = ?", (namespace,)
+        ).fetchone()[0]
+
+    def mark_seen(self, msg_key, ttl):
+        now = time.time()
+
+        def mark(conn):
+            conn.execute("DELETE FROM seen_messages WHERE msg_key = ? AND expires <= ?", (msg_key, now))
+            cursor = conn.execute("INSERT OR IGNORE INTO seen_messages (msg_key, expires) VALUES (?, ?)",
+                                  (msg_key, now + ttl))
+            if cursor.rowcount and hash(msg_key) % 100 == 0:
+                conn.execute("DELETE FROM seen_messages WHERE expires <= ?", (now,))
+            return cursor.rowcount == 1
+
+        return self._transaction(mark)
+
+    def outbox_add(self, payload, created=None):
+        entry_id = uuid.uuid4().hex
+        self._conn().execute("INSERT INTO outbox (id, created, payload) VALUES (?, ?, ?)",
+                             (entry_id, time.time() if created is None else created,
+                              json.dumps(payload, ensure_ascii=False)))
+        return entry_id
+
+    def outbox_remove(self, entry_id):
+        self._conn().execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+    def outbox_claim_stale(self, older_than):
+        cutoff = time.time() - older_than
+
+        def claim(conn):
+            rows = conn.execute("SELECT id, payload FROM outbox WHERE created < ?", (cutoff,)).fetchall()
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in rows])
+            return [json.loads(row[1]) for row in rows]
+
+        return self._transaction(claim)
+
+    def outbox_size(self):
+        return self._conn().execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+
+        def acquire(conn):
+            row = conn.execute("SELECT owner, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (name, owner, expires) VALUES (?, ?, ?)",
+                         (name, owner, now + ttl))
+            return True
+
+        return self._transaction(acquire)
+
+    def release_lease(self, name, owner):
+        self._conn().execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# 续约/抢占租约: 键不存在或已属于自己时设置并刷新过期时间
+LEASE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current == false or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisStateBackend:
+    """
+    Redis(或兼容协议的存储)状态,需要安装redis包
+    可以传入任意redis兼容的client(例如测试时使用本地替身)
+    """
+
+    def __init__(self, url=None, key_prefix='wxbridge:', client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("state.backend=redis requires the 'redis' package (pip install redis)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = key_prefix
+
+    def _key(self, *parts):
+        return self.prefix + ':'.join(parts)
+
+    def get_conversation(self, namespace, key):
+        return self.client.hget(self._key('conversations', namespace), key)
+
+    def set_conversation(self, namespace, key, conversation_id):
+        self.client.hset(self._key('conversations', namespace), key, conversation_id)
+
+    def delete_conversation(self, namespace, key):
+        self.client.hdel(self._key('conversations', namespace), key)
+
+    def count_conversations(self, namespace):
+        return self.client.hlen(self._key('conversations', namespace))
+
+    def mark_seen(self, msg_key, ttl):
+        return bool(self.client.set(self._key('seen', msg_key), 1, nx=True, ex=max(1, int(ttl))))
+
+    def outbox_add(self, payload, created=None):
+        entry_id = uuid.uuid4().hex
+        created = time.time() if created is None else created
+        self.client.hset(self._key('outbox'), entry_id,
+                         json.dumps({"created": created, "payload": payload}, ensure_ascii=False))
+        return entry_id
+
+    def outbox_remove(self, entry_id):
+        self.client.hdel(self._key('outbox'), entry_id)
+
+    def outbox_claim_stale(self, older_than):
+        cutoff = time.time() - older_than
+        claimed = []
+        for entry_id, raw in self.client.hgetall(self._key('outbox')).items():
+            entry = json.loads(raw)
+            # HDEL返回1的节点才算取到,多个节点同时补发时不会重复
+            if entry['created'] < cutoff and self.client.hdel(self._key('outbox'), entry_id) == 1:
+                claimed.append(entry['payload'])
+        return claimed
+
+    def outbox_size(self):
+        return self.client.hlen(self._key('outbox'))
+
+    def acquire_lease(self, name, owner, ttl):
+        return bool(self.client.eval(LEASE_SCRIPT, 1, self._key('lease', name), owner, int(ttl * 1000)))
+
+    def release_lease(self, name, owner):
+        self.client.eval(RELEASE_SCRIPT, 1, self._key('lease', name), owner)
+
+    def close(self):
+        close = getattr(self.client, 'close', None)
+        if close:
+            close()
+
+
+def create_state_backend(state_config=None):
+    """
+    根据配置创建状态后端
+    """
+    state_config = {**DEFAULT_STATE_CONFIG, **(state_config or {})}
+    backend = state_config['backend']
+    if backend == 'sqlite':
+        logger.info("Using SQLite state backend: %s", state_config['sqlite_path'])
+        return SQLiteStateBackend(state_config['sqlite_path'])
+    if backend == 'redis':
+        logger.info("Using Redis state backend: %s", state_config['redis_url'])
+        return RedisStateBackend(state_config['redis_url'], state_config['key_prefix'])
+    if backend != 'memory':
+        logger.warning("Unknown state backend '%s', using memory", backend)
+    return MemoryStateBackend(state_config['memory_snapshot'])
+
+
+class ConversationMap:
+    """
+    某个机器人的会话ID命名空间,提供与dict相同的用法(get/[]/in/del/len)
+    """
+
+    def __init__(self, backend, namespace):
+        self.backend = backend
+        self.namespace = namespace
+
+    def get(self, key, default=None):
+        value = self.backend.get_conversation(self.namespace, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.backend.get_conversation(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, conversation_id):
+        self.backend.set_conversation(self.namespace, key, conversation_id)
+
+    def __delitem__(self, key):
+        self.backend.delete_conversation(self.namespace, key)
+
+    def __contains__(self, key):
+        return self.backend.get_conversation(self.namespace, key) is not None
+
+    def __len__(self):
+        return self.backend.count_conversations(self.namespace)
+
+
+class LeaderElector:
+    """
+    基于租约的主节点选举
+    后台线程每隔ttl/3续约一次;续约失败(或存储不可用)时立即放弃主节点身份
+    """
+
+    def __init__(self, backend, name, node_id, ttl=30, on_tick=None):
+        self.backend = backend
+        self.name = name
+        self.node_id = node_id
+        self.ttl = max(3.0, float(ttl))
+        self.on_tick = on_tick  # 作为主节点时每次续约后调用(例如补发发件箱)
+        self.is_leader = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="leader-elector", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                acquired = self.backend.acquire_lease(self.name, self.node_id, self.ttl)
+            except Exception as e:
+                logger.error("Lease renewal failed: %s", e)
+                acquired = False
+
+            if acquired != self.is_leader:
+                logger.info("Node %s %s leadership of '%s'", self.node_id,
+                            "acquired" if acquired else "lost", self.name)
+            self.is_leader = acquired
+
+            if acquired and self.on_tick:
+                try:
+                    self.on_tick()
+                except Exception as e:
+                    logger.error("Leader task failed: %s", e, exc_info=True)
+
+            self._stop.wait(self.ttl / 3)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.ttl)
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                self.backend.release_lease(self.name, self.node_id)
+            except Exception as e:
+                logger.error("Failed to release lease: %s", e)
@@ -0,0 +1,73 @@
+import importlib
+import json
+import sys
+
+import pytest
+
+
+def bridge_config(workdir):
+    return {
+        "bot_wxid": "wxid_bot",
+        "dify": {"default": {"api_url": "http://127.0.0.1:9/v1/chat-messages", "api_key": "app-test",
+                             "timeout": 60},
+                 "group_mapping": {}},
+        "weixin": {"api_url": "http://127.0.0.1:9/qianxun/httpapi"},
+        "server": {"host": "127.0.0.1", "port": 0, "debug": False},
+        "trigger_keywords": [],
+        "blacklist": [],
+        "messages": {"empty_message_reply": "empty", "default_reply": "default", "service_unavailable": "unavailable:"},
+        "scheduled_tasks": [],
+        "state": {"backend": "memory", "memory_snapshot": ""},
+        "usage": {"path": str(workdir / 'usage.json')},
+        "warmup": {"enabled": False},
+        "profiling": {"token": "admin-token"},
+        "logging": {"level": "CRITICAL"}
+    }
+
+
+def import_bridge(workdir, config):
+    """
+    app在导入时读取当前目录下的config.json,在workdir中写入配置后重新导入
+    """
+    (workdir / 'config.json').write_text(json.dumps(config), encoding='utf-8')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workdir)
+        sys.modules.pop('app', None)
+        return importlib.import_module('app')
+
+
+@pytest.fixture(scope='session')
+def bridge(tmp_path_factory):
+    pytest.importorskip('flask')
+    pytest.importorskip('requests')
+    workdir = tmp_path_factory.mktemp('bridge-app')
+    app = import_bridge(workdir, bridge_config(workdir))
+    yield app
+    sys.modules.pop('app', None)
+
+
+@pytest.fixture
+def restart_bridge(tmp_path):
+    """
+    每次调用导入一个新的app实例(模拟进程重启),共用同一个工作目录;用完后恢复原来的app模块
+    """
+    pytest.importorskip('flask')
+    pytest.importorskip('requests')
+    previous = sys.modules.get('app')
+
+    def restart(**overrides):
+        config = bridge_config(tmp_path)
+        for section, values in overrides.items():
+            config[section] = {**config.get(section, {}), **values}
+        return import_bridge(tmp_path, config)
+
+    yield restart
+    if previous is not None:
+        sys.modules['app'] = previous
+    else:
+        sys.modules.pop('app', None)
+
+
+@pytest.fixture
+def client(bridge):
+    return bridge.app.test_client()
@@ -0,0 +1,42 @@
+from adaptive_timeout import AdaptiveTimeouts
+
+
+def fill(timeouts, app_name, seconds, count=20):
+    for _ in range(count):
+        timeouts.record(app_name, seconds)
+
+
+def test_uses_configured_timeout_until_enough_samples():
+    timeouts = AdaptiveTimeouts({"min_samples": 20})
+    fill(timeouts, "app", 1.0, count=19)
+    assert timeouts.read_timeout("app", {"timeout": 60}) == 60.0
+
+
+def test_adapts_to_observed_latency():
+    timeouts = AdaptiveTimeouts({"min_samples": 20, "factor": 2, "min_timeout": 10})
+    fill(timeouts, "app", 8.0)
+    assert timeouts.read_timeout("app", {"timeout": 60}) == 16.0
+
+
+def test_never_exceeds_configured_timeout():
+    timeouts = AdaptiveTimeouts({"min_samples": 20})
+    fill(timeouts, "app", 50.0)
+    assert timeouts.read_timeout("app", {"timeout": 60}) == 60.0
+
+
+def test_floor_is_clamped_to_configured_timeout_below_min_timeout():
+    timeouts = AdaptiveTimeouts({"min_samples": 20, "min_timeout": 10})
+    fill(timeouts, "app", 0.1)
+    assert timeouts.read_timeout("app", {"timeout": 3}) == 3.0
+
+
+def test_per_app_max_timeout_clamps_floor():
+    timeouts = AdaptiveTimeouts({"min_samples": 20, "min_timeout": 10})
+    fill(timeouts, "app", 0.1)
+    assert timeouts.read_timeout("app", {"timeout": 60, "max_timeout": 5}) == 5.0
+
+
+def test_disabled_returns_configured_timeout():
+    timeouts = AdaptiveTimeouts({"adaptive": False, "min_samples": 1})
+    fill(timeouts, "app", 0.1)
+    assert timeouts.read_timeout("app", {"timeout": 3}) == 3.0
@@ -0,0 +1,92 @@
+import pytest
+
+from admission import AdmissionController, ADMIT, BUSY, DROP
+from metrics import metrics
+
+
+@pytest.fixture
+def counters():
+    """
+    返回计数器相对测试开始时的增量(全局计数器在测试之间共享)
+    """
+    before = metrics.snapshot()
+    return lambda name: metrics.get(name) - before.get(name, 0)
+
+
+def test_total_cap(counters):
+    controller = AdmissionController({"max_inflight": 2, "max_inflight_per_group": 5})
+    assert controller.try_admit('g1') == ADMIT
+    assert controller.try_admit('g2') == ADMIT
+    assert controller.try_admit('g3') == BUSY
+    assert controller.try_admit('g3', low_priority=True) == DROP
+
+    assert counters('admission.admitted') == 2
+    assert counters('admission.shed.busy') == 1
+    assert counters('admission.shed.drop') == 1
+    assert counters('admission.shed_reason.total_cap') == 2
+
+    controller.release('g1')
+    assert controller.try_admit('g3') == ADMIT
+    assert controller.stats()['inflight'] == 2
+
+
+def test_group_cap(counters):
+    controller = AdmissionController({"max_inflight": 10, "max_inflight_per_group": 1})
+    assert controller.try_admit('g1') == ADMIT
+    assert controller.try_admit('g1') == BUSY
+    assert controller.try_admit('g2') == ADMIT
+    assert counters('admission.shed_reason.group_cap') == 1
+
+    controller.release('g1')
+    assert controller.try_admit('g1') == ADMIT
+    assert controller.stats()['busiest_groups'] == {'g1': 1, 'g2': 1}
+
+
+def test_wait_budget(counters):
+    controller = AdmissionController({"max_inflight": 10, "max_inflight_per_group": 10, "max_estimated_wait": 5},
+                                     concurrency=1)
+    for _ in range(10):
+        controller.record_latency(3.0)
+    # 前面没有请求时不需要等待;前面已有2个请求时估计等待6秒,超出预算
+    assert controller.try_admit('g1') == ADMIT
+    assert controller.try_admit('g1') == ADMIT
+    assert controller.estimate_wait(2) == 6.0
+    assert controller.try_admit('g1') == BUSY
+    assert counters('admission.shed_reason.wait_budget') == 1
+
+
+def test_low_priority_gets_busy_reply_when_drop_disabled():
+    controller = AdmissionController({"max_inflight": 1, "drop_low_priority": False})
+    assert controller.try_admit('g1') == ADMIT
+    assert controller.try_admit('g2', low_priority=True) == BUSY
+
+
+def test_disabled_always_admits(counters):
+    controller = AdmissionController({"enabled": False, "max_inflight": 1})
+    assert [controller.try_admit('g1') for _ in range(3)] == [ADMIT] * 3
+    controller.release('g1')
+    assert counters('admission.admitted') == 0
+    assert controller.stats()['inflight'] == 0
+
+
+def test_release_never_goes_negative():
+    controller = AdmissionController({"max_inflight": 1})
+    controller.release('g1')
+    assert controller.stats()['inflight'] == 0
+    assert controller.try_admit('g1') == ADMIT
+    assert controller.try_admit('g2') == BUSY
+
+
+def test_slot_released_when_handler_raises(bridge, monkeypatch):
+    admission = bridge.bots.resolve('wxid_bot').admission
+    inflight = admission.stats()['inflight']
+
+    def broken_handler(*args, **kwargs):
+        raise RuntimeError('dify exploded')
+
+    monkeypatch.setattr(bridge, 'handle_incoming_message', broken_handler)
+    assert admission.try_admit('group@chatroom') == ADMIT
+    with pytest.raises(RuntimeError):
+        bridge.handle_admitted_message("你好", 'group@chatroom', 'msg-1', 'wxid_bot')
+    assert admission.stats()['inflight'] == inflight
+    assert 'group@chatroom' not in admission.stats()['busiest_groups']
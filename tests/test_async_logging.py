@@ -0,0 +1,68 @@
+import json
+import logging
+
+import pytest
+
+from async_logging import setup_logging
+from metrics import metrics
+
+
+@pytest.fixture
+def stderr(capsys):
+    """
+    setup_logging会替换根日志的处理器,测试结束后恢复;返回读取已写出的stderr的函数
+    """
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield lambda: capsys.readouterr().err
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_async_mode_flushes_queue_on_stop(stderr):
+    listener = setup_logging({"mode": "async", "format": "json", "queue_size": 1000})
+    logger = logging.getLogger('bridge-test')
+    for idx in range(500):
+        logger.info("message %s", idx, extra={'msgId': f'm{idx}', 'stage': 'reply'})
+    # stop()等待后台线程写完队列中剩余的记录
+    listener.stop()
+    lines = [json.loads(line) for line in stderr().splitlines()]
+    assert [line['msg'] for line in lines] == [f"message {idx}" for idx in range(500)]
+    assert lines[-1]['msgId'] == 'm499' and lines[-1]['stage'] == 'reply'
+
+
+def test_full_queue_drops_and_counts(stderr):
+    listener = setup_logging({"mode": "async", "queue_size": 10})
+    # 不启动写线程,让队列积满
+    listener.stop()
+    before = metrics.get('logging.dropped')
+    logger = logging.getLogger('bridge-test')
+    for idx in range(15):
+        logger.warning("message %s", idx)
+    assert metrics.get('logging.dropped') - before == 5
+    assert listener.queue.qsize() == 10
+
+
+def test_sampling_keeps_one_in_n(stderr):
+    listener = setup_logging({"mode": "async", "sample_rates": {"ignored": 10}})
+    logger = logging.getLogger('bridge-test')
+    for idx in range(25):
+        logger.info("ignored %s", idx, extra={'sample': 'ignored'})
+    logger.info("kept")
+    listener.stop()
+    output = stderr()
+    assert output.count('ignored') == 3
+    assert 'kept' in output
+
+
+def test_sync_mode_writes_immediately(stderr):
+    assert setup_logging({"mode": "sync", "level": "WARNING"}) is None
+    logger = logging.getLogger('bridge-test')
+    logger.info("hidden")
+    logger.warning("shown %s", 1)
+    output = stderr()
+    assert 'hidden' not in output
+    assert 'WARNING - shown 1' in output
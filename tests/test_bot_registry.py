@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+from bot_registry import BotRegistry
+
+
+def make_config(**overrides):
+    config = {
+        "bot_wxid": "wxid_main",
+        "dify": {"default": {"api_url": "http://dify/v1", "api_key": "app-main"},
+                 "group_mapping": {"vip@chatroom": {"api_url": "http://dify/v1", "api_key": "app-vip",
+                                                    "rate_limit": {"group_rate": 1}}}},
+        "trigger_keywords": ["@主号"],
+        "bots": {
+            "wxid_main": {"description": "主号"},
+            "wxid_sales": {"description": "销售号", "trigger_keywords": ["@销售"],
+                           "dify": {"default": {"api_url": "http://dify/v1", "api_key": "app-sales"}}},
+        },
+        "scheduler": {"workers": 1},
+    }
+    config.update(overrides)
+    return config
+
+
+def group_body(bot_wxid, msg, at_list=None, group="team@chatroom"):
+    return json.dumps({
+        "event": 10008, "wxid": bot_wxid,
+        "data": {"type": "recvMsg", "data": {"fromType": 2, "msgType": 1, "msgSource": 0, "fromWxid": group,
+                                             "finalFromWxid": "wxid_member", "atWxidList": at_list or [],
+                                             "msg": msg}}
+    }, ensure_ascii=False).encode('utf-8')
+
+
+@pytest.fixture
+def make_registry():
+    registries = []
+
+    def make(config):
+        registry = BotRegistry(config)
+        registries.append(registry)
+        return registry
+
+    yield make
+    for registry in registries:
+        registry.shutdown(wait=False)
+
+
+def test_registered_bots_and_unknown_bot(make_registry):
+    registry = make_registry(make_config())
+    assert registry.resolve("wxid_main") is registry.default
+    assert registry.resolve("wxid_sales").description == "销售号"
+    # 配置了bots且顶层bot_wxid不为空时,未登记的账号不处理
+    assert not registry.catch_all
+    assert registry.resolve("wxid_unknown") is None
+    assert {bot.wxid for bot in registry.all()} == {"wxid_main", "wxid_sales"}
+
+
+@pytest.mark.parametrize('overrides', [{"bots": {}}, {"bot_wxid": ""}], ids=['no-bots', 'empty-bot-wxid'])
+def test_unknown_bot_falls_through_to_catch_all(make_registry, overrides):
+    registry = make_registry(make_config(**overrides))
+    assert registry.catch_all
+    assert registry.resolve("wxid_unknown") is registry.default
+    assert registry.should_handle(group_body("wxid_unknown", "@主号 你好"))
+
+
+def test_bots_are_isolated(make_registry):
+    registry = make_registry(make_config())
+    main, sales = registry.resolve("wxid_main"), registry.resolve("wxid_sales")
+    assert main.scheduler is not sales.scheduler
+    assert main.admission is not sales.admission
+    main.conversations["team@chatroom"] = "conv-main"
+    assert sales.conversations.get("team@chatroom") is None
+
+
+def test_should_handle_uses_each_bots_keywords(make_registry):
+    registry = make_registry(make_config())
+    assert registry.should_handle(group_body("wxid_main", "@主号 在吗"))
+    assert not registry.should_handle(group_body("wxid_main", "@销售 在吗"))
+    assert registry.should_handle(group_body("wxid_sales", "@销售 在吗"))
+    assert not registry.should_handle(group_body("wxid_sales", "@主号 在吗"))
+    # 每个机器人只认@自己的消息
+    assert registry.should_handle(group_body("wxid_sales", "在吗", at_list=["wxid_sales"]))
+    assert not registry.should_handle(group_body("wxid_sales", "在吗", at_list=["wxid_main"]))
+
+
+def test_should_handle_when_bot_is_unknown_or_missing(make_registry):
+    registry = make_registry(make_config())
+    # 未登记的账号和没有wxid的回调交给完整流程(由完整流程按未知机器人忽略)
+    assert registry.should_handle(group_body("wxid_unknown", "闲聊"))
+    assert registry.should_handle(b'{"event": 10008, "data": {}}')
+
+
+def test_group_specific_dify_config(make_registry):
+    registry = make_registry(make_config())
+    main, sales = registry.resolve("wxid_main"), registry.resolve("wxid_sales")
+    assert main.get_dify_config("vip@chatroom")["api_key"] == "app-vip"
+    assert main.get_dify_config("team@chatroom")["api_key"] == "app-main"
+    assert main.get_dify_config("wxid_friend")["api_key"] == "app-main"
+    assert main.group_rate_limit("vip@chatroom") == {"group_rate": 1}
+    assert main.group_rate_limit("team@chatroom") is None
+    # 单独配置了dify的机器人不使用顶层的群映射
+    assert sales.get_dify_config("vip@chatroom")["api_key"] == "app-sales"
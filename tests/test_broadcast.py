@@ -0,0 +1,164 @@
+import threading
+import time
+
+import pytest
+
+from broadcast import Broadcaster, BroadcastJob, BroadcastSkipped, SENT, FAILED, SKIPPED
+from priority_scheduler import PriorityScheduler
+
+
+class FakeBot:
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+
+class FakeBots:
+    def __init__(self, scheduler):
+        self.bot = FakeBot(scheduler)
+
+    def resolve(self, wxid):
+        return self.bot if wxid == 'wxid_bot' else None
+
+
+@pytest.fixture
+def scheduler():
+    # 群发通道只有一个工作线程,重试等待期间如果占着线程,其他任务就无法执行
+    scheduler = PriorityScheduler({"workers": 1, "lanes": {"scheduled": {"max_concurrency": 1, "max_queue": 100}}})
+    yield scheduler
+    scheduler.shutdown(wait=False)
+
+
+def wait_done(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while job.state != 'done' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return job.state == 'done'
+
+
+def test_broadcast_sends_all_targets(scheduler):
+    sent = []
+    cleaned = []
+    broadcaster = Broadcaster({"concurrency": 2}, FakeBots(scheduler),
+                              lambda job, target: sent.append(target.wxid) or True, cleanup=cleaned.append)
+    job = broadcaster.submit(BroadcastJob('wxid_bot', ['a', 'b', 'a', 'c'], segments=[(None, "通知")]))
+
+    assert wait_done(job)
+    assert sorted(sent) == ['a', 'b', 'c']
+    assert job.counts()[SENT] == 3
+    assert cleaned == [job]
+
+
+def test_failed_and_skipped_targets(scheduler):
+    def send_target(job, target):
+        if target.wxid == 'skip':
+            raise BroadcastSkipped('blacklist')
+        if target.wxid == 'broken':
+            raise RuntimeError('qianxun down')
+        return True
+
+    broadcaster = Broadcaster({"retries": 1, "retry_backoff": 0.05}, FakeBots(scheduler), send_target)
+    job = broadcaster.submit(BroadcastJob('wxid_bot', ['ok', 'skip', 'broken'], segments=[(None, "通知")]))
+
+    assert wait_done(job)
+    states = {target['wxid']: (target['state'], target['attempts']) for target in job.snapshot()['targets']}
+    assert states == {'ok': (SENT, 1), 'skip': (SKIPPED, 1), 'broken': (FAILED, 2)}
+
+
+def test_retry_backoff_does_not_hold_a_worker(scheduler):
+    attempts = []
+
+    def send_target(job, target):
+        attempts.append(time.monotonic())
+        return len(attempts) > 1
+
+    broadcaster = Broadcaster({"retries": 2, "retry_backoff": 0.5}, FakeBots(scheduler), send_target)
+    job = broadcaster.submit(BroadcastJob('wxid_bot', ['flaky'], segments=[(None, "通知")]))
+    while not attempts:
+        time.sleep(0.01)
+
+    # 目标在等待重试,此时同一通道的其他任务应能立即执行
+    other = threading.Event()
+    submitted_at = time.monotonic()
+    scheduler.submit('scheduled', other.set)
+    assert other.wait(2)
+    assert time.monotonic() - submitted_at < 0.3
+    assert job.state == 'running'
+
+    assert wait_done(job)
+    assert job.counts()[SENT] == 1
+    assert attempts[1] - attempts[0] >= 0.45
+
+
+def test_submit_validation(scheduler):
+    broadcaster = Broadcaster({"max_targets": 2}, FakeBots(scheduler), lambda job, target: True)
+    with pytest.raises(ValueError):
+        broadcaster.submit(BroadcastJob('wxid_bot', [], segments=[(None, "通知")]))
+    with pytest.raises(ValueError):
+        broadcaster.submit(BroadcastJob('wxid_bot', ['a', 'b', 'c'], segments=[(None, "通知")]))
+    with pytest.raises(ValueError):
+        broadcaster.submit(BroadcastJob('wxid_unknown', ['a'], segments=[(None, "通知")]))
+
+
+@pytest.mark.parametrize('body', [
+    ["a"],
+    "text",
+    {"targets": "wxid_a", "message": "hi"},
+    {"targets": ["wxid_a"], "message": {"text": "hi"}},
+    {"targets": ["wxid_a"], "prompt": ["hi"]},
+    {"targets": ["wxid_a"], "media": "https://example.com/a.png"},
+    {"targets": ["wxid_a"], "media": ["https://example.com/a.png"]},
+    {"targets": ["wxid_a"], "media": [{"type": "image", "url": 1}]},
+    {"targets": ["wxid_a"], "media": [{"type": "sticker", "url": "https://example.com/a.png"}]},
+    {"targets": ["wxid_a"]},
+])
+def test_create_broadcast_rejects_malformed_body(client, body):
+    response = client.post('/broadcast', json=body, headers={'X-Admin-Token': 'admin-token'})
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_create_broadcast_requires_token(client):
+    response = client.post('/broadcast', json={"targets": ["wxid_a"], "message": "hi"})
+    assert response.status_code == 403
+
+
+def test_in_flight_targets_are_unfinished():
+    job = BroadcastJob('wxid_bot', ['a', 'b', 'c'], segments=[(None, "通知")])
+    sending, _ = job.next_target()
+    done, _ = job.next_target()
+    done.state = SENT
+    assert [target.wxid for target in job.unfinished()] == [sending.wxid, 'c']
+
+
+def test_drain_persists_in_flight_targets(bridge):
+    job = BroadcastJob('wxid_bot', ['wxid_a', 'wxid_b'], segments=[(None, "第一段"), (None, "第二段")])
+    target, _ = job.next_target()
+    target.next_segment = 1
+    bridge.broadcaster._jobs[job.id] = job
+    try:
+        leftovers = [payload for payload in bridge.broadcast_leftovers() if payload['task'] == 'api']
+    finally:
+        bridge.broadcaster._jobs.pop(job.id)
+    assert [(payload['target_wxid'], payload['segments']) for payload in leftovers] == [
+        ('wxid_a', [[None, "第二段"]]), ('wxid_b', [[None, "第一段"], [None, "第二段"]])]
+
+
+def test_prefetched_media_falls_back_to_url(bridge, monkeypatch):
+    calls = []
+
+    def send_media(target_wxid, marker, media_url, bot_wxid):
+        calls.append(media_url)
+        return media_url.startswith('http')
+
+    monkeypatch.setattr(bridge, 'send_weixin_media', send_media)
+    image = bridge.media_markers.by_name('image')
+    job = BroadcastJob('wxid_bot', ['wxid_a'], segments=[(image, 'https://example.com/a.png')])
+    job.media_paths['https://example.com/a.png'] = '/tmp/broadcast_media/a.png'
+    target, _ = job.next_target()
+
+    assert bridge.send_broadcast_target(job, target)
+    assert calls == ['/tmp/broadcast_media/a.png', 'https://example.com/a.png']
+
+
+def test_prefetch_is_opt_in():
+    assert Broadcaster(None, None, None).config['prefetch_media'] is False
@@ -0,0 +1,131 @@
+import json
+
+import pytest
+
+from callback_filter import CallbackPrefilter
+from message_classifier import is_emoji, is_refer_xml
+
+BOT_WXID = "wxid_bot"
+TRIGGER_KEYWORDS = ["@AI小朋", "天气/预报"]
+
+
+def make_message(msg, at_list=None, event=10008, msg_type=1, msg_source=0):
+    return {
+        "event": event,
+        "wxid": BOT_WXID,
+        "data": {
+            "type": "recvMsg",
+            "data": {
+                "fromType": 2,
+                "msgType": msg_type,
+                "msgSource": msg_source,
+                "fromWxid": "48683142917@chatroom",
+                "finalFromWxid": "wxid_member",
+                "atWxidList": at_list or [],
+                "msg": msg,
+                "msgId": "8473628193746251234"
+            }
+        }
+    }
+
+
+def encode(message, ensure_ascii=False):
+    return json.dumps(message, ensure_ascii=ensure_ascii).encode('utf-8')
+
+
+def full_path_handles(raw_body):
+    """
+    完整流程(JSON解析后的回调/群消息处理)是否会处理这条消息
+    """
+    message_data = json.loads(raw_body)
+    if message_data.get('event') != 10008:
+        return True  # 私聊和其他事件由各自的处理流程决定
+    data_info = message_data['data']['data']
+    msg = data_info.get('msg', '')
+    if data_info.get('msgType') != 1 and not is_refer_xml(msg):
+        return False
+    if data_info.get('msgSource') == 1:
+        return False
+    return (BOT_WXID in data_info.get('atWxidList', [])
+            or any(keyword in msg for keyword in TRIGGER_KEYWORDS)
+            or is_emoji(msg))
+
+
+@pytest.fixture
+def prefilter():
+    return CallbackPrefilter(BOT_WXID, TRIGGER_KEYWORDS)
+
+
+GROUP_MESSAGES = {
+    "plain": make_message("今天中午吃什么?"),
+    "long": make_message("这是一段比较长的聊天内容。" * 80),
+    "at-other": make_message("@张三 明天开会", at_list=["wxid_other"]),
+    "at-bot": make_message("@AI小朋 你好", at_list=[BOT_WXID]),
+    "at-bot-among-others": make_message("@张三 @AI小朋 你好", at_list=["wxid_other", BOT_WXID]),
+    "keyword": make_message("问下@AI小朋 今天天气"),
+    "keyword-with-slash": make_message("天气/预报 北京"),
+    "emoji": make_message("[微笑]"),
+    "emoji-leading-space": make_message("  [微笑]\n"),
+    "emoji-escaped-whitespace": make_message("\n\t\f[微笑]"),
+    "emoji-ideographic-space": make_message("\u3000[微笑]\u3000"),
+    "emoji-nbsp": make_message("\xa0[微笑]"),
+    "self-sent": make_message("@AI小朋 你好", at_list=[BOT_WXID], msg_source=1),
+    "self-sent-emoji": make_message("[微笑]", msg_source=1),
+    "image": make_message("<msg><img/></msg>", msg_type=3),
+}
+
+# 预过滤只做廉价的字节查找,以下消息会交给完整流程再被忽略(多解析一次,不会漏处理)
+CONSERVATIVE_MESSAGES = {
+    "bracket-not-emoji": make_message("[链接] 看这个"),
+    "keyword-in-other-field": make_message("今天中午吃什么?", at_list=["@AI小朋"]),
+}
+
+ALL_MESSAGES = {**GROUP_MESSAGES, **CONSERVATIVE_MESSAGES}
+
+
+@pytest.mark.parametrize('message', GROUP_MESSAGES.values(), ids=list(GROUP_MESSAGES))
+def test_same_decision_as_full_path(prefilter, message):
+    raw_body = encode(message)
+    assert prefilter.should_handle(raw_body) == full_path_handles(raw_body)
+
+
+@pytest.mark.parametrize('message', CONSERVATIVE_MESSAGES.values(), ids=list(CONSERVATIVE_MESSAGES))
+def test_conservative_accepts(prefilter, message):
+    raw_body = encode(message)
+    assert prefilter.should_handle(raw_body)
+    assert not full_path_handles(raw_body)
+
+
+@pytest.mark.parametrize('message', ALL_MESSAGES.values(), ids=list(ALL_MESSAGES))
+def test_escaped_body_is_never_dropped(prefilter, message):
+    # \u转义的中文和\/转义的斜杠无法在原始请求体上匹配,只能交给完整流程
+    for raw_body in (encode(message, ensure_ascii=True), encode(message).replace(b'/', b'\\/')):
+        assert json.loads(raw_body) == message
+        if full_path_handles(raw_body):
+            assert prefilter.should_handle(raw_body)
+        if (b'\\u' in raw_body or b'\\/' in raw_body) and message['data']['data']['msgSource'] != 1:
+            assert prefilter.should_handle(raw_body)
+
+
+@pytest.mark.parametrize('key', ['event', 'atWxidList', 'msg'])
+def test_escaped_keys_go_to_full_path(prefilter, key):
+    message = make_message("@AI小朋 你好", at_list=[BOT_WXID])
+    escaped_key = '\\u%04x' % ord(key[0]) + key[1:]
+    raw_body = encode(message).replace(f'"{key}"'.encode(), f'"{escaped_key}"'.encode(), 1)
+    assert json.loads(raw_body) == message
+    assert full_path_handles(raw_body)
+    assert prefilter.should_handle(raw_body)
+
+
+@pytest.mark.parametrize('event', [10009, 10010, 10014, None])
+def test_non_target_events_go_to_full_path(prefilter, event):
+    message = make_message("今天中午吃什么?", event=event)
+    if event is None:
+        del message['event']
+    assert prefilter.should_handle(encode(message))
+
+
+def test_without_bot_wxid_any_mention_goes_to_full_path():
+    prefilter = CallbackPrefilter('', TRIGGER_KEYWORDS)
+    assert prefilter.should_handle(encode(make_message("@张三 明天开会", at_list=["wxid_other"])))
+    assert not prefilter.should_handle(encode(make_message("今天中午吃什么?")))
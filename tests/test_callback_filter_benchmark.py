@@ -0,0 +1,101 @@
+"""
+群聊回调预过滤基准测试(pytest-benchmark)
+对比"被忽略的群消息"在原完整流程(JSON解析 + json.dumps记录日志 + 引用/触发检查)
+和快速预过滤下的单条耗时
+
+阈值: 预过滤单条耗时不超过MAX_US,且至少比原流程快MIN_SPEEDUP倍
+运行: python -m pytest tests/test_callback_filter_benchmark.py
+"""
+
+import json
+import re
+import timeit
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from callback_filter import CallbackPrefilter
+
+BOT_WXID = "wxid_alwc6m6hw4rs22"
+TRIGGER_KEYWORDS = ["@AI小朋", "@叶若涵"]
+
+# 预过滤单条耗时上限(微秒),为慢速CI机器留出余量
+MAX_US = 50
+# 相对原流程的最低加速比
+MIN_SPEEDUP = 2
+
+
+def make_body(msg, at_list=None):
+    return json.dumps({
+        "event": 10008,
+        "wxid": BOT_WXID,
+        "data": {
+            "type": "recvMsg",
+            "des": "收到消息",
+            "data": {
+                "timeStamp": "1733900000000",
+                "fromType": 2,
+                "msgType": 1,
+                "msgSource": 0,
+                "fromWxid": "48683142917@chatroom",
+                "finalFromWxid": "wxid_member0001",
+                "atWxidList": at_list or [],
+                "silence": 0,
+                "membercount": 300,
+                "signature": "v1_abcdefgh",
+                "msg": msg,
+                "msgId": "8473628193746251234"
+            }
+        }
+    }, ensure_ascii=False).encode('utf-8')
+
+
+# 用例id使用ASCII,便于在pytest-benchmark的报告中阅读
+CASES = {
+    "short-text": make_body("今天中午吃什么?"),
+    "long-text": make_body("这是一段比较长的聊天内容。" * 80),
+    "at-other-member": make_body("@张三 明天开会", at_list=["wxid_other"]),
+}
+
+
+def full_pipeline_ignore(raw_body):
+    """
+    原流程中被忽略的群消息需要做的工作
+    """
+    message_data = json.loads(raw_body)
+    _ = f"Received WeChat message: {json.dumps(message_data, ensure_ascii=False)[:500]}..."
+    data_info = message_data['data']['data']
+    msg_content = data_info.get('msg', '')
+    is_refer_message = '<title>' in msg_content and '<refermsg>' in msg_content and '<content>' in msg_content
+    if data_info.get('msgType') != 1 and not is_refer_message:
+        return False
+    if data_info.get('msgSource') == 1:
+        return False
+    msg = data_info['msg']
+    is_mentioned = BOT_WXID in data_info.get('atWxidList', [])
+    has_keyword = any(keyword in msg for keyword in TRIGGER_KEYWORDS)
+    is_simple_emoji = bool(re.match(r'^\[[一-龥]{2}\]$', msg.strip()))
+    return is_mentioned or has_keyword or is_simple_emoji
+
+
+def best_us(func, body, number=2000, repeat=5):
+    return min(timeit.repeat(lambda: func(body), number=number, repeat=repeat)) / number * 1e6
+
+
+@pytest.mark.parametrize('body', CASES.values(), ids=list(CASES))
+def test_prefilter_ignores_like_full_pipeline(body):
+    assert full_pipeline_ignore(body) is False
+    assert CallbackPrefilter(BOT_WXID, TRIGGER_KEYWORDS).should_handle(body) is False
+
+
+@pytest.mark.parametrize('body', CASES.values(), ids=list(CASES))
+def test_prefilter_speed(benchmark, body):
+    prefilter = CallbackPrefilter(BOT_WXID, TRIGGER_KEYWORDS)
+    benchmark.group = 'callback-prefilter'
+    benchmark(prefilter.should_handle, body)
+    assert benchmark.stats['min'] * 1e6 < MAX_US
+
+    full_us = best_us(full_pipeline_ignore, body)
+    fast_us = best_us(prefilter.should_handle, body)
+    assert full_us / fast_us >= MIN_SPEEDUP, f"预过滤 {fast_us:.2f}us/msg, 原流程 {full_us:.2f}us/msg"
@@ -0,0 +1,16 @@
+import pytest
+
+
+DEBUG_ENDPOINTS = ['/debug/scheduler', '/debug/bots', '/debug/metrics', '/debug/usage', '/debug/traces']
+
+
+@pytest.mark.parametrize('path', DEBUG_ENDPOINTS)
+def test_debug_endpoint_requires_token(client, path):
+    assert client.get(path).status_code == 403
+    assert client.get(path, headers={'X-Admin-Token': 'wrong'}).status_code == 403
+
+
+@pytest.mark.parametrize('path', DEBUG_ENDPOINTS)
+def test_debug_endpoint_with_token(client, path):
+    assert client.get(path, headers={'X-Admin-Token': 'admin-token'}).status_code == 200
+    assert client.get(path + '?token=admin-token').status_code == 200
@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('requests')
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     'benchmarks', 'bench_fault_scenarios.py')
+
+
+def test_fault_scenarios():
+    # 基准脚本会切换工作目录并以临时配置导入app,放在单独的进程中运行,不影响其他测试
+    result = subprocess.run([sys.executable, BENCH], capture_output=True, text=True, timeout=600)
+    assert result.returncode == 0, result.stdout + result.stderr[-2000:]
@@ -0,0 +1,101 @@
+import pytest
+
+pytest.importorskip('requests')
+
+import ip_monitor
+from ip_monitor import IpProbePool, IpChangeDebouncer
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """
+    每个探测地址返回固定的IP文本,值为异常时抛出
+    """
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.calls = []
+
+    def get(self, url, timeout=None):
+        self.calls.append(url)
+        answer = self.answers[url]
+        if isinstance(answer, Exception):
+            raise answer
+        return FakeResponse(answer)
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(answers):
+        pool = IpProbePool(list(answers), FakeSession(answers))
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.executor.shutdown(wait=True)
+
+
+def test_quorum_with_one_failed_probe(make_pool, monkeypatch):
+    monkeypatch.setattr(ip_monitor, 'PROBE_QUORUM', 2)
+    pool = make_pool({"http://a": "1.2.3.4\n", "http://b": ConnectionError("timeout"), "http://c": "1.2.3.4"})
+    assert pool.query() == "1.2.3.4"
+    assert pool.failures == {"http://a": 0, "http://b": 1, "http://c": 0}
+    # 失败过的探测排到最后
+    assert pool.ordered_urls()[-1] == "http://b"
+
+
+def test_error_page_is_not_a_vote(make_pool, monkeypatch):
+    monkeypatch.setattr(ip_monitor, 'PROBE_QUORUM', 2)
+    pool = make_pool({"http://a": "1.2.3.4", "http://b": "<html>502 Bad Gateway</html>", "http://c": "5.6.7.8"})
+    assert pool.query() is None
+    assert pool.failures["http://b"] == 1
+
+
+def test_remaining_probes_queried_when_first_batch_falls_short(make_pool, monkeypatch):
+    monkeypatch.setattr(ip_monitor, 'PROBE_QUORUM', 2)
+    answers = {"http://a": "1.2.3.4", "http://b": ConnectionError("down"), "http://c": ConnectionError("down"),
+               "http://d": "1.2.3.4"}
+    pool = make_pool(answers)
+    # 先让d成为最慢的探测,只在前3个结果不足时才查询
+    pool.latency = {"http://a": 0.1, "http://b": 0.1, "http://c": 0.1, "http://d": 5.0}
+    assert pool.query() == "1.2.3.4"
+    assert sorted(pool.session.calls) == sorted(answers)
+
+
+def test_quorum_not_reached_when_probes_disagree(make_pool, monkeypatch):
+    monkeypatch.setattr(ip_monitor, 'PROBE_QUORUM', 2)
+    pool = make_pool({"http://a": "1.2.3.4", "http://b": "5.6.7.8", "http://c": ConnectionError("down")})
+    assert pool.query() is None
+
+
+def test_flapping_change_is_suppressed():
+    debouncer = IpChangeDebouncer("1.1.1.1", debounce_count=3)
+    # 新旧IP交替出现,候选计数每次都被重置,不会认定为变化
+    for ip in ["2.2.2.2", "2.2.2.2", "1.1.1.1", "2.2.2.2", "3.3.3.3", "2.2.2.2", "2.2.2.2", "1.1.1.1"]:
+        assert debouncer.observe(ip) is None
+    assert debouncer.stored_ip == "1.1.1.1"
+    assert debouncer.candidate_ip is None
+
+
+def test_stable_change_is_confirmed_after_debounce():
+    debouncer = IpChangeDebouncer("1.1.1.1", debounce_count=3)
+    assert debouncer.observe("2.2.2.2") is None
+    assert debouncer.observe("2.2.2.2") is None
+    assert debouncer.observe("2.2.2.2") == "2.2.2.2"
+    # 保存失败(未confirm)时下一次检查仍然返回该IP
+    assert debouncer.observe("2.2.2.2") == "2.2.2.2"
+
+    debouncer.confirm("2.2.2.2")
+    assert debouncer.stored_ip == "2.2.2.2"
+    assert debouncer.observe("2.2.2.2") is None
+    assert debouncer.candidate_count == 0
@@ -0,0 +1,167 @@
+import gzip
+
+import pytest
+
+import log_monitor
+
+
+def make_config(tmp_path):
+    log_path = tmp_path / 'app.log'
+    log_path.write_text('', encoding='utf-8')
+    config = {
+        "wechat": {"api_url": "http://127.0.0.1:9/qianxun/httpapi", "wxid": "wxid_bot"},
+        "monitors": [{"name": "app", "paths": [str(log_path)], "keywords": ["[error]"], "id_pattern": r"req-\d+",
+                      "blacklist": [], "chatroom": "room@chatroom"}],
+        "alert_state": {"path": str(tmp_path / 'state.json'), "suppression_window": 3600}
+    }
+    return config, log_path
+
+
+def append(log_path, text):
+    with open(log_path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_failed_send_is_retried_on_next_check(tmp_path, monkeypatch):
+    config, log_path = make_config(tmp_path)
+    sent = []
+    results = iter([False, False, True])
+    monkeypatch.setattr(log_monitor, 'PART_INTERVAL', 0)
+    monkeypatch.setattr(log_monitor, 'send_wechat_message',
+                        lambda message, **kwargs: sent.append(message) or next(results))
+
+    append(log_path, "[error] req-1 数据库连接失败\n")
+    log_monitor.check_log_files(config)
+    state = log_monitor.AlertStateStore(config['alert_state'])
+    assert state.files == {}
+    assert state.fingerprints == {}
+
+    log_monitor.check_log_files(config)
+    assert sent == ["[error] req-1 数据库连接失败"] * 3
+    state = log_monitor.AlertStateStore(config['alert_state'])
+    assert state.files[str(log_path)]['offset'] == log_path.stat().st_size
+    assert [entry['last_sent'] > 0 for entry in state.fingerprints.values()] == [True]
+
+
+def test_sent_alert_is_suppressed_on_next_check(tmp_path, monkeypatch):
+    config, log_path = make_config(tmp_path)
+    sent = []
+    monkeypatch.setattr(log_monitor, 'PART_INTERVAL', 0)
+    monkeypatch.setattr(log_monitor, 'send_wechat_message',
+                        lambda message, **kwargs: sent.append(message) or True)
+
+    append(log_path, "[error] req-1 数据库连接失败\n")
+    log_monitor.check_log_files(config)
+    append(log_path, "[error] req-2 数据库连接失败\n")
+    log_monitor.check_log_files(config)
+
+    assert sent == ["[error] req-1 数据库连接失败"]
+    state = log_monitor.AlertStateStore(config['alert_state'])
+    assert [entry['suppressed'] for entry in state.fingerprints.values()] == [1]
+
+
+def test_related_lines_written_before_keyword_line_in_earlier_read(tmp_path, monkeypatch):
+    config, log_path = make_config(tmp_path)
+    sent = []
+    monkeypatch.setattr(log_monitor, 'PART_INTERVAL', 0)
+    monkeypatch.setattr(log_monitor, 'send_wechat_message',
+                        lambda message, **kwargs: sent.append(message) or True)
+
+    append(log_path, "req-7 开始处理订单\nreq-8 开始处理订单\n")
+    log_monitor.check_log_files(config)
+    assert sent == []
+
+    append(log_path, "[error] req-7 写入数据库失败\n")
+    log_monitor.check_log_files(config)
+    assert sent == ["req-7 开始处理订单\n[error] req-7 写入数据库失败"]
+
+
+def test_related_lines_written_after_keyword_line_in_later_read(tmp_path, monkeypatch):
+    config, log_path = make_config(tmp_path)
+    sent = []
+    monkeypatch.setattr(log_monitor, 'PART_INTERVAL', 0)
+    monkeypatch.setattr(log_monitor, 'send_wechat_message',
+                        lambda message, **kwargs: sent.append(message) or True)
+
+    append(log_path, "[error] req-7 写入数据库失败\n")
+    log_monitor.check_log_files(config)
+    append(log_path, "req-7 回滚事务\nreq-8 正常结束\n")
+    log_monitor.check_log_files(config)
+
+    assert sent == ["[error] req-7 写入数据库失败", "req-7 回滚事务"]
+
+
+def test_context_is_bounded(tmp_path, monkeypatch):
+    config, log_path = make_config(tmp_path)
+    config['alert_state']['context_lines'] = 2
+    monkeypatch.setattr(log_monitor, 'send_wechat_message', lambda message, **kwargs: True)
+
+    append(log_path, "".join(f"req-{idx} 处理中\n" for idx in range(5)))
+    log_monitor.check_log_files(config)
+
+    state = log_monitor.AlertStateStore(config['alert_state'])
+    assert state.files[str(log_path)]['context'] == ["req-3 处理中", "req-4 处理中"]
+
+
+def write_lines(path, count, newline_at_end=True):
+    text = "\n".join(f"line {idx:03d}" + " x" * (idx % 7) for idx in range(count))
+    path.write_text(text + ("\n" if newline_at_end else ""), encoding='utf-8')
+    return text.split("\n")
+
+
+@pytest.mark.parametrize('range_bytes', [1, 7, 13, 64, 10 ** 6])
+@pytest.mark.parametrize('newline_at_end', [True, False])
+def test_split_ranges_are_line_aligned(tmp_path, range_bytes, newline_at_end):
+    path = tmp_path / 'app.log'
+    lines = write_lines(path, 50, newline_at_end)
+    ranges = log_monitor.split_ranges(str(path), range_bytes)
+
+    # 区间首尾相接覆盖整个文件,每个区间(除最后一个)都在换行符之后结束
+    data = path.read_bytes()
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(ranges, ranges[1:]))
+    assert all(data[end - 1:end] == b"\n" for _, end in ranges[:-1])
+    assert [line for start, end in ranges for line in log_monitor.iter_range_lines(str(path), start, end)] == lines
+    if range_bytes >= len(data):
+        assert ranges == [(0, len(data))]
+
+
+def test_split_ranges_empty_file_and_gzip(tmp_path):
+    empty = tmp_path / 'empty.log'
+    empty.write_bytes(b"")
+    assert log_monitor.split_ranges(str(empty), 10) == []
+    assert log_monitor.split_ranges(str(tmp_path / 'app.log.1.gz'), 10) == [(None, None)]
+
+
+def test_iter_range_lines_reads_gzip(tmp_path):
+    path = tmp_path / 'app.log.1.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write("  第一行  \n\n[error] req-1 失败\n")
+    assert list(log_monitor.iter_range_lines(str(path), None, None)) == ["第一行", "[error] req-1 失败"]
+
+
+def test_backfill_matches_full_scan(tmp_path, monkeypatch):
+    config, log_path = make_config(tmp_path)
+    config['monitors'][0]['blacklist'] = ["忽略"]
+    text = "".join(
+        f"req-{idx} 开始处理\n" + ("填充内容\n" * 5) + (f"[error] req-{idx} 处理失败\n" if idx % 3 == 0 else "")
+        + (f"req-{idx} 已忽略\n" if idx % 2 == 0 else "")
+        for idx in range(30)
+    )
+    log_path.write_text(text, encoding='utf-8')
+    rotated = tmp_path / 'app.log.1.gz'
+    with gzip.open(rotated, 'wt', encoding='utf-8') as f:
+        f.write("req-100 旧的请求\n[error] req-100 旧的失败\nreq-101 无关\n")
+    # 区间很小时,关键字行和关联行落在同一文件的不同区间
+    monkeypatch.setattr(log_monitor, 'BACKFILL_RANGE_BYTES', 64)
+    assert len(log_monitor.split_ranges(str(log_path))) > 10
+
+    result = log_monitor.run_backfill(config, [str(tmp_path / 'app.log*')], workers=2)
+
+    expected = []
+    for path in (str(log_path), str(rotated)):
+        lines = list(log_monitor.iter_range_lines(path, *log_monitor.split_ranges(path, 10 ** 9)[0]))
+        expected.extend(log_monitor.scan_lines(lines, [log_monitor.MonitorRule(config['monitors'][0], 'wxid_bot')])['app'])
+    assert result == {'app': expected}
+    assert "req-0 开始处理" in expected and "req-0 已忽略" not in expected
+    assert expected[-2:] == ["req-100 旧的请求", "[error] req-100 旧的失败"]
@@ -0,0 +1,67 @@
+import pytest
+
+from message_classifier import MediaMarkers, DifyReply, IncomingMessage, strip_mentions
+
+IMAGE = "![Generated Image]"
+VIDEO = "[点击下载视频]"
+AUDIO = {"name": "audio", "marker": "<点击收听音频>", "send_type": "sendFile", "extension": ".mp3"}
+
+
+def flatten(segments):
+    return [(marker.name if marker is not None else None, content) for marker, content in segments]
+
+
+def test_tokenize_keeps_order_of_mixed_images_and_videos():
+    text = (f"开头\n{IMAGE}(https://e.com/1.png){VIDEO}(https://e.com/1.mp4)\n中间 "
+            f"{VIDEO}(http://e.com/2.mp4) {IMAGE}(https://e.com/2.png)结尾")
+    assert flatten(MediaMarkers().tokenize(text)) == [
+        (None, "开头"),
+        ("image", "https://e.com/1.png"),
+        ("video", "https://e.com/1.mp4"),
+        (None, "中间"),
+        ("video", "http://e.com/2.mp4"),
+        ("image", "https://e.com/2.png"),
+        (None, "结尾"),
+    ]
+
+
+def test_tokenize_text_without_media():
+    markers = MediaMarkers()
+    assert flatten(markers.tokenize("  普通回复 [链接](not-a-url) ")) == [(None, "  普通回复 [链接](not-a-url) ")]
+    assert markers.tokenize("  \n ") == []
+
+
+def test_marker_not_ending_in_bracket():
+    # 自定义标记不以]结尾时,快速路径不能跳过它
+    markers = MediaMarkers([AUDIO])
+    text = f"{VIDEO}(https://e.com/a.mp4)听这个{AUDIO['marker']}(https://e.com/a.mp3)"
+    assert flatten(markers.tokenize(text)) == [
+        ("video", "https://e.com/a.mp4"), (None, "听这个"), ("audio", "https://e.com/a.mp3")]
+    assert flatten(markers.tokenize(f"{AUDIO['marker']}(https://e.com/b.mp3)")) == [("audio", "https://e.com/b.mp3")]
+
+
+def test_longer_marker_wins_over_suffix():
+    markers = MediaMarkers([{"name": "hd", "marker": "[高清" + VIDEO[1:], "extension": ".mp4"}])
+    assert flatten(markers.tokenize(f"[高清{VIDEO[1:]}(https://e.com/hd.mp4)")) == [("hd", "https://e.com/hd.mp4")]
+
+
+def test_empty_marker_is_rejected():
+    with pytest.raises(ValueError):
+        MediaMarkers([{"name": "broken", "marker": ""}])
+
+
+def test_dify_reply_classification():
+    reply = DifyReply(f"图来了{IMAGE}(https://e.com/1.png)")
+    assert reply.has_media and not reply.is_emoji
+    assert reply.media_urls('image') == ["https://e.com/1.png"]
+    assert reply.media_urls('video') == []
+    assert not DifyReply("纯文本").has_media
+    assert DifyReply(" [害羞] ").is_emoji
+
+
+def test_incoming_message_classification():
+    incoming = IncomingMessage("[微笑]")
+    assert incoming.is_emoji and not incoming.is_refer
+    assert incoming.classify_query("[微笑]") is True
+    assert IncomingMessage("@AI小朋 [微笑]").classify_query(strip_mentions("@AI小朋 [微笑]")) is True
+    assert IncomingMessage("<msg><title>t</title><refermsg><content>c</content></refermsg></msg>").is_refer
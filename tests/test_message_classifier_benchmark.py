@@ -0,0 +1,90 @@
+"""
+消息分类基准测试(pytest-benchmark)
+对比一条触发消息在原流程中的逐处正则匹配(表情判断在回调、群消息处理、会话重置处各算一次,
+@提及清理、Dify回复的媒体/表情判断每次都临时编译查找正则)和预编译 + 只分类一次后的单条耗时
+
+阈值: 每个用例当前流程的单条耗时不超过MAX_US,且不比原流程慢
+运行: python -m pytest tests/test_message_classifier_benchmark.py
+"""
+
+import re
+import timeit
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from message_classifier import IncomingMessage, DifyReply, strip_mentions
+
+# 当前流程单条消息分类耗时上限(微秒),为慢速CI机器留出余量
+MAX_US = 50
+# 与原流程比较时允许的计时误差
+TOLERANCE = 1.1
+
+# 用例id使用ASCII,便于在pytest-benchmark的报告中阅读
+CASES = {
+    # @机器人 短问题 / 文本回复
+    "mention-short-text": ("@AI小朋 今天天气怎么样", "今天晴,气温20度左右。"),
+    # 表情触发 / 表情回复
+    "emoji-emoji": ("[微笑]", "[害羞]"),
+    # 长问题 / 图片回复
+    "long-question-images": ("@AI小朋 " + "帮我画一只猫," * 40,
+                             "好的\n![Generated Image](https://example.com/a.png)\n"
+                             "![Generated Image](https://example.com/b.png)"),
+    # @机器人 / 长文本回复
+    "mention-long-text": ("@AI小朋 讲个故事", "从前有座山,山里有座庙。" * 200),
+    # @机器人 表情 / 视频回复
+    "mention-emoji-video": ("@AI小朋 [微笑]", "[点击下载视频](https://example.com/a.mp4)"),
+}
+
+
+def old_pipeline(msg, dify_reply):
+    """
+    原流程中一条群消息(从回调到发送回复)做的分类工作
+    """
+    is_refer_message = '<title>' in msg and '<refermsg>' in msg and '<content>' in msg
+    is_simple_emoji = bool(re.match(r'^\[[一-龥]{2}\]$', msg.strip()))
+    query_text = re.sub(r'@[一-龥A-Za-z0-9_. ]+\s*', '', msg).strip() if not is_simple_emoji else msg
+    is_low_priority = bool(re.match(r'^\[[一-龥]{2}\]$', query_text.strip()))
+    is_input_emoji = bool(re.match(r'^\[[一-龥]{2}\]$', query_text.strip()))
+
+    has_generated_images = '![Generated Image]' in dify_reply
+    has_videos = '[点击下载视频]' in dify_reply
+    is_output_emoji = bool(re.match(r'^\[[一-龥]{2}\]$', dify_reply.strip()))
+    images = re.findall(r'!\[Generated Image\]\((https?://[^\)]+)\)', dify_reply)
+    videos = re.findall(r'\[点击下载视频\]\((https?://[^\)]+)\)', dify_reply)
+    return (is_refer_message, is_low_priority, is_input_emoji, has_generated_images or has_videos,
+            is_output_emoji, images, videos)
+
+
+def new_pipeline(msg, dify_reply):
+    """
+    当前流程: 预编译正则,回调中分类一次并随消息传递,回复只切分一次(发送时直接遍历分段)
+    """
+    incoming = IncomingMessage(msg)
+    query_text = strip_mentions(msg) if not incoming.is_emoji else msg
+    is_low_priority = incoming.classify_query(query_text)
+    return incoming, is_low_priority, DifyReply(dify_reply)
+
+
+def best_us(func, args, number=2000, repeat=5):
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=repeat)) / number * 1e6
+
+
+@pytest.mark.parametrize('case', CASES.values(), ids=list(CASES))
+def test_same_result_as_old_pipeline(case):
+    incoming, is_low_priority, reply = new_pipeline(*case)
+    assert (incoming.is_refer, is_low_priority, is_low_priority, reply.has_media, reply.is_emoji,
+            reply.media_urls('image'), reply.media_urls('video')) == old_pipeline(*case)
+
+
+@pytest.mark.parametrize('case', CASES.values(), ids=list(CASES))
+def test_classification_speed(benchmark, case):
+    benchmark.group = 'message-classifier'
+    benchmark(new_pipeline, *case)
+    assert benchmark.stats['min'] * 1e6 < MAX_US
+
+    # 原流程和当前流程交替取最优值比较,减少机器负载波动的影响
+    old_us = min(best_us(old_pipeline, case) for _ in range(2))
+    new_us = min(best_us(new_pipeline, case) for _ in range(2))
+    assert new_us <= old_us * TOLERANCE, f"当前流程 {new_us:.2f}us/msg 慢于原流程 {old_us:.2f}us/msg"
@@ -0,0 +1,102 @@
+import pytest
+
+from message_classifier import DifyReply
+from message_splitter import split_message, send_parts, summarize_lines, hard_split, byte_len
+
+
+def strip_marker(part):
+    return part.split('\n', 1)[1]
+
+
+def test_short_message_is_not_split():
+    assert split_message("你好\n世界", max_bytes=100) == ["你好\n世界"]
+
+
+@pytest.mark.parametrize('max_bytes', [64, 100, 257])
+def test_parts_fit_limit_and_keep_lines(max_bytes):
+    lines = [f"第{idx}行: " + "内容" * (idx % 5) for idx in range(40)]
+    text = "\n".join(lines)
+    parts = split_message(text, max_bytes=max_bytes)
+
+    assert len(parts) > 1
+    assert all(byte_len(part) <= max_bytes for part in parts)
+    assert [part.split('\n', 1)[0] for part in parts] == [f"({idx}/{len(parts)})" for idx in range(1, len(parts) + 1)]
+    # 在行边界切分: 去掉标记后按行拼接还原原文
+    assert "\n".join(strip_marker(part) for part in parts) == text
+
+
+def test_long_line_splits_at_sentence_boundary():
+    sentences = ["这是第一句话。", "这是第二句话!", "这是第三句话?", "最后一句没有标点"]
+    text = "".join(sentences[:3] * 4) + sentences[3]
+    parts = [strip_marker(part) for part in split_message(text, max_bytes=16 + byte_len(sentences[0]) * 2)]
+
+    assert len(parts) > 1
+    assert "".join(parts) == text
+    # 除最后一段外每段都以句末标点结尾
+    assert all(part[-1] in "。!?" for part in parts[:-1])
+
+
+def test_long_sentence_is_hard_split_without_breaking_characters():
+    text = "很长的句子" * 50
+    parts = split_message(text, max_bytes=40, with_markers=False)
+    assert all(byte_len(part) <= 40 for part in parts)
+    assert "".join(parts) == text
+    assert hard_split("a中b", 3) == ["a", "中", "b"]
+
+
+def test_blank_parts_are_dropped():
+    text = "第一段" * 10 + "\n\n\n\n" + "第二段" * 10
+    parts = split_message(text, max_bytes=60, with_markers=False)
+    assert all(part.strip() for part in parts)
+    assert all(not part.startswith('\n') and not part.endswith('\n') for part in parts)
+
+
+def test_send_parts_retries_only_failed_part():
+    attempts = []
+    failures = {"b": 1}
+
+    def send(part):
+        attempts.append(part)
+        if failures.get(part):
+            failures[part] -= 1
+            return False
+        return True
+
+    assert send_parts(["a", "b", "c"], send, interval=0, retries=1)
+    assert attempts == ["a", "b", "b", "c"]
+
+
+def test_send_parts_reports_failure_and_continues():
+    attempts = []
+    assert not send_parts(["a", "b", "c"], lambda part: attempts.append(part) or part != "b", interval=0, retries=2)
+    assert attempts == ["a", "b", "b", "b", "c"]
+
+
+def test_summarize_lines():
+    lines = [f"line {idx}" for idx in range(100)]
+    assert summarize_lines(lines[:60], head=30, tail=30) == lines[:60]
+
+    summary = summarize_lines(lines, head=3, tail=2)
+    assert summary == ["line 0", "line 1", "line 2", "... 省略 95 行 ...", "line 98", "line 99"]
+
+
+def test_media_segments_are_sent_in_order_with_long_text_split(bridge, monkeypatch):
+    sent = []
+    monkeypatch.setattr(bridge, 'MAX_MESSAGE_BYTES', 64)
+    monkeypatch.setattr(bridge, 'PART_INTERVAL', 0)
+    monkeypatch.setattr(bridge, 'send_weixin_reply', lambda target, text, msg_id, bot: sent.append(('reply', text)) or True)
+    monkeypatch.setattr(bridge, 'send_weixin_text', lambda target, text, bot: sent.append(('text', text)) or True)
+    monkeypatch.setattr(bridge, 'send_weixin_media',
+                        lambda target, marker, url, bot: sent.append((marker.name, url)) or True)
+
+    long_text = "\n".join(f"第{idx}段说明文字" for idx in range(10))
+    reply = DifyReply(f"{long_text}\n![Generated Image](https://e.com/a.png)\n结尾[点击下载视频](https://e.com/a.mp4)",
+                      bridge.media_markers)
+    assert bridge.send_reply_segments(reply, 'group@chatroom', 'wxid_bot', msg_id='msg-1')
+
+    # 超长文本第一段引用回复,其余分段为普通文本,然后按原文顺序发送图片、文本、视频
+    assert [kind for kind, _ in sent[:-3]] == ['reply'] + ['text'] * (len(sent) - 4)
+    assert sent[-3:] == [('image', 'https://e.com/a.png'), ('text', '结尾'), ('video', 'https://e.com/a.mp4')]
+    text_parts = [text for kind, text in sent[:-3]]
+    assert all(byte_len(text) <= 64 for text in text_parts)
+    assert "\n".join(strip_marker(text) for text in text_parts) == long_text
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from priority_scheduler import PriorityScheduler, DEFAULT_LANES
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(config):
+        scheduler = PriorityScheduler(config)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.shutdown(wait=False)
+
+
+def block_worker(scheduler, lane):
+    """
+    占住唯一的工作线程,让后续任务先全部进入队列
+    """
+    started = threading.Event()
+    release = threading.Event()
+    scheduler.submit(lane, lambda: (started.set(), release.wait(5)))
+    assert started.wait(5)
+    return release
+
+
+def run_in_order(scheduler, tasks):
+    """
+    tasks: [(通道名, 标签)],全部提交后再放行工作线程,返回执行顺序
+    """
+    order = []
+    release = block_worker(scheduler, tasks[0][0])
+    futures = [scheduler.submit(lane, order.append, label) for lane, label in tasks]
+    release.set()
+    for future in futures:
+        future.result(timeout=5)
+    return order
+
+
+def test_lane_weights(make_scheduler):
+    scheduler = make_scheduler({"workers": 1, "lanes": DEFAULT_LANES})
+    tasks = [(lane, lane) for lane in DEFAULT_LANES for _ in range(30)]
+    order = run_in_order(scheduler, tasks)
+
+    # 所有通道都有积压时,每一轮(权重之和)内各通道的执行次数等于权重
+    total_weight = sum(lane['weight'] for lane in DEFAULT_LANES.values())
+    assert Counter(order[:total_weight]) == {lane: config['weight'] for lane, config in DEFAULT_LANES.items()}
+    assert Counter(order[total_weight:total_weight * 2]) == Counter(order[:total_weight])
+
+
+def test_low_weight_lane_is_not_starved(make_scheduler):
+    lanes = {"private": {"weight": 10, "max_concurrency": 4, "max_queue": 1000},
+             "scheduled": {"weight": 1, "max_concurrency": 1, "max_queue": 1000}}
+    scheduler = make_scheduler({"workers": 1, "lanes": lanes})
+    tasks = [("private", f"p{i}") for i in range(200)] + [("scheduled", f"s{i}") for i in range(5)]
+    order = run_in_order(scheduler, tasks)
+
+    # 高优先级通道积压200个任务时,低优先级任务每11次调度至少执行一次
+    positions = [idx for idx, label in enumerate(order) if label.startswith('s')]
+    assert positions[0] < 11
+    assert all(later - earlier <= 11 for earlier, later in zip(positions, positions[1:]))
+    # 同一通道内先进先出
+    assert [label for label in order if label.startswith('s')] == [f"s{i}" for i in range(5)]
+
+
+def test_lane_concurrency_limit(make_scheduler):
+    lanes = {"mention": {"weight": 1, "max_concurrency": 4, "max_queue": 100},
+             "keyword": {"weight": 1, "max_concurrency": 1, "max_queue": 100}}
+    scheduler = make_scheduler({"workers": 4, "lanes": lanes})
+    lock = threading.Lock()
+    active = Counter()
+    peak = Counter()
+
+    def task(lane):
+        with lock:
+            active[lane] += 1
+            peak[lane] = max(peak[lane], active[lane])
+        time.sleep(0.02)
+        with lock:
+            active[lane] -= 1
+
+    futures = [scheduler.submit(lane, task, lane) for _ in range(6) for lane in lanes]
+    for future in futures:
+        future.result(timeout=5)
+    assert peak['keyword'] == 1
+    assert peak['mention'] > 1
+
+
+def test_full_queue_and_unknown_lane_are_rejected(make_scheduler):
+    scheduler = make_scheduler({"workers": 1, "lanes": {"keyword": {"max_queue": 2}}})
+    release = block_worker(scheduler, "keyword")
+    assert scheduler.submit("keyword", time.sleep, 0) is not None
+    assert scheduler.submit("keyword", time.sleep, 0) is not None
+    assert scheduler.submit("keyword", time.sleep, 0) is None
+    assert scheduler.submit("missing", time.sleep, 0) is None
+    release.set()
+    assert scheduler.stats()['lanes']['keyword']['rejected'] == 1
+
+
+def test_drain_waits_for_queued_tasks(make_scheduler):
+    scheduler = make_scheduler({"workers": 2})
+    done = []
+    for idx in range(10):
+        scheduler.submit("mention", lambda idx=idx: (time.sleep(0.01), done.append(idx)))
+    assert scheduler.drain(timeout=5) == ([], [])
+    assert sorted(done) == list(range(10))
+    # 排空后不再接收新任务
+    assert scheduler.submit("mention", done.append, 99) is None
+    assert scheduler.stats()['lanes']['mention']['rejected'] == 1
+
+
+def test_drain_timeout_returns_leftovers(make_scheduler):
+    scheduler = make_scheduler({"workers": 1})
+    release = block_worker(scheduler, "scheduled")
+    queued = [scheduler.submit("private", time.sleep, 0) for _ in range(3)]
+
+    leftover_queued, leftover_running = scheduler.drain(timeout=0.05)
+    assert [(lane, args) for lane, _, args, _ in leftover_queued] == [("private", (0,))] * 3
+    assert [lane for lane, *_ in leftover_running] == ["scheduled"]
+    # 未执行的任务被取消,不会在放行后再执行
+    assert all(future.cancelled() for future in queued)
+
+    release.set()
+    scheduler.shutdown(wait=True)
+    assert scheduler.stats()['lanes']['private']['completed'] == 0
@@ -0,0 +1,76 @@
+import sys
+import threading
+import time
+
+import pytest
+
+import profiler
+from profiler import ProfilerBusy, SamplingProfiler, check_token
+
+
+def test_check_token_accepts_only_matching_token():
+    assert check_token('admin-token', 'admin-token')
+    assert not check_token('admin-token', 'admin-tokeN')
+    assert not check_token('admin-token', 'admin')
+    assert not check_token('admin-token', '')
+    assert not check_token('admin-token', None)
+
+
+def test_check_token_rejects_everything_when_unconfigured():
+    assert not check_token('', '')
+    assert not check_token(None, 'anything')
+    assert not check_token('', 'admin-token')
+
+
+def test_check_token_handles_non_ascii():
+    assert not check_token('admin-token', '管理令牌')
+    assert check_token('管理令牌', '管理令牌')
+
+
+def test_profile_endpoint_rejects_bad_tokens(client):
+    assert client.post('/debug/profile?duration=0.1').status_code == 403
+    assert client.post('/debug/profile?duration=0.1', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert client.post('/debug/profile?duration=0.1&token=管理令牌').status_code == 403
+
+
+def test_profile_samples_other_threads():
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            time.sleep(0.001)
+
+    worker = threading.Thread(target=busy_worker, name='busy-worker')
+    worker.start()
+    try:
+        result = SamplingProfiler({"sample_interval": 0.005}).profile(0.1)
+    finally:
+        stop.set()
+        worker.join()
+    assert result['samples'] > 0
+    assert 'busy-worker' in result['threads']
+    assert any(line.startswith('busy-worker;') and 'busy_worker' in line for line in result['collapsed'].splitlines())
+
+
+def test_only_one_session_at_a_time():
+    sampler = SamplingProfiler()
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: (started.set(), sampler.profile(0.3)))
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(ProfilerBusy):
+            sampler.profile(0.1)
+    finally:
+        thread.join()
+
+
+def test_frame_stack_is_outermost_first():
+    def inner():
+        return profiler.frame_stack(sys._getframe(), 64)
+
+    stack = inner()
+    assert stack[-1].startswith('inner (')
+    assert stack[-2].startswith('test_frame_stack_is_outermost_first (')
+    assert len(profiler.frame_stack(sys._getframe(), 2)) == 2
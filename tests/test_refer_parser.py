@@ -0,0 +1,101 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+from refer_parser import extract_refer_fields, combine_refer_fields
+
+
+def legacy_extract(msg):
+    """
+    原实现: ElementTree整树解析后查找第一个title和refermsg/content
+    """
+    try:
+        root = ET.fromstring(msg)
+    except Exception:
+        return None
+    title_elem = root.find('.//title')
+    refer_content_elem = root.find('.//refermsg/content')
+    return (title_elem.text if title_elem is not None and title_elem.text else "",
+            refer_content_elem.text if refer_content_elem is not None and refer_content_elem.text else "")
+
+
+def make_refer_xml(filler_size=0):
+    filler = "".join(f"<item><key>k{i}</key><value>{'v' * 40}</value></item>" for i in range(filler_size))
+    return (
+        '<?xml version="1.0"?>\n<msg><appmsg appid="" sdkver="0">'
+        '<title>@AI小朋 这篇文章讲了什么?</title><des></des><type>57</type>'
+        '<refermsg><type>49</type><svrid>123456789</svrid><fromusr>48683142917@chatroom</fromusr>'
+        '<displayname>张三</displayname>'
+        '<content>&lt;msg&gt;&lt;appmsg&gt;&lt;title&gt;一篇公众号文章&lt;/title&gt;&lt;/appmsg&gt;&lt;/msg&gt;</content>'
+        '</refermsg>'
+        f'<extinfo>{filler}</extinfo>'
+        '</appmsg><fromusername>wxid_member0001</fromusername></msg>'
+    )
+
+
+WELL_FORMED = {
+    "refer": make_refer_xml(),
+    "refer-long-appmsg": make_refer_xml(200),
+    "content-before-title": '<msg><refermsg><content>引用</content></refermsg><title>问题</title></msg>',
+    "title-only": '<msg><appmsg><title>只有标题</title></appmsg></msg>',
+    "empty-fields": '<msg><title></title><refermsg><content/></refermsg></msg>',
+    "no-fields": '<msg><appmsg><des>x</des></appmsg></msg>',
+    "root-title": '<title>根节点</title>',
+    "root-refermsg": '<refermsg><content>根节点下的content</content><title>t</title></refermsg>',
+    "text-before-child": '<msg><title>前<b>子元素</b>后</title><refermsg><content>c</content></refermsg></msg>',
+    "comment-cdata-entity": '<msg><title>a<!--注释-->b<![CDATA[<z>]]>&amp;</title>'
+                            '<refermsg><content>&#20320;&#22909;</content></refermsg></msg>',
+    "internal-entity": '<!DOCTYPE msg [<!ENTITY e "实体">]><msg><title>&e;</title></msg>',
+    "default-namespace": '<msg xmlns="urn:x"><title>ns</title><refermsg><content>c</content></refermsg></msg>',
+    "prefixed-namespace": '<msg><x:title xmlns:x="urn:x">p</x:title><title>q</title></msg>',
+    "bom": '﻿<msg><title>bom</title></msg>',
+    "leading-whitespace": '\n  <msg><title>t</title></msg>',
+}
+
+NESTED = {
+    "nested-refermsg": '<msg><refermsg><refermsg><content>内层</content></refermsg>'
+                       '<content>外层</content></refermsg><title>t</title></msg>',
+    "content-with-child-title": '<msg><refermsg><content>a<title>内层标题</title>b</content></refermsg></msg>',
+    "title-with-child-refermsg": '<msg><title>外<refermsg><content>内层引用</content></refermsg></title></msg>',
+    "second-title-ignored": '<msg><a><title>第一个</title></a><title>第二个</title>'
+                            '<refermsg><content>c</content></refermsg></msg>',
+    "content-outside-refermsg": '<msg><content>不是引用</content><refermsg><x><content>孙节点</content></x>'
+                                '</refermsg><title>t</title></msg>',
+}
+
+MALFORMED = {
+    "plain-text": "@AI小朋 今天天气怎么样?",
+    "lt-text": "<3 谢谢你 @AI小朋",
+    "empty": "",
+    "trailing-text": make_refer_xml() + "多余内容",
+    "second-root": make_refer_xml() + "<msg/>",
+    "unclosed-after-fields": '<msg><title>t</title><refermsg><content>c</content></refermsg><bad></msg>',
+    "undefined-entity": '<msg><title>&undefined;</title></msg>',
+    "undeclared-prefix": '<msg><x:title>t</x:title></msg>',
+    "lone-surrogate": '<msg><title>t\ud800</title></msg>',
+}
+
+
+@pytest.mark.parametrize('msg', [*WELL_FORMED.values(), *NESTED.values(), *MALFORMED.values()],
+                         ids=[*WELL_FORMED, *NESTED, *MALFORMED])
+def test_same_fields_as_element_tree(msg):
+    assert extract_refer_fields(msg) == legacy_extract(msg)
+
+
+@pytest.mark.parametrize('msg', MALFORMED.values(), ids=list(MALFORMED))
+def test_malformed_is_not_refer(msg):
+    assert extract_refer_fields(msg) is None
+
+
+@pytest.mark.parametrize('msg', [make_refer_xml(), *NESTED.values()], ids=['refer', *NESTED])
+def test_truncated_same_as_element_tree(msg):
+    # 在每个位置截断: 字段已经读完但文档不完整时,也要和整树解析一样判为非XML
+    for end in range(len(msg)):
+        assert extract_refer_fields(msg[:end]) == legacy_extract(msg[:end]), msg[:end]
+
+
+def test_combine_fields():
+    assert combine_refer_fields("问题", "引用") == "引用\n问题"
+    assert combine_refer_fields("", "引用") == "引用"
+    assert combine_refer_fields("问题", "") == "问题"
+    assert combine_refer_fields("", "") is None
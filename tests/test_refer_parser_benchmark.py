@@ -0,0 +1,106 @@
+"""
+引用消息解析基准测试(pytest-benchmark)
+对比原parse_refer_message(ElementTree整树解析 + ParseError分支)与流式提取器
+
+阈值: 普通文本的单次耗时不超过PLAIN_MAX_US,各用例相对原实现的加速比不低于MIN_SPEEDUP
+运行: python -m pytest tests/test_refer_parser_benchmark.py
+"""
+
+import timeit
+import xml.etree.ElementTree as ET
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from refer_parser import extract_refer_fields, combine_refer_fields
+
+# 普通文本(绝大多数消息)单次耗时上限(微秒),为慢速CI机器留出余量
+PLAIN_MAX_US = 5
+# 各用例相对原实现的最低加速比
+# 小引用消息每个元素都要回调Python(含属性字典),与C实现的整树解析基本持平,只要求不明显变慢
+MIN_SPEEDUP = {
+    "plain-text": 5,
+    "lt-text": 1,
+    "small-refer": 0.8,
+    "large-refer": 2,
+}
+
+
+def legacy_parse_refer_message(msg):
+    """
+    原实现(去掉日志)
+    """
+    try:
+        root = ET.fromstring(msg)
+        title_elem = root.find('.//title')
+        title_text = title_elem.text if title_elem is not None and title_elem.text else ""
+        refer_content_elem = root.find('.//refermsg/content')
+        refer_content = refer_content_elem.text if refer_content_elem is not None and refer_content_elem.text else ""
+        if not title_text and not refer_content:
+            return None
+        if refer_content and title_text:
+            return f"{refer_content}\n{title_text}"
+        elif refer_content:
+            return refer_content
+        else:
+            return title_text
+    except ET.ParseError:
+        return None
+    except Exception:
+        return None
+
+
+def new_parse_refer_message(msg):
+    fields = extract_refer_fields(msg)
+    if fields is None:
+        return None
+    return combine_refer_fields(*fields)
+
+
+def make_refer_xml(filler_size):
+    filler = "".join(f"<item><key>k{i}</key><value>{'v' * 40}</value></item>" for i in range(filler_size))
+    return (
+        '<?xml version="1.0"?>\n<msg><appmsg appid="" sdkver="0">'
+        '<title>@AI小朋 这篇文章讲了什么?</title><des></des><type>57</type>'
+        '<refermsg><type>49</type><svrid>123456789</svrid><fromusr>48683142917@chatroom</fromusr>'
+        '<displayname>张三</displayname>'
+        '<content>&lt;msg&gt;&lt;appmsg&gt;&lt;title&gt;一篇很长的公众号文章&lt;/title&gt;&lt;/appmsg&gt;&lt;/msg&gt;</content>'
+        '</refermsg>'
+        f'<extinfo>{filler}</extinfo>'
+        '</appmsg><fromusername>wxid_member0001</fromusername></msg>'
+    )
+
+
+# 用例id使用ASCII,便于在pytest-benchmark的报告中阅读
+PLAIN_TEXT = "@AI小朋 今天天气怎么样?"
+CASES = {
+    "plain-text": PLAIN_TEXT,
+    "lt-text": "<3 谢谢你 @AI小朋",
+    "small-refer": make_refer_xml(0),
+    "large-refer": make_refer_xml(500),
+}
+
+
+def best_us(func, msg, repeat=5):
+    number = 100 if len(msg) > 10000 else 2000
+    return min(timeit.repeat(lambda: func(msg), number=number, repeat=repeat)) / number * 1e6
+
+
+@pytest.mark.parametrize('msg', CASES.values(), ids=list(CASES))
+def test_same_result_as_legacy(msg):
+    assert new_parse_refer_message(msg) == legacy_parse_refer_message(msg)
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_refer_parser_speed(benchmark, case):
+    msg = CASES[case]
+    benchmark.group = 'refer-parser'
+    benchmark(new_parse_refer_message, msg)
+    if msg is PLAIN_TEXT:
+        assert benchmark.stats['min'] * 1e6 < PLAIN_MAX_US
+
+    # 原实现和流式提取器交替取最优值比较,减少机器负载波动的影响
+    legacy_us = min(best_us(legacy_parse_refer_message, msg) for _ in range(2))
+    new_us = min(best_us(new_parse_refer_message, msg) for _ in range(2))
+    assert legacy_us / new_us >= MIN_SPEEDUP[case], f"流式提取器 {new_us:.2f}us/call, 原实现 {legacy_us:.2f}us/call"
@@ -0,0 +1,111 @@
+import json
+import threading
+
+import pytest
+
+
+def start_bridge(restart_bridge, snapshot, **state):
+    return restart_bridge(state={"memory_snapshot": str(snapshot), **state}, shutdown={"drain_timeout": 0.2},
+                          scheduler={"workers": 2})
+
+
+def sigterm(app, monkeypatch):
+    """
+    模拟收到SIGTERM: handle_sigterm在后台线程中排空,完成后中断主线程(这里只记录)
+    """
+    interrupted = threading.Event()
+    monkeypatch.setattr(app._thread, 'interrupt_main', interrupted.set)
+    app.handle_sigterm(None)
+    assert interrupted.wait(5)
+
+
+def test_queued_and_running_messages_survive_sigterm(restart_bridge, tmp_path, monkeypatch):
+    snapshot = tmp_path / 'snapshot.json'
+    app = start_bridge(restart_bridge, snapshot)
+    release = threading.Event()
+    started = threading.Semaphore(0)
+
+    def blocked_handler(query_text, direct_reply, target_wxid, msg_id, bot_wxid, reset_conversation=None):
+        started.release()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(app, 'handle_incoming_message', blocked_handler)
+    bot = app.bots.default
+    for idx in range(4):
+        assert bot.scheduler.submit('private', app.handle_admitted_message, f'q{idx}', f'wxid_u{idx}', f'm{idx}',
+                                    'wxid_bot') is not None
+    # 两个工作线程各卡在一条消息上,另外两条在排队
+    assert started.acquire(timeout=5) and started.acquire(timeout=5)
+    try:
+        sigterm(app, monkeypatch)
+        assert app.draining.is_set()
+        assert bot.scheduler.submit('private', app.handle_admitted_message, 'late', 'wxid_late', 'm-late',
+                                    'wxid_bot') is None
+    finally:
+        release.set()
+
+    saved = json.loads(snapshot.read_text(encoding='utf-8'))
+    payloads = sorted((payload for _, _, payload in saved['outbox']), key=lambda payload: payload['msg_id'])
+    assert [(payload['query'], payload['target_wxid'], payload['msg_id'], payload['lane'], payload['bot_wxid'])
+            for payload in payloads] == [(f'q{idx}', f'wxid_u{idx}', f'm{idx}', 'private', 'wxid_bot')
+                                         for idx in range(4)]
+
+    # 下次启动时恢复发件箱并由主节点重新提交
+    restarted = start_bridge(restart_bridge, snapshot)
+    assert not snapshot.exists()
+    assert restarted.state.outbox_size() == 4
+    handled = []
+    done = threading.Semaphore(0)
+
+    def recording_handler(query_text, direct_reply, target_wxid, msg_id, bot_wxid, reset_conversation=None):
+        handled.append((query_text, target_wxid, msg_id, bot_wxid))
+        done.release()
+        return True
+
+    monkeypatch.setattr(restarted, 'handle_incoming_message', recording_handler)
+    try:
+        restarted.replay_outbox()
+        for _ in range(4):
+            assert done.acquire(timeout=5)
+        assert sorted(handled) == [(f'q{idx}', f'wxid_u{idx}', f'm{idx}', 'wxid_bot') for idx in range(4)]
+        assert restarted.state.outbox_size() == 0
+    finally:
+        restarted.drain(None)
+
+
+def test_reply_being_sent_is_not_asked_again(restart_bridge, tmp_path, monkeypatch):
+    snapshot = tmp_path / 'snapshot.json'
+    app = start_bridge(restart_bridge, snapshot)
+    release = threading.Event()
+    sending = threading.Event()
+
+    def blocked_send(dify_reply, target_wxid, msg_id, bot_wxid):
+        sending.set()
+        release.wait(5)
+        return True
+
+    monkeypatch.setattr(app, 'send_to_dify', lambda *args, **kwargs: 'answer')
+    monkeypatch.setattr(app, 'send_dify_reply', blocked_send)
+    bot = app.bots.default
+    bot.scheduler.submit('private', app.handle_admitted_message, 'question', 'wxid_u1', 'm1', 'wxid_bot')
+    assert sending.wait(5)
+    try:
+        sigterm(app, monkeypatch)
+    finally:
+        release.set()
+
+    # 正在发送的消息只保留回复记录(补发回复),不再重新提问
+    saved = json.loads(snapshot.read_text(encoding='utf-8'))
+    assert [payload for _, _, payload in saved['outbox']] == [
+        {"bot_wxid": "wxid_bot", "target_wxid": "wxid_u1", "msg_id": "m1", "reply": "answer"}]
+
+    # 发送途中留下的回复记录按创建时间判断是否过期(其他节点可能仍在发送),这里不等待
+    restarted = start_bridge(restart_bridge, snapshot, outbox_replay_after=0)
+    replayed = []
+    monkeypatch.setattr(restarted, 'send_dify_reply', lambda *args: replayed.append(args) or True)
+    try:
+        restarted.replay_outbox()
+        assert replayed == [('answer', 'wxid_u1', 'm1', 'wxid_bot')]
+    finally:
+        restarted.drain(None)
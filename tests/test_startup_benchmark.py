@@ -0,0 +1,16 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('requests')
+
+BENCH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                     'benchmarks', 'bench_startup.py')
+
+
+def test_warm_pool_saves_connection_setup():
+    # 预热后的首个请求不比新建连接快时,基准脚本以非0退出
+    result = subprocess.run([sys.executable, BENCH, '--rounds', '2'], capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stdout + result.stderr[-2000:]
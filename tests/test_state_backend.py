@@ -0,0 +1,298 @@
+import threading
+import time
+import timeit
+
+import pytest
+
+import state_backend
+from state_backend import (ConversationMap, LeaderElector, LEASE_SCRIPT, MemoryStateBackend, RedisStateBackend,
+                           RELEASE_SCRIPT, SQLiteStateBackend)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class FakeRedis:
+    """
+    本地redis替身: 实现RedisStateBackend用到的命令,过期时间使用FakeClock
+    eval只支持LEASE_SCRIPT和RELEASE_SCRIPT,按脚本语义执行
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.strings = {}   # key -> (value, 过期时间或None)
+        self.hashes = {}
+
+    def _get(self, key):
+        entry = self.strings.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= self.clock.time():
+            del self.strings[key]
+            return None
+        return entry[0] if entry else None
+
+    def get(self, key):
+        with self.lock:
+            return self._get(key)
+
+    def set(self, key, value, nx=False, ex=None, px=None):
+        with self.lock:
+            if nx and self._get(key) is not None:
+                return None
+            ttl = ex if ex is not None else (px / 1000 if px is not None else None)
+            self.strings[key] = (str(value), None if ttl is None else self.clock.time() + ttl)
+            return True
+
+    def hget(self, name, key):
+        with self.lock:
+            return self.hashes.get(name, {}).get(key)
+
+    def hset(self, name, key, value):
+        with self.lock:
+            created = key not in self.hashes.setdefault(name, {})
+            self.hashes[name][key] = str(value)
+            return int(created)
+
+    def hdel(self, name, key):
+        with self.lock:
+            return int(self.hashes.get(name, {}).pop(key, None) is not None)
+
+    def hlen(self, name):
+        with self.lock:
+            return len(self.hashes.get(name, {}))
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes.get(name, {}))
+
+    def eval(self, script, numkeys, *args):
+        key, owner = args[0], args[1]
+        with self.lock:
+            current = self._get(key)
+            if script == LEASE_SCRIPT:
+                if current is None or current == owner:
+                    self.strings[key] = (owner, self.clock.time() + int(args[2]) / 1000)
+                    return 1
+                return 0
+            if script == RELEASE_SCRIPT:
+                if current == owner:
+                    del self.strings[key]
+                    return 1
+                return 0
+        raise NotImplementedError(script)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(state_backend, 'time', clock)
+    return clock
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def make_backend(request, clock, tmp_path):
+    """
+    返回一个工厂,每次调用创建一个新的后端实例;sqlite和redis的实例共享同一份存储(模拟多个节点)
+    """
+    backends = []
+    client = FakeRedis(clock)
+    memory = MemoryStateBackend()
+
+    def make():
+        if request.param == 'memory':
+            backend = memory
+        elif request.param == 'sqlite':
+            backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+        else:
+            backend = RedisStateBackend(key_prefix='test:', client=client)
+        backends.append(backend)
+        return backend
+
+    yield make
+    for backend in backends:
+        backend.close()
+
+
+def test_lease_acquire_and_renew(make_backend, clock):
+    backend = make_backend()
+    assert backend.acquire_lease('scheduler', 'node-a', 30)
+    clock.advance(20)
+    assert backend.acquire_lease('scheduler', 'node-a', 30)
+    # 续约后从续约时刻重新计算过期时间
+    clock.advance(20)
+    assert not make_backend().acquire_lease('scheduler', 'node-b', 30)
+
+
+def test_lease_held_by_other_node_until_expiry(make_backend, clock):
+    node_a, node_b = make_backend(), make_backend()
+    assert node_a.acquire_lease('scheduler', 'node-a', 30)
+    assert not node_b.acquire_lease('scheduler', 'node-b', 30)
+
+    clock.advance(31)
+    assert node_b.acquire_lease('scheduler', 'node-b', 30)
+    assert not node_a.acquire_lease('scheduler', 'node-a', 30)
+
+
+def test_lease_release_allows_takeover(make_backend):
+    node_a, node_b = make_backend(), make_backend()
+    assert node_a.acquire_lease('scheduler', 'node-a', 30)
+    node_b.release_lease('scheduler', 'node-b')
+    assert not node_b.acquire_lease('scheduler', 'node-b', 30)
+
+    node_a.release_lease('scheduler', 'node-a')
+    assert node_b.acquire_lease('scheduler', 'node-b', 30)
+
+
+def test_leases_are_independent_by_name(make_backend):
+    backend = make_backend()
+    assert backend.acquire_lease('scheduler', 'node-a', 30)
+    assert backend.acquire_lease('other', 'node-b', 30)
+
+
+def test_conversation_ids_persist_across_instances(make_backend):
+    conversations = ConversationMap(make_backend(), 'wxid_bot')
+    conversations['wxid_user'] = 'conv-1'
+    ConversationMap(make_backend(), 'wxid_other')['wxid_user'] = 'conv-2'
+
+    restored = ConversationMap(make_backend(), 'wxid_bot')
+    assert restored['wxid_user'] == 'conv-1'
+    assert 'wxid_user' in restored
+    assert len(restored) == 1
+    assert restored.get('wxid_missing', '') == ''
+
+    del restored['wxid_user']
+    assert conversations.get('wxid_user') is None
+    with pytest.raises(KeyError):
+        conversations['wxid_user']
+
+
+def test_mark_seen_expires(make_backend, clock):
+    backend = make_backend()
+    assert backend.mark_seen('bot:msg-1', 600)
+    assert not make_backend().mark_seen('bot:msg-1', 600)
+    clock.advance(601)
+    assert backend.mark_seen('bot:msg-1', 600)
+
+
+def test_memory_mark_seen_evicts_expired_incrementally(clock):
+    backend = MemoryStateBackend()
+    for idx in range(100):
+        assert backend.mark_seen(f'bot:msg-{idx}', 600 if idx % 2 else 60)
+    assert not backend.mark_seen('bot:msg-0', 60)
+
+    # 短TTL的记录先过期,下次写入时清理,长TTL的仍然保留
+    clock.advance(61)
+    assert backend.mark_seen('bot:new', 60)
+    assert len(backend._seen) == len(backend._seen_expiry) == 51
+    assert backend.mark_seen('bot:msg-0', 60)
+    assert not backend.mark_seen('bot:msg-1', 600)
+
+    clock.advance(600)
+    assert backend.mark_seen('bot:last', 60)
+    assert list(backend._seen) == ['bot:last']
+
+
+def test_memory_mark_seen_cost_does_not_grow_with_live_keys(clock):
+    """
+    原实现在超过10000条未过期记录后每次写入都重建整个表;现在每次只处理堆顶
+    """
+    backend = MemoryStateBackend()
+    for idx in range(50000):
+        backend.mark_seen(f'bot:warm-{idx}', 600)
+    counter = iter(range(10 ** 9))
+    best_us = min(timeit.repeat(lambda: backend.mark_seen(f'bot:msg-{next(counter)}', 600),
+                                number=1000, repeat=5)) / 1000 * 1e6
+    assert best_us < 50, f"mark_seen took {best_us:.1f}us with 50000 live keys"
+
+
+def test_outbox_claims_stale_entries_once(make_backend, clock):
+    node_a, node_b = make_backend(), make_backend()
+    node_a.outbox_add({"type": "reply", "n": 1})
+    done = node_a.outbox_add({"type": "reply", "n": 2})
+    node_a.outbox_remove(done)
+    node_a.outbox_add({"type": "reply", "n": 3}, created=0)
+
+    # created=0的记录立即可以补发,其余要等到超过older_than
+    assert node_b.outbox_claim_stale(300) == [{"type": "reply", "n": 3}]
+    clock.advance(301)
+    assert node_b.outbox_claim_stale(300) == [{"type": "reply", "n": 1}]
+    assert node_a.outbox_claim_stale(300) == []
+    assert node_a.outbox_size() == 0
+
+
+def test_sqlite_conversations_survive_reopen(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteStateBackend(path)
+    backend.set_conversation('wxid_bot', 'wxid_user', 'conv-1')
+    backend.close()
+
+    backend = SQLiteStateBackend(path)
+    assert backend.get_conversation('wxid_bot', 'wxid_user') == 'conv-1'
+    backend.close()
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return predicate()
+
+
+def test_leader_election_failover(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / 'state.db'))
+    ticks = {'node-a': 0, 'node-b': 0}
+
+    def on_tick(node_id):
+        def tick():
+            ticks[node_id] += 1
+        return tick
+
+    node_a = LeaderElector(backend, 'scheduler', 'node-a', ttl=3, on_tick=on_tick('node-a'))
+    node_b = LeaderElector(backend, 'scheduler', 'node-b', ttl=3, on_tick=on_tick('node-b'))
+    node_a.start()
+    assert wait_until(lambda: node_a.is_leader)
+    node_b.start()
+    try:
+        time.sleep(0.2)
+        assert not node_b.is_leader
+        assert ticks['node-b'] == 0
+
+        # 主节点退出时释放租约,另一个节点在下一次续约时接管
+        node_a.stop()
+        assert not node_a.is_leader
+        assert wait_until(lambda: node_b.is_leader)
+        assert wait_until(lambda: ticks['node-b'] > 0)
+    finally:
+        node_a.stop()
+        node_b.stop()
+        backend.close()
+
+
+def test_leader_steps_down_when_store_fails():
+    class FlakyBackend(MemoryStateBackend):
+        fail = False
+
+        def acquire_lease(self, name, owner, ttl):
+            if self.fail:
+                raise ConnectionError("store unavailable")
+            return super().acquire_lease(name, owner, ttl)
+
+    backend = FlakyBackend()
+    elector = LeaderElector(backend, 'scheduler', 'node-a', ttl=3)
+    elector.start()
+    try:
+        assert wait_until(lambda: elector.is_leader)
+        backend.fail = True
+        assert wait_until(lambda: not elector.is_leader, timeout=3)
+    finally:
+        elector.stop()
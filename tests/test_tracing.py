@@ -0,0 +1,76 @@
+import json
+
+import tracing
+from tracing import Trace, TraceStore
+
+
+def finished_trace(msg_id, wxid='group1', duration=1.0):
+    trace = Trace(msg_id, wxid)
+    trace.finish('sent')
+    trace.end = trace.start + duration
+    return trace
+
+
+def test_ring_buffer_keeps_capacity_and_order():
+    store = TraceStore({"buffer_size": 5})
+    for idx in range(12):
+        store.add(finished_trace(idx))
+    # 只保留最近的5条,按加入顺序
+    assert [trace.msg_id for trace in store._traces] == [7, 8, 9, 10, 11]
+    assert store.query()['total'] == 5
+
+
+def test_query_slowest_and_group_summary():
+    store = TraceStore({"buffer_size": 100})
+    for idx in range(10):
+        store.add(finished_trace(idx, 'group1' if idx % 2 else 'group2', duration=idx / 10))
+    result = store.query(slowest=3)
+    assert [entry['msg_id'] for entry in result['slowest']] == [9, 8, 7]
+    assert result['by_group']['group1']['count'] == 5
+    assert result['by_group']['group1']['max_ms'] == 900.0
+    filtered = store.query(slowest=10, group='group2')
+    assert filtered['total'] == 5
+    assert {entry['wxid'] for entry in filtered['slowest']} == {'group2'}
+
+
+def test_disabled_store_creates_no_trace():
+    store = TraceStore({"enabled": False})
+    assert store.start_trace('m1', 'group1') is None
+    store.add(None)
+    assert store.query()['total'] == 0
+
+
+def test_spans_nest_and_sum_by_stage():
+    trace = Trace('m1', 'group1')
+    with tracing.activate(trace):
+        with tracing.span('dify'):
+            with tracing.span('media'):
+                pass
+            with tracing.span('media'):
+                pass
+        tracing.set_outcome('sent')
+        tracing.set_outcome('failed')
+    assert tracing.current_trace() is None
+    assert trace.outcome == 'sent'
+    spans = {recorded.name: recorded for recorded in trace.spans}
+    assert spans['media'].parent_id == spans['dify'].span_id
+    assert set(trace.stage_durations()) == {'dify', 'media'}
+
+
+def test_span_without_trace_is_noop():
+    with tracing.span('dify') as current:
+        assert current is None
+
+
+def test_export_writes_otel_spans(tmp_path):
+    export_path = tmp_path / 'traces.jsonl'
+    store = TraceStore({"export_path": str(export_path)})
+    trace = Trace('m1', 'group1')
+    with trace.span('reply'):
+        pass
+    trace.finish('sent')
+    store.add(trace)
+    spans = [json.loads(line) for line in export_path.read_text(encoding='utf-8').splitlines()]
+    assert [span['name'] for span in spans] == ['wechat.message', 'reply']
+    assert spans[1]['parentSpanId'] == spans[0]['spanId']
+    assert {span['traceId'] for span in spans} == {trace.trace_id}
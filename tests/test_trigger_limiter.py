@@ -0,0 +1,124 @@
+import pytest
+
+import trigger_limiter
+from trigger_limiter import TriggerLimiter, BucketTable, ALLOW, COOLDOWN_REPLY, DROP
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(trigger_limiter, 'time', clock)
+    return clock
+
+
+def make_limiter(**overrides):
+    return TriggerLimiter({"user_per_minute": 6, "user_burst": 3, "group_per_minute": 600, "group_burst": 100,
+                           "action": "drop", **overrides})
+
+
+def test_burst_then_limited(clock):
+    limiter = make_limiter()
+    assert [limiter.check('g1', 'u1') for _ in range(4)] == [ALLOW, ALLOW, ALLOW, DROP]
+
+
+def test_refill(clock):
+    limiter = make_limiter()
+    for _ in range(3):
+        limiter.check('g1', 'u1')
+    # 每分钟6次,即每10秒恢复一个令牌
+    clock.advance(9.9)
+    assert limiter.check('g1', 'u1') == DROP
+    clock.advance(0.1)
+    assert limiter.check('g1', 'u1') == ALLOW
+    assert limiter.check('g1', 'u1') == DROP
+    # 恢复的令牌不超过突发上限
+    clock.advance(3600)
+    assert [limiter.check('g1', 'u1') for _ in range(4)] == [ALLOW, ALLOW, ALLOW, DROP]
+
+
+def test_per_user_isolation(clock):
+    limiter = make_limiter()
+    assert [limiter.check('g1', 'u1') for _ in range(4)] == [ALLOW, ALLOW, ALLOW, DROP]
+    # 同一群的其他成员、其他群的同一成员不受影响
+    assert limiter.check('g1', 'u2') == ALLOW
+    assert limiter.check('g2', 'u1') == ALLOW
+
+
+def test_group_limit_applies_across_users(clock):
+    limiter = make_limiter(group_burst=4)
+    results = [limiter.check('g1', f'u{idx}') for idx in range(6)]
+    assert results == [ALLOW] * 4 + [DROP] * 2
+    assert limiter.check('g2', 'u0') == ALLOW
+
+
+def test_rejected_request_does_not_consume_other_level(clock):
+    limiter = make_limiter(group_burst=4)
+    for _ in range(3):
+        limiter.check('g1', 'u1')
+    # u1超限的请求不消耗群额度
+    assert [limiter.check('g1', 'u1') for _ in range(5)] == [DROP] * 5
+    assert limiter.check('g1', 'u2') == ALLOW
+    assert limiter.check('g1', 'u3') == DROP
+
+
+def test_cooldown_reply_once_per_cooldown(clock):
+    limiter = make_limiter(action="reply")
+    for _ in range(3):
+        limiter.check('g1', 'u1')
+    assert limiter.check('g1', 'u1') == COOLDOWN_REPLY
+    assert limiter.check('g1', 'u1') == DROP
+    clock.advance(10)
+    assert limiter.check('g1', 'u1') == ALLOW
+    assert limiter.check('g1', 'u1') == COOLDOWN_REPLY
+
+
+def test_group_overrides_and_disabled(clock):
+    limiter = make_limiter()
+    overrides = {"user_burst": 1, "cooldown_reply": "慢点"}
+    assert [limiter.check('vip', 'u1', overrides) for _ in range(2)] == [ALLOW, DROP]
+    assert limiter.cooldown_reply(overrides) == "慢点"
+    assert limiter.cooldown_reply() == trigger_limiter.DEFAULT_RATE_LIMIT_CONFIG['cooldown_reply']
+    assert all(limiter.check('g1', 'u1', {"enabled": False}) == ALLOW for _ in range(10))
+
+
+def test_idle_buckets_expire(clock):
+    table = BucketTable(max_keys=100, idle_expiry=60)
+    table.get('a', 3, 0.1, clock.now)[0] -= 3
+    table.get('b', 3, 0.1, clock.now)
+    clock.advance(61)
+    # 新建状态时从最久未使用的一端清理过期状态
+    table.get('c', 3, 0.1, clock.now)
+    assert len(table) == 1
+    # 过期后重新开始时额度是满的(而不是按经过时间恢复)
+    assert table.get('a', 3, 0.0, clock.now)[0] == 3
+
+
+def test_lru_eviction_at_capacity(clock):
+    table = BucketTable(max_keys=2, idle_expiry=600)
+    table.get('a', 3, 0.1, clock.now)
+    table.get('b', 3, 0.1, clock.now)
+    table.get('a', 3, 0.1, clock.now)   # a变为最近使用
+    table.get('c', 3, 0.1, clock.now)
+    assert len(table) == 2
+    assert list(table._entries) == ['a', 'c']
+
+
+def test_limiter_tracks_bounded_keys(clock):
+    limiter = make_limiter(max_keys=10, idle_expiry=60)
+    for idx in range(50):
+        limiter.check(f'g{idx}', 'u1')
+    assert limiter.stats() == {"tracked_users": 10, "tracked_groups": 10}
+    clock.advance(61)
+    limiter.check('g-new', 'u1')
+    assert limiter.stats() == {"tracked_users": 1, "tracked_groups": 1}
@@ -0,0 +1,148 @@
+import pytest
+
+from usage_accounting import (UsageAccounting, hist_percentile, LATENCY_BUCKETS_MS,
+                              BUDGET_OK, BUDGET_DEGRADE, BUDGET_REFUSE)
+
+
+def make_hist(counts):
+    """
+    counts: {桶上界(毫秒)或None(更慢): 次数}
+    """
+    hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    for bound, count in counts.items():
+        hist[LATENCY_BUCKETS_MS.index(bound) if bound is not None else -1] = count
+    return hist
+
+
+def make_usage(tmp_path, **overrides):
+    return UsageAccounting({"path": str(tmp_path / 'usage.json'), **overrides})
+
+
+def test_hist_percentile():
+    assert hist_percentile(make_hist({}), 0.5) == 0
+    assert hist_percentile(make_hist({250: 10}), 0.99) == 250
+
+    hist = make_hist({100: 50, 1000: 45, 10000: 5})
+    assert hist_percentile(hist, 0.50) == 100
+    assert hist_percentile(hist, 0.51) == 1000
+    assert hist_percentile(hist, 0.95) == 1000
+    assert hist_percentile(hist, 0.99) == 10000
+    # 慢于最后一个边界的请求返回该边界
+    assert hist_percentile(make_hist({100: 1, None: 9}), 0.5) == LATENCY_BUCKETS_MS[-1]
+
+
+def test_record_and_query(tmp_path):
+    usage = make_usage(tmp_path)
+    usage.record('g1', 'app-a', 0.2, {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15,
+                                      "total_price": "0.001"})
+    usage.record('g1', 'app-b', 3.0, {"total_tokens": 100})
+    usage.record('g2', 'app-a', 0.05, error=True)
+
+    result = usage.query(hours=1)
+    assert result['by_group']['g1']['requests'] == 2
+    assert result['by_group']['g1']['total_tokens'] == 115
+    assert result['by_group']['g2']['errors'] == 1
+    assert result['by_app']['app-a']['requests'] == 2
+    assert result['by_app']['app-a']['total_price'] == 0.001
+    assert result['by_app']['app-b']['latency_ms'] == {"avg": 3000.0, "p50": 5000, "p95": 5000, "p99": 5000}
+    assert list(usage.query(hours=1, group='g2')['by_group']) == ['g2']
+
+
+def test_budget_degrade_and_refuse(tmp_path):
+    usage = make_usage(tmp_path, budgets={"g1": {"daily_tokens": 1000, "degrade_at": 0.5},
+                                          "*": {"daily_tokens": 100, "action": "degrade"}})
+    assert usage.check_budget('g1') == BUDGET_OK
+    usage.record('g1', 'app', 0.1, {"total_tokens": 499})
+    assert usage.check_budget('g1') == BUDGET_OK
+    usage.record('g1', 'app', 0.1, {"total_tokens": 1})
+    assert usage.check_budget('g1') == BUDGET_DEGRADE
+    usage.record('g1', 'app', 0.1, {"total_tokens": 500})
+    assert usage.check_budget('g1') == BUDGET_REFUSE
+
+    # 未单独配置的群使用"*"预算,超出后按action降级而不是拒绝
+    usage.record('g2', 'app', 0.1, {"total_tokens": 100})
+    assert usage.check_budget('g2') == BUDGET_DEGRADE
+    assert usage.query(hours=1)['budgets']['g1'] == {"used_tokens": 1000, "daily_tokens": 1000,
+                                                      "status": BUDGET_REFUSE}
+
+
+def test_budget_disabled_or_unset(tmp_path):
+    usage = make_usage(tmp_path)
+    usage.record('g1', 'app', 0.1, {"total_tokens": 10 ** 9})
+    assert usage.check_budget('g1') == BUDGET_OK
+    assert make_usage(tmp_path, enabled=False, budgets={"*": {"daily_tokens": 1}}).check_budget('g1') == BUDGET_OK
+
+
+def test_flush_and_reload_keeps_daily_tokens(tmp_path):
+    usage = make_usage(tmp_path, budgets={"g1": {"daily_tokens": 100}})
+    usage.record('g1', 'app', 0.1, {"total_tokens": 100})
+    usage.flush()
+
+    reloaded = make_usage(tmp_path, budgets={"g1": {"daily_tokens": 100}})
+    assert reloaded.check_budget('g1') == BUDGET_REFUSE
+    assert reloaded.query(hours=1)['by_group']['g1']['requests'] == 1
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload or {}
+
+    def raise_for_status(self):
+        import requests
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} error", response=self)
+
+    def json(self):
+        return self.payload
+
+
+class FakeDify:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def post(self, url, headers=None, json=None, timeout=None):
+        self.requests.append(json)
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def fake_dify(bridge, monkeypatch):
+    def install(responses):
+        dify = FakeDify(responses)
+        monkeypatch.setattr(bridge, 'http_session', dify)
+        return dify
+    return install
+
+
+def test_404_retry_is_recorded_once(bridge, fake_dify):
+    group = 'retry-once@chatroom'
+    bridge.bots.default.conversations[group] = 'stale-conversation'
+    dify = fake_dify([FakeResponse(404),
+                      FakeResponse(200, {"answer": "好的", "conversation_id": "new-conversation",
+                                         "metadata": {"usage": {"total_tokens": 42}}})])
+
+    assert bridge.send_to_dify("你好", group) == "好的"
+    assert [request['conversation_id'] for request in dify.requests] == ['stale-conversation', '']
+    summary = bridge.usage_accounting.query(hours=1, group=group)['by_group'][group]
+    assert (summary['requests'], summary['errors'], summary['total_tokens']) == (1, 0, 42)
+    assert bridge.bots.default.conversations[group] == 'new-conversation'
+
+
+def test_failed_404_retry_is_recorded_once(bridge, fake_dify):
+    group = 'retry-failed@chatroom'
+    bridge.bots.default.conversations[group] = 'stale-conversation'
+    fake_dify([FakeResponse(404), FakeResponse(500)])
+
+    assert bridge.send_to_dify("你好", group).startswith("unavailable:")
+    summary = bridge.usage_accounting.query(hours=1, group=group)['by_group'][group]
+    assert (summary['requests'], summary['errors']) == (1, 1)
+
+
+def test_other_http_error_is_recorded(bridge, fake_dify):
+    group = 'server-error@chatroom'
+    fake_dify([FakeResponse(500)])
+    assert bridge.send_to_dify("你好", group).startswith("unavailable:")
+    summary = bridge.usage_accounting.query(hours=1, group=group)['by_group'][group]
+    assert (summary['requests'], summary['errors']) == (1, 1)
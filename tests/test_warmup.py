@@ -0,0 +1,86 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip('requests')
+
+from warmup import create_session, origin_of, warm_up, Readiness
+
+
+class SlowHeadHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 保持连接,预热的连接才能留在连接池中
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.accepted += 1
+
+    def do_HEAD(self):
+        time.sleep(0.05)
+        self.send_response(405)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHeadHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.accepted = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_origin_of():
+    assert origin_of('https://api.dify.ai/v1/chat-messages') == 'https://api.dify.ai'
+    assert origin_of('http://127.0.0.1:7777/qianxun/httpapi?wxid=1') == 'http://127.0.0.1:7777'
+
+
+def test_warm_up_opens_several_pooled_connections(upstream):
+    server, base_url = upstream
+    session = create_session(pool_size=8)
+    results = warm_up(session, [base_url + '/v1/chat-messages', base_url + '/qianxun/httpapi'], connections=4)
+
+    assert list(results) == [base_url]
+    assert results[base_url]['ok'] and results[base_url]['connections'] == 4
+    assert results[base_url]['status'] == 405
+    assert server.accepted == 4
+
+    # 随后的并发请求复用预热好的连接,不再新建
+    threads = [threading.Thread(target=session.get, args=(base_url + '/v1/chat-messages',)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert server.accepted == 4
+
+
+def test_warm_up_reports_unreachable_origin(upstream):
+    _, base_url = upstream
+    results = warm_up(create_session(), [base_url + '/v1', 'http://127.0.0.1:9/api', None], timeout=1, connections=2)
+    assert results[base_url]['ok'] and results[base_url]['connections'] == 2
+    unreachable = results['http://127.0.0.1:9']
+    assert not unreachable['ok'] and unreachable['connections'] == 0 and unreachable['error']
+    assert warm_up(create_session(), []) == {}
+
+
+def test_readiness_stays_unready_while_draining():
+    readiness = Readiness()
+    readiness.mark_draining()
+    readiness.mark_ready()
+    assert readiness.snapshot()['ready'] is False
@@ -0,0 +1,87 @@
+import importlib
+import json
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def listener(tmp_path_factory):
+    # 模块导入时读取当前目录下的webhook_config.json,在临时目录中生成不聚合的配置
+    workdir = tmp_path_factory.mktemp('webhook')
+    config = {
+        "weixin": {"api_url": "http://127.0.0.1:9/qianxun/httpapi", "part_interval": 0},
+        "server": {"host": "127.0.0.1", "port": 0},
+        "default_route": "default",
+        "routes": {"default": {"bot_wxid": "wxid_bot", "targets": ["room@chatroom"], "batch_window": 0}}
+    }
+    (workdir / 'webhook_config.json').write_text(json.dumps(config), encoding='utf-8')
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(workdir)
+        sys.modules.pop('webhook_listener', None)
+        module = importlib.import_module('webhook_listener')
+    yield module
+    sys.modules.pop('webhook_listener', None)
+
+
+def test_extract_message_stringifies_structured_payloads(listener):
+    assert listener.extract_message({"message": "磁盘告警"}) == "磁盘告警"
+    assert listener.extract_message({"message": {"host": "db1"}}) == '{"host": "db1"}'
+    assert listener.extract_message({"msg": ["a", "b"]}) == '["a", "b"]'
+    assert listener.extract_message(["告警"]) == '["告警"]'
+
+
+def test_structured_message_does_not_kill_worker(listener, monkeypatch):
+    sent = []
+    sender = listener.routes['default']
+    monkeypatch.setattr(sender, 'send', sent.append)
+    client = listener.app.test_client()
+
+    for payload in ({"message": {"host": "db1"}}, {"message": ["a"]}, {"message": "磁盘告警"}):
+        assert client.post('/webhook', json=payload).status_code == 202
+    sender.queue.join()
+
+    assert sender.thread.is_alive()
+    assert sent == ['{"host": "db1"}', '["a"]', "磁盘告警"]
+
+
+def test_worker_survives_unhashable_message(listener, monkeypatch):
+    sent = []
+    sender = listener.routes['default']
+    monkeypatch.setattr(sender, 'send', sent.append)
+
+    sender.submit({"bypassed": "extract_message"})
+    sender.submit("磁盘告警")
+    sender.queue.join()
+
+    assert sender.thread.is_alive()
+    assert sent == ["磁盘告警"]
+
+
+def test_payload_logged_only_at_debug(listener, monkeypatch, caplog):
+    sender = listener.routes['default']
+    monkeypatch.setattr(sender, 'send', lambda message: None)
+    client = listener.app.test_client()
+    payload = {"event": "disk_full", "id": 42, "message": "db1 磁盘使用率 98%"}
+
+    with caplog.at_level('INFO', logger='webhook_listener'):
+        assert client.post('/webhook', json=payload).status_code == 202
+    info = [record.getMessage() for record in caplog.records]
+    assert any('event=disk_full id=42' in message for message in info)
+    assert not any('磁盘使用率' in message for message in info)
+
+    caplog.clear()
+    with caplog.at_level('DEBUG', logger='webhook_listener'):
+        assert client.post('/webhook', json=payload).status_code == 202
+    sender.queue.join()
+    debug = [record.getMessage() for record in caplog.records if record.levelname == 'DEBUG']
+    assert any('磁盘使用率' in message for message in debug)
+
+
+def test_summarize_payload(listener):
+    assert listener.summarize_payload({"type": "alert", "alert_id": "a-1", "message": "secret"}) == \
+        "type=alert alert_id=a-1"
+    assert listener.summarize_payload({"message": "secret", "host": "db1"}) == "(无事件类型/ID字段, 2个字段)"
+    assert listener.summarize_payload({"id": {"nested": "secret"}}) == "(无事件类型/ID字段, 1个字段)"
+    assert listener.summarize_payload(["secret"]) == "(list, 长度1)"
+    assert listener.summarize_payload(None) == "(空请求体)"
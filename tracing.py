@@ -0,0 +1,256 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TRACING_CONFIG = {
+    "enabled": True,
+    "buffer_size": 1000,  # 内存中保留最近的trace条数
+    "export_path": ""     # 非空时把每条trace的span以JSON行追加写入该文件(OpenTelemetry span字段)
+}
+
+# 当前线程正在处理的trace
+_local = threading.local()
+
+
+class Span:
+    """
+    一个阶段的耗时记录(基于monotonic时钟)
+    """
+
+    __slots__ = ('name', 'span_id', 'parent_id', 'start', 'end', 'attrs', 'status')
+
+    def __init__(self, name, start, parent_id=None, attrs=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = start
+        self.end = None
+        self.attrs = attrs or {}
+        self.status = 'ok'
+
+
+class Trace:
+    """
+    单条消息从回调到回复的完整链路
+    在wechat_callback中创建,随任务进入工作线程,各函数通过span()记录阶段耗时
+    """
+
+    def __init__(self, msg_id, wxid, **attrs):
+        self.trace_id = uuid.uuid4().hex
+        self.msg_id = msg_id
+        self.wxid = wxid
+        self.attrs = attrs
+        self.start_wall = time.time()
+        self.start = time.monotonic()
+        self.end = None
+        self.outcome = None
+        self.spans = []
+        self.queued_at = None
+        self._stack = []
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+    @contextmanager
+    def span(self, name, **attrs):
+        parent_id = self._stack[-1].span_id if self._stack else None
+        current = Span(name, time.monotonic(), parent_id, attrs)
+        self._stack.append(current)
+        try:
+            yield current
+        except BaseException:
+            current.status = 'error'
+            raise
+        finally:
+            current.end = time.monotonic()
+            self._stack.pop()
+            with self._lock:
+                self.spans.append(current)
+
+    def add_span(self, name, start, end, **attrs):
+        """
+        记录事后才知道起止时间的阶段(如排队等待)
+        """
+        recorded = Span(name, start, attrs=attrs)
+        recorded.end = end
+        with self._lock:
+            self.spans.append(recorded)
+
+    def set_outcome(self, outcome):
+        if self.outcome is None:
+            self.outcome = outcome
+
+    def finish(self, outcome=None):
+        if outcome:
+            self.set_outcome(outcome)
+        self.end = time.monotonic()
+
+    def stage_durations(self):
+        """
+        各阶段累计耗时(毫秒),同名阶段相加(如多张图片)
+        """
+        durations = defaultdict(float)
+        with self._lock:
+            for recorded in self.spans:
+                durations[recorded.name] += ((recorded.end or recorded.start) - recorded.start) * 1000
+        return {name: round(value, 1) for name, value in durations.items()}
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "msg_id": self.msg_id,
+            "wxid": self.wxid,
+            "outcome": self.outcome,
+            "start": self.start_wall,
+            "duration_ms": round(self.duration * 1000, 1),
+            "stages_ms": self.stage_durations(),
+            **self.attrs
+        }
+
+    def to_otel_spans(self):
+        """
+        转为OpenTelemetry span格式(根span + 各阶段span),时间为Unix纳秒
+        """
+        def to_unix_nano(monotonic_value):
+            return int((self.start_wall + (monotonic_value - self.start)) * 1e9)
+
+        root_id = uuid.uuid4().hex[:16]
+        root_attrs = {"msg_id": str(self.msg_id), "wxid": self.wxid, "outcome": self.outcome, **self.attrs}
+        spans = [{
+            "traceId": self.trace_id,
+            "spanId": root_id,
+            "parentSpanId": "",
+            "name": "wechat.message",
+            "startTimeUnixNano": to_unix_nano(self.start),
+            "endTimeUnixNano": to_unix_nano(self.end or time.monotonic()),
+            "attributes": root_attrs,
+            "status": "error" if self.outcome == 'error' else "ok"
+        }]
+        with self._lock:
+            recorded_spans = list(self.spans)
+        for recorded in recorded_spans:
+            spans.append({
+                "traceId": self.trace_id,
+                "spanId": recorded.span_id,
+                "parentSpanId": recorded.parent_id or root_id,
+                "name": recorded.name,
+                "startTimeUnixNano": to_unix_nano(recorded.start),
+                "endTimeUnixNano": to_unix_nano(recorded.end or recorded.start),
+                "attributes": recorded.attrs,
+                "status": recorded.status
+            })
+        return spans
+
+
+class TraceStore:
+    """
+    最近trace的环形缓冲区,可选导出到本地文件
+    """
+
+    def __init__(self, tracing_config=None):
+        tracing_config = {**DEFAULT_TRACING_CONFIG, **(tracing_config or {})}
+        self.enabled = tracing_config['enabled']
+        self.export_path = tracing_config['export_path']
+        self._traces = deque(maxlen=max(1, int(tracing_config['buffer_size'])))
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+
+    def start_trace(self, msg_id, wxid, **attrs):
+        """
+        创建trace;未启用时返回None,调用方的span()都会变成空操作
+        """
+        if not self.enabled:
+            return None
+        return Trace(msg_id, wxid, **attrs)
+
+    def add(self, trace):
+        if trace is None:
+            return
+        with self._lock:
+            self._traces.append(trace)
+        if self.export_path:
+            self._export(trace)
+
+    def _export(self, trace):
+        try:
+            lines = ''.join(json.dumps(span, ensure_ascii=False) + '\n' for span in trace.to_otel_spans())
+            with self._export_lock:
+                with open(self.export_path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+        except OSError as e:
+            logger.error("Failed to export trace %s: %s", trace.trace_id, e)
+
+    def query(self, slowest=20, group=None):
+        """
+        返回: 最慢的N条trace(可按群过滤)以及按群汇总的耗时
+        """
+        with self._lock:
+            traces = list(self._traces)
+
+        if group:
+            traces = [trace for trace in traces if trace.wxid == group]
+
+        by_group = defaultdict(list)
+        for trace in traces:
+            by_group[trace.wxid].append(trace.duration * 1000)
+
+        group_summary = {}
+        for wxid, durations in by_group.items():
+            durations.sort()
+            group_summary[wxid] = {
+                "count": len(durations),
+                "avg_ms": round(sum(durations) / len(durations), 1),
+                "p95_ms": round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 1),
+                "max_ms": round(durations[-1], 1)
+            }
+
+        slowest_traces = sorted(traces, key=lambda trace: trace.duration, reverse=True)[:slowest]
+        return {
+            "total": len(traces),
+            "slowest": [trace.to_dict() for trace in slowest_traces],
+            "by_group": group_summary
+        }
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def activate(trace):
+    """
+    在当前线程中设置正在处理的trace(跨线程传递时在工作线程中调用)
+    """
+    previous = getattr(_local, 'trace', None)
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    在当前trace中记录一个阶段;没有trace时不做任何事
+    """
+    trace = current_trace()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **attrs) as current:
+        yield current
+
+
+def set_outcome(outcome):
+    trace = current_trace()
+    if trace is not None:
+        trace.set_outcome(outcome)
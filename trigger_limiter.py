@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import metrics
+
+DEFAULT_RATE_LIMIT_CONFIG = {
+    "enabled": True,
+    "user_per_minute": 6,     # 同一群内单个成员每分钟最多触发次数
+    "user_burst": 3,          # 单个成员连续触发的突发上限
+    "group_per_minute": 30,   # 单个群每分钟最多触发次数
+    "group_burst": 10,
+    "action": "reply",        # 超出限制时: reply=回复冷却提示(同一成员每个冷却期只提示一次), drop=静默丢弃
+    "cooldown_reply": "你说得太快啦,请稍后再试~",
+    "max_keys": 10000,        # 内存中最多保留的限流状态条数(超过时淘汰最久未使用的)
+    "idle_expiry": 600        # 超过该秒数未触发的限流状态会被清理
+}
+
+# 检查结果
+ALLOW = 'allow'
+COOLDOWN_REPLY = 'reply'
+DROP = 'drop'
+
+
+class BucketTable:
+    """
+    按key保存令牌桶状态,容量有上限(LRU淘汰),长时间未访问的状态自动过期
+    调用方负责加锁
+    """
+
+    def __init__(self, max_keys, idle_expiry):
+        self.max_keys = max(1, int(max_keys))
+        self.idle_expiry = float(idle_expiry)
+        self._entries = OrderedDict()  # key -> [tokens, updated, last_notified]
+
+    def get(self, key, burst, rate, now):
+        entry = self._entries.get(key)
+        if entry is None or now - entry[1] > self.idle_expiry:
+            entry = [float(burst), now, None]
+            self._entries[key] = entry
+            self._evict(now)
+        else:
+            entry[0] = min(float(burst), entry[0] + (now - entry[1]) * rate)
+            entry[1] = now
+            self._entries.move_to_end(key)
+        return entry
+
+    def _evict(self, now):
+        # 先从最久未使用的一端清理过期状态,仍超出容量时直接淘汰
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if len(self._entries) > self.max_keys or now - entry[1] > self.idle_expiry:
+                self._entries.popitem(last=False)
+            else:
+                break
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TriggerLimiter:
+    """
+    群聊触发限流: 按(群, 成员)和按群两级令牌桶,在调用Dify之前检查
+    群级配置可在group_mapping对应群的rate_limit中覆盖
+    """
+
+    def __init__(self, rate_limit_config=None):
+        self.config = {**DEFAULT_RATE_LIMIT_CONFIG, **(rate_limit_config or {})}
+        self._lock = threading.Lock()
+        self._users = BucketTable(self.config['max_keys'], self.config['idle_expiry'])
+        self._groups = BucketTable(self.config['max_keys'], self.config['idle_expiry'])
+
+    def check(self, group_wxid, sender_wxid, overrides=None):
+        """
+        检查并消耗一次触发额度
+        :param overrides: 该群的限流配置(group_mapping中的rate_limit)
+        返回: ALLOW / COOLDOWN_REPLY / DROP
+        """
+        limits = {**self.config, **overrides} if overrides else self.config
+        if not limits['enabled']:
+            return ALLOW
+
+        user_rate = float(limits['user_per_minute']) / 60
+        group_rate = float(limits['group_per_minute']) / 60
+        now = time.monotonic()
+        with self._lock:
+            user = self._users.get((group_wxid, sender_wxid), limits['user_burst'], user_rate, now)
+            group = self._groups.get(group_wxid, limits['group_burst'], group_rate, now)
+
+            # 两级都有额度时才放行(同时扣减),避免被拒绝的请求白白消耗另一级额度
+            if user[0] >= 1 and group[0] >= 1:
+                user[0] -= 1
+                group[0] -= 1
+                return ALLOW
+
+            scope = 'user' if user[0] < 1 else 'group'
+            metrics.incr(f'rate_limit.limited.{scope}')
+            if limits['action'] != 'reply':
+                return DROP
+
+            # 冷却提示本身也要限流: 额度恢复前同一成员(成员超限)或同一群(群超限)只提示一次
+            limited, rate = (user, user_rate) if scope == 'user' else (group, group_rate)
+            cooldown = 1 / rate if rate > 0 else 60
+            if limited[2] is not None and now - limited[2] < cooldown:
+                return DROP
+            limited[2] = now
+            return COOLDOWN_REPLY
+
+    def cooldown_reply(self, overrides=None):
+        return (overrides or {}).get('cooldown_reply') or self.config['cooldown_reply']
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tracked_users": len(self._users),
+                "tracked_groups": len(self._groups)
+            }
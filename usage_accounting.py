@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_USAGE_CONFIG = {
+    "enabled": True,
+    "path": "dify_usage.json",   # 按小时汇总的用量文件
+    "flush_interval": 60,        # 写盘间隔(秒)
+    "retention_hours": 24 * 14,  # 保留的小时数
+    # 每个群(或好友wxid)的每日token预算,"*"为未单独配置时的默认值
+    # 用量达到 degrade_at*daily_tokens 后降级(要求简短回答),达到 daily_tokens 后执行action(refuse|degrade)
+    "budgets": {},
+    "degrade_prompt": "\n\n(请用不超过100字简短回答)",
+    "budget_reply": "今日额度已用完,请明天再来~"
+}
+
+# 延迟直方图的桶上界(毫秒),最后一个桶为"更慢"
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2000, 5000, 10000, 20000, 30000, 60000)
+
+USAGE_FIELDS = ('prompt_tokens', 'completion_tokens', 'total_tokens')
+
+# 预算检查结果
+BUDGET_OK = 'ok'
+BUDGET_DEGRADE = 'degrade'
+BUDGET_REFUSE = 'refuse'
+
+
+def new_bucket():
+    return {
+        "requests": 0,
+        "errors": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "total_tokens": 0,
+        "total_price": 0.0,
+        "latency_ms_sum": 0.0,
+        "latency_hist": [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    }
+
+
+def merge_bucket(target, source):
+    for key in ('requests', 'errors', 'prompt_tokens', 'completion_tokens', 'total_tokens',
+                'total_price', 'latency_ms_sum'):
+        target[key] += source[key]
+    target['latency_hist'] = [a + b for a, b in zip(target['latency_hist'], source['latency_hist'])]
+    return target
+
+
+def hist_percentile(hist, p):
+    """
+    从直方图估算分位数(返回所在桶的上界,慢于最后一个边界时返回该边界)
+    """
+    total = sum(hist)
+    if not total:
+        return 0
+    rank = total * p
+    seen = 0
+    for idx, count in enumerate(hist):
+        seen += count
+        if seen >= rank and count:
+            return LATENCY_BUCKETS_MS[min(idx, len(LATENCY_BUCKETS_MS) - 1)]
+    return LATENCY_BUCKETS_MS[-1]
+
+
+def summarize(bucket):
+    requests_count = bucket['requests']
+    return {
+        "requests": requests_count,
+        "errors": bucket['errors'],
+        "prompt_tokens": bucket['prompt_tokens'],
+        "completion_tokens": bucket['completion_tokens'],
+        "total_tokens": bucket['total_tokens'],
+        "total_price": round(bucket['total_price'], 6),
+        "latency_ms": {
+            "avg": round(bucket['latency_ms_sum'] / requests_count, 1) if requests_count else 0,
+            "p50": hist_percentile(bucket['latency_hist'], 0.50),
+            "p95": hist_percentile(bucket['latency_hist'], 0.95),
+            "p99": hist_percentile(bucket['latency_hist'], 0.99)
+        }
+    }
+
+
+def current_hour(now=None):
+    return time.strftime('%Y-%m-%dT%H', time.localtime(now))
+
+
+class UsageAccounting:
+    """
+    Dify调用用量统计: 按(小时, 群, 应用)汇总请求数、token、费用和延迟直方图
+    数据在内存中累加,后台线程定期整体写盘(原子替换),重启后从文件恢复
+    """
+
+    def __init__(self, usage_config=None):
+        usage_config = {**DEFAULT_USAGE_CONFIG, **(usage_config or {})}
+        self.enabled = usage_config['enabled']
+        self.path = usage_config['path']
+        self.flush_interval = float(usage_config['flush_interval'])
+        self.retention_hours = int(usage_config['retention_hours'])
+        self.budgets = usage_config['budgets']
+        self.degrade_prompt = usage_config['degrade_prompt']
+        self.budget_reply = usage_config['budget_reply']
+
+        self._lock = threading.Lock()
+        # {hour: {group: {app: bucket}}}
+        self._hours = defaultdict(lambda: defaultdict(dict))
+        # 当日每个群的token累计(用于预算检查),跨天时重置
+        self._day = time.strftime('%Y-%m-%d')
+        self._daily_tokens = defaultdict(int)
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+
+        if self.enabled:
+            self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("Failed to load usage file %s: %s", self.path, e)
+            return
+
+        today = time.strftime('%Y-%m-%d')
+        with self._lock:
+            for hour, groups in data.get('hours', {}).items():
+                for group, apps in groups.items():
+                    for app_name, bucket in apps.items():
+                        self._hours[hour][group][app_name] = merge_bucket(new_bucket(), bucket)
+                        if hour.startswith(today):
+                            self._daily_tokens[group] += bucket['total_tokens']
+        logger.info("Loaded Dify usage for %s hour(s) from %s", len(self._hours), self.path)
+
+    def flush(self):
+        """
+        把内存中的汇总写入文件(只在有新数据时写)
+        """
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._prune()
+            data = {"hours": {hour: {group: dict(apps) for group, apps in groups.items()}
+                              for hour, groups in self._hours.items()}}
+            payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+            self._dirty = False
+
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error("Failed to write usage file %s: %s", self.path, e)
+
+    def _prune(self):
+        cutoff = current_hour(time.time() - self.retention_hours * 3600)
+        for hour in [hour for hour in self._hours if hour < cutoff]:
+            del self._hours[hour]
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._flush_loop, name="usage-flush", daemon=True)
+        self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+    def record(self, group, app_name, latency_seconds, usage=None, error=False):
+        """
+        记录一次Dify调用
+        :param usage: Dify响应中的metadata.usage
+        """
+        if not self.enabled:
+            return
+        usage = usage or {}
+        latency_ms = latency_seconds * 1000
+        bucket_idx = len(LATENCY_BUCKETS_MS)
+        for idx, bound in enumerate(LATENCY_BUCKETS_MS):
+            if latency_ms <= bound:
+                bucket_idx = idx
+                break
+
+        hour = current_hour()
+        with self._lock:
+            apps = self._hours[hour][group]
+            bucket = apps.get(app_name)
+            if bucket is None:
+                bucket = apps[app_name] = new_bucket()
+            bucket['requests'] += 1
+            bucket['errors'] += 1 if error else 0
+            for field in USAGE_FIELDS:
+                bucket[field] += int(usage.get(field) or 0)
+            try:
+                bucket['total_price'] += float(usage.get('total_price') or 0)
+            except (TypeError, ValueError):
+                pass
+            bucket['latency_ms_sum'] += latency_ms
+            bucket['latency_hist'][bucket_idx] += 1
+
+            self._roll_day()
+            self._daily_tokens[group] += int(usage.get('total_tokens') or 0)
+            self._dirty = True
+
+    def _roll_day(self):
+        today = time.strftime('%Y-%m-%d')
+        if today != self._day:
+            self._day = today
+            self._daily_tokens.clear()
+
+    def budget_for(self, group):
+        return self.budgets.get(group) or self.budgets.get('*')
+
+    def check_budget(self, group):
+        """
+        返回: BUDGET_OK / BUDGET_DEGRADE / BUDGET_REFUSE
+        """
+        budget = self.budget_for(group)
+        if not self.enabled or not budget:
+            return BUDGET_OK
+        limit = int(budget.get('daily_tokens', 0))
+        if limit <= 0:
+            return BUDGET_OK
+
+        with self._lock:
+            self._roll_day()
+            used = self._daily_tokens.get(group, 0)
+        if used >= limit:
+            return BUDGET_REFUSE if budget.get('action', 'refuse') == 'refuse' else BUDGET_DEGRADE
+        if used >= limit * float(budget.get('degrade_at', 0.8)):
+            return BUDGET_DEGRADE
+        return BUDGET_OK
+
+    def query(self, hours=24, group=None):
+        """
+        返回最近N小时按群、按应用、按小时的汇总,以及当日预算使用情况
+        """
+        cutoff = current_hour(time.time() - (hours - 1) * 3600)
+        by_group = defaultdict(new_bucket)
+        by_app = defaultdict(new_bucket)
+        by_hour = defaultdict(new_bucket)
+        with self._lock:
+            for hour, groups in self._hours.items():
+                if hour < cutoff:
+                    continue
+                for group_wxid, apps in groups.items():
+                    if group and group_wxid != group:
+                        continue
+                    for app_name, bucket in apps.items():
+                        merge_bucket(by_group[group_wxid], bucket)
+                        merge_bucket(by_app[app_name], bucket)
+                        merge_bucket(by_hour[hour], bucket)
+            self._roll_day()
+            daily_tokens = dict(self._daily_tokens)
+
+        budgets = {}
+        for group_wxid in set(daily_tokens) | set(key for key in self.budgets if key != '*'):
+            budget = self.budget_for(group_wxid)
+            if budget and (not group or group_wxid == group):
+                budgets[group_wxid] = {
+                    "used_tokens": daily_tokens.get(group_wxid, 0),
+                    "daily_tokens": budget.get('daily_tokens', 0),
+                    "status": self.check_budget(group_wxid)
+                }
+
+        return {
+            "hours": hours,
+            "by_group": {key: summarize(bucket) for key, bucket in by_group.items()},
+            "by_app": {key: summarize(bucket) for key, bucket in by_app.items()},
+            "by_hour": {key: summarize(bucket) for key, bucket in sorted(by_hour.items())},
+            "budgets": budgets
+        }
@@ -0,0 +1,115 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WARMUP_CONFIG = {
+    "enabled": True,
+    "pool_size": 20,  # 每个上游地址保持的长连接数上限
+    "connections": 4, # 启动时每个上游预先建立的连接数(不超过pool_size)
+    "timeout": 5      # 预热请求超时(秒)
+}
+
+
+def create_session(pool_size=20):
+    """
+    创建带连接池的Session,Dify和千寻请求共用,避免每条消息重新建立TCP/TLS连接
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def origin_of(url):
+    """
+    返回: scheme://host:port,同一个上游只预热一次
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def warm_up(session, urls, timeout=5, connections=1):
+    """
+    对每个上游同时发送connections个轻量请求(HEAD /),完成DNS解析和TCP/TLS握手并把这些连接留在连接池中
+    请求同时发出,各自占用一个连接;所有上游并行预热。收到任何HTTP响应(包括404/405)都算成功
+    返回: {origin: {"ok": bool, "ms": 耗时, "connections": 成功数, "status"/"error": ...}}
+    """
+    origins = sorted({origin_of(url) for url in urls if url})
+    connections = max(1, int(connections))
+    if not origins:
+        return {}
+
+    def head(origin):
+        started_at = time.monotonic()
+        try:
+            status, error = session.head(origin + '/', timeout=timeout, allow_redirects=False).status_code, None
+        except requests.exceptions.RequestException as e:
+            status, error = None, str(e)
+        return status, error, time.monotonic() - started_at
+
+    with ThreadPoolExecutor(max_workers=len(origins) * connections, thread_name_prefix='warmup') as executor:
+        futures = {origin: [executor.submit(head, origin) for _ in range(connections)] for origin in origins}
+        results = {}
+        for origin, origin_futures in futures.items():
+            outcomes = [future.result() for future in origin_futures]
+            statuses = [status for status, _, _ in outcomes if status is not None]
+            results[origin] = {"ok": bool(statuses), "connections": len(statuses),
+                               "ms": round(max(elapsed for _, _, elapsed in outcomes) * 1000, 1)}
+            if statuses:
+                results[origin]["status"] = statuses[0]
+                logger.info("Warmed up %s connection(s) to %s in %sms", len(statuses), origin, results[origin]["ms"])
+            else:
+                results[origin]["error"] = outcomes[0][1]
+                logger.warning("Failed to warm up connection to %s: %s", origin, results[origin]["error"])
+    return results
+
+
+class Readiness:
+    """
+    就绪状态: 启动时的各项准备工作全部完成后才算就绪
+    与存活检查(/)分开,负载均衡应使用/ready
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ready = False
+        self.draining = False
+        self.started = time.monotonic()
+        self.ready_after = None
+        self.checks = {}
+
+    def set_check(self, name, ok, **detail):
+        with self._lock:
+            self.checks[name] = {"ok": ok, **detail}
+
+    def mark_ready(self):
+        with self._lock:
+            if self.draining:
+                return
+            self.ready = True
+            self.ready_after = round(time.monotonic() - self.started, 3)
+
+    def mark_draining(self):
+        """
+        退出前排空: 此后一直返回未就绪,负载均衡不再转发新请求
+        """
+        with self._lock:
+            self.draining = True
+            self.ready = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "draining": self.draining,
+                "ready_after_seconds": self.ready_after,
+                "checks": dict(self.checks)
+            }
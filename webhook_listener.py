@@ -1,8 +1,16 @@
 from flask import Flask, request, jsonify
-import requests
+import json
 import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 
+from qianxun_client import QianxunClient, is_success
+from message_splitter import split_message, send_parts, DEFAULT_MAX_BYTES, DEFAULT_PART_INTERVAL
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -12,78 +20,263 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# 配置常量
-WECHAT_API_URL = "http://127.0.0.1:7777/qianxun/httpapi"
-ROBOT_WXID = "wxid_alwc6m6hw4rs22"
-TARGET_WXID = "48683142917@chatroom"
-
 
-def send_wechat_message(message):
+def load_config():
     """
-    发送消息到微信API
-    
-    Args:
-        message: 要发送的消息内容
-        
-    Returns:
-        dict: API响应结果
+    加载转发服务配置文件,如果不存在则使用默认配置
+    routes中每一项对应一个 /webhook/<name> 端点
+    batch_window: 聚合窗口(秒),窗口内的消息去重合并为一条发送,0表示不聚合
+    batch_max_messages: 窗口内最多聚合的消息条数,达到后立即发送
     """
-    try:
-        # 构造请求URL
-        url = f"{WECHAT_API_URL}?wxid={ROBOT_WXID}"
-        
-        # 构造请求体
-        payload = {
-            "type": "sendText2",
-            "data": {
-                "wxid": TARGET_WXID,
-                "msg": message
+    config_path = 'webhook_config.json'
+    default_config = {
+        "weixin": {
+            "api_url": "http://127.0.0.1:7777/qianxun/httpapi",
+            "timeout": 10,
+            "pool_size": 10,
+            "max_message_bytes": DEFAULT_MAX_BYTES,  # 超出则按行/句子拆分发送
+            "part_interval": DEFAULT_PART_INTERVAL
+        },
+        "server": {
+            "host": "0.0.0.0",
+            "port": 5000
+        },
+        "default_route": "default",  # /webhook 和 /test 使用的路由
+        "routes": {
+            "default": {
+                "bot_wxid": "wxid_alwc6m6hw4rs22",
+                "targets": ["48683142917@chatroom"],
+                "description": "默认告警群",
+                "batch_window": 10,
+                "batch_max_messages": 50
+            },
+            "iwintrue": {
+                "bot_wxid": "wxid_alwc6m6hw4rs22",
+                "targets": ["48138693151@chatroom"],
+                "description": "原 webhook_listener.iwintrue.py (5001端口) 的告警群",
+                "batch_window": 10,
+                "batch_max_messages": 50
             }
         }
-        
-        # 发送POST请求
-        logger.info(f"发送消息到微信API: {message[:50]}...")
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
-        
-        result = response.json()
-        logger.info(f"消息发送成功，响应: {result}")
-        return result
-        
-    except requests.exceptions.RequestException as e:
-        logger.error(f"发送消息失败: {str(e)}")
-        return {"error": str(e)}
+    }
+
+    try:
+        if os.path.exists(config_path):
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+                logger.info(f"Configuration loaded from {config_path}")
+                return config
+        else:
+            # 创建默认配置文件
+            with open(config_path, 'w', encoding='utf-8') as f:
+                json.dump(default_config, f, ensure_ascii=False, indent=2)
+            logger.info(f"Default configuration file created at {config_path}")
+            return default_config
+    except Exception as e:
+        logger.error(f"Failed to load config file: {str(e)}, using default config")
+        return default_config
+
+
+config = load_config()
+
+# 所有路由共用一个千寻客户端(共享连接池)
+weixin_config = config['weixin']
+qianxun = QianxunClient(
+    weixin_config['api_url'],
+    timeout=weixin_config.get('timeout', 10),
+    pool_size=weixin_config.get('pool_size', 10)
+)
+MAX_MESSAGE_BYTES = weixin_config.get('max_message_bytes', DEFAULT_MAX_BYTES)
+PART_INTERVAL = weixin_config.get('part_interval', DEFAULT_PART_INTERVAL)
+
+
+def merge_messages(counts):
+    """
+    合并一个聚合窗口内的消息
+    :param counts: OrderedDict {消息内容: 重复次数},保持首次出现的顺序
+    返回: 合并后的单条消息
+    """
+    if len(counts) == 1:
+        message, count = next(iter(counts.items()))
+        return message if count == 1 else f"{message}\n(重复 {count} 次)"
+
+    total = sum(counts.values())
+    parts = [f"【告警汇总】共 {total} 条，去重后 {len(counts)} 条"]
+    for message, count in counts.items():
+        parts.append(message if count == 1 else f"{message}\n(重复 {count} 次)")
+    return '\n\n'.join(parts)
+
+
+class RouteSender:
+    """
+    单个路由的发送队列
+    每个路由一个后台线程按顺序发送,不同路由互不阻塞;
+    告警风暴时在聚合窗口内去重合并,多条webhook只发送一条微信消息
+    """
+
+    def __init__(self, name, route_config):
+        self.name = name
+        self.bot_wxid = route_config['bot_wxid']
+        self.targets = route_config.get('targets', [])
+        self.description = route_config.get('description', '')
+        self.batch_window = float(route_config.get('batch_window', 0))
+        self.batch_max_messages = max(1, int(route_config.get('batch_max_messages', 50)))
+        self.queue = queue.Queue(maxsize=route_config.get('max_queue', 1000))
+        self.received = 0
+        self.sent_batches = 0
+        self.thread = threading.Thread(target=self._worker_loop, name=f"route-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, message):
+        """
+        将消息放入发送队列,由后台线程聚合后发送
+        队列已满时抛出queue.Full
+        """
+        self.queue.put_nowait(message)
+        self.received += 1
+
+    def _collect_batch(self):
+        """
+        阻塞等待第一条消息,然后在聚合窗口内继续收集,直到窗口结束或达到条数上限
+        返回: 收集到的消息列表(按到达顺序)
+        """
+        messages = [self.queue.get()]
+
+        deadline = time.monotonic() + self.batch_window
+        while len(messages) < self.batch_max_messages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                messages.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return messages
+
+    def _worker_loop(self):
+        while True:
+            messages = self._collect_batch()
+            try:
+                # 去重计数也在try中: 任何异常只丢弃这一批,不能让后台线程退出
+                counts = OrderedDict()
+                for message in messages:
+                    counts[message] = counts.get(message, 0) + 1
+                if len(messages) > 1:
+                    logger.info(f"[{self.name}] 聚合 {len(messages)} 条消息(去重后 {len(counts)} 条)")
+                self.send(merge_messages(counts))
+                self.sent_batches += 1
+            except Exception as e:
+                logger.error(f"[{self.name}] 发送消息异常: {str(e)}")
+            finally:
+                for _ in messages:
+                    self.queue.task_done()
+
+    def send(self, message):
+        """
+        发送消息到该路由的所有目标群,超长消息拆分后按顺序发送
+        返回: {target_wxid: [每个分段的千寻响应]}
+        """
+        parts = split_message(message, MAX_MESSAGE_BYTES)
+        results = {}
+        for target_wxid in self.targets:
+            logger.info(f"[{self.name}] 发送消息到 {target_wxid} (共{len(parts)}段): {message[:50]}...")
+            target_results = []
+
+            def send_part(part):
+                result = qianxun.send_text(self.bot_wxid, target_wxid, part)
+                target_results.append(result)
+                return is_success(result)
+
+            send_parts(parts, send_part, interval=PART_INTERVAL)
+            logger.info(f"[{self.name}] 微信API响应: {target_results}")
+            results[target_wxid] = target_results
+        return results
+
+
+routes = {name: RouteSender(name, route_config) for name, route_config in config['routes'].items()}
+DEFAULT_ROUTE = config.get('default_route', 'default')
+
+
+# INFO日志只记录这些字段(事件类型和ID),完整请求体只在DEBUG级别记录,避免告警内容写进日志
+PAYLOAD_SUMMARY_KEYS = ('event', 'event_type', 'type', 'status', 'id', 'event_id', 'alert_id', 'msgId', 'request_id')
+
+
+def summarize_payload(data):
+    """
+    请求体摘要: 对象只保留事件类型和ID字段,其他JSON只记录类型和长度
+    """
+    if isinstance(data, dict):
+        fields = [f"{key}={data[key]}" for key in PAYLOAD_SUMMARY_KEYS
+                  if isinstance(data.get(key), (str, int, float))]
+        return ' '.join(fields) or f"(无事件类型/ID字段, {len(data)}个字段)"
+    if data is None:
+        return "(空请求体)"
+    length = f", 长度{len(data)}" if isinstance(data, (str, list)) else ""
+    return f"({type(data).__name__}{length})"
+
+
+def extract_message(data):
+    """
+    从webhook请求体中提取消息内容(根据实际webhook格式调整)
+    这里假设消息在 data['message'] / data['msg'] / data['content'] 字段
+    """
+    if not isinstance(data, dict):
+        # 请求体为数组/字符串等非对象JSON
+        return data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+
+    message = data.get('message') or data.get('msg') or data.get('content')
+
+    if not message:
+        # 如果没有找到消息字段，尝试将整个数据转为字符串
+        message = str(data)
+    elif not isinstance(message, str):
+        # 字段为对象/数组时转为JSON文本,聚合去重需要可哈希的字符串
+        message = json.dumps(message, ensure_ascii=False)
+
+    return message
+
+
+def forward_to_route(route_name, message):
+    """
+    将消息放入指定路由的发送队列,立即返回,聚合发送在后台完成
+    返回: (响应体, HTTP状态码)
+    """
+    sender = routes.get(route_name)
+    if sender is None:
+        return {"status": "error", "message": f"未知路由: {route_name}"}, 404
+
+    try:
+        sender.submit(message)
+    except queue.Full:
+        logger.error(f"[{route_name}] 发送队列已满，拒绝消息")
+        return {"status": "error", "message": "发送队列已满"}, 503
+
+    return {
+        "status": "accepted",
+        "message": "消息已进入发送队列",
+        "route": route_name
+    }, 202
 
 
 @app.route('/webhook', methods=['POST'])
-def webhook_listener():
+@app.route('/webhook/<route_name>', methods=['POST'])
+def webhook_listener(route_name=None):
     """
     Webhook监听端点
-    接收POST请求，提取消息内容并转发
+    接收POST请求，提取消息内容并转发到路由配置的目标群
+    /webhook 使用default_route
     """
+    route_name = route_name or DEFAULT_ROUTE
     try:
         # 获取请求数据
         data = request.get_json()
-        logger.info(f"收到webhook消息: {data}")
-        
-        # 提取消息内容（根据实际webhook格式调整）
-        # 这里假设消息在 data['message'] 或 data['msg'] 字段
-        message = data.get('message') or data.get('msg') or data.get('content')
-        
-        if not message:
-            # 如果没有找到消息字段，尝试将整个数据转为字符串
-            message = str(data)
-        
-        # 转发消息到微信
-        result = send_wechat_message(message)
-        
-        # 返回响应
-        return jsonify({
-            "status": "success",
-            "message": "消息已转发",
-            "wechat_response": result
-        }), 200
-        
+        logger.info(f"[{route_name}] 收到webhook消息: {summarize_payload(data)}")
+        logger.debug("[%s] webhook请求体: %s", route_name, data)
+
+        message = extract_message(data)
+        body, status_code = forward_to_route(route_name, message)
+        return jsonify(body), status_code
+
     except Exception as e:
         logger.error(f"处理webhook请求失败: {str(e)}")
         return jsonify({
@@ -97,30 +290,49 @@ def health_check():
     """健康检查端点"""
     return jsonify({
         "status": "running",
-        "timestamp": datetime.now().isoformat()
+        "timestamp": datetime.now().isoformat(),
+        "routes": {
+            name: {
+                "targets": sender.targets,
+                "queued": sender.queue.qsize(),
+                "received": sender.received,
+                "sent_batches": sender.sent_batches
+            }
+            for name, sender in routes.items()
+        }
     }), 200
 
 
 @app.route('/test', methods=['POST'])
-def test_send():
+@app.route('/test/<route_name>', methods=['POST'])
+def test_send(route_name=None):
     """
-    测试端点，用于手动测试消息发送
+    测试端点，用于手动测试消息发送(不经过聚合,直接同步发送)
     POST数据格式: {"message": "测试消息"}
     """
+    route_name = route_name or DEFAULT_ROUTE
+    sender = routes.get(route_name)
+    if sender is None:
+        return jsonify({"error": f"未知路由: {route_name}"}), 404
     try:
         data = request.get_json()
         message = data.get('message', '这是一条测试消息')
-        result = send_wechat_message(message)
+        result = sender.send(message)
         return jsonify(result), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 if __name__ == '__main__':
-    logger.info("启动Webhook监听服务...")
-    logger.info(f"监听地址: http://0.0.0.0:5000/webhook")
-    logger.info(f"健康检查: http://0.0.0.0:5000/health")
-    logger.info(f"测试接口: http://0.0.0.0:5000/test")
-    
+    host = config['server']['host']
+    port = config['server']['port']
+
+    logger.info("启动Webhook转发服务...")
+    logger.info(f"默认路由: http://{host}:{port}/webhook -> {DEFAULT_ROUTE}")
+    for name, sender in routes.items():
+        logger.info(f"  路由 http://{host}:{port}/webhook/{name} -> {', '.join(sender.targets)} ({sender.description})")
+    logger.info(f"健康检查: http://{host}:{port}/health")
+    logger.info(f"测试接口: http://{host}:{port}/test")
+
     # 启动Flask应用
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host=host, port=port, debug=False)